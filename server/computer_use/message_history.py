@@ -0,0 +1,200 @@
+"""
+In-process cache of job message histories for the sampling loop.
+
+The sampling loop sends the complete message history to the model in every
+iteration. Instead of reading it back from the database each time, the loop
+appends every message it persists to this cache and only reads the database
+when a job starts or resumes, or after its history was evicted.
+
+Messages are cached in their stored form (screenshots as blob references) and
+rehydrated when the history is handed to the loop. Screenshots that the
+_maybe_filter_to_n_most_recent_images policy would drop are removed from the
+cached history, so they are never loaded from the blob store again.
+
+The cache is bounded by settings.MESSAGE_HISTORY_CACHE_MAX_BYTES (estimated
+from the serialized size of the messages); least recently used histories are
+evicted first.
+"""
+
+import json
+import logging
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+from uuid import UUID
+
+from anthropic.types.beta import BetaMessageParam
+
+from server.settings import settings
+from server.utils.blob_store import rehydrate_images
+
+from .utils import _maybe_filter_to_n_most_recent_images
+
+logger = logging.getLogger(__name__)
+
+
+def _message_size(content: Any) -> int:
+    try:
+        return len(json.dumps(content, default=str))
+    except (TypeError, ValueError):
+        return 0
+
+
+def _count_images(messages: List[Dict[str, Any]]) -> int:
+    return sum(
+        1
+        for message in messages
+        for item in (message['content'] if isinstance(message['content'], list) else [])
+        if isinstance(item, dict) and item.get('type') == 'tool_result'
+        for content in (item.get('content') or [])
+        if isinstance(content, dict) and content.get('type') == 'image'
+    )
+
+
+class _JobHistory:
+    def __init__(self):
+        # Stored (dehydrated) messages: {'role': ..., 'content': ...}
+        self.messages: List[Dict[str, Any]] = []
+        self.sizes: List[int] = []
+        self.last_sequence = 0
+
+    @property
+    def size(self) -> int:
+        return sum(self.sizes)
+
+    def append(self, sequence: int, role: str, content: Any):
+        self.messages.append({'role': role, 'content': content})
+        self.sizes.append(_message_size(content))
+        self.last_sequence = sequence
+
+
+class MessageHistoryCache:
+    """LRU cache of job message histories, bounded by estimated size in bytes."""
+
+    def __init__(self, max_bytes: int):
+        self._max_bytes = max_bytes
+        self._histories: OrderedDict[str, _JobHistory] = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def load(self, job_id: UUID, db_messages: List[Dict[str, Any]]):
+        """Replace the cached history of a job with messages read from the database."""
+        history = _JobHistory()
+        for message in db_messages:
+            history.append(
+                message['sequence'], message['role'], message['message_content']
+            )
+        with self._lock:
+            self._discard(str(job_id))
+            self._histories[str(job_id)] = history
+            self._size += history.size
+            self._evict()
+
+    def append(self, job_id: UUID, sequence: int, role: str, content: Any):
+        """Add a message that was just persisted to the job's cached history.
+
+        If the job's history is not cached, or the message does not directly
+        follow the cached ones, the history is dropped and reloaded on next read.
+        """
+        job_key = str(job_id)
+        with self._lock:
+            history = self._histories.get(job_key)
+            if history is None:
+                return
+            if sequence != history.last_sequence + 1:
+                logger.warning(
+                    f'Job {job_id}: message seq {sequence} does not follow cached seq {history.last_sequence}, dropping cached history'
+                )
+                self._discard(job_key)
+                return
+            history.append(sequence, role, content)
+            self._size += history.sizes[-1]
+            self._histories.move_to_end(job_key)
+            self._evict()
+
+    def last_sequence(self, job_id: UUID) -> Optional[int]:
+        with self._lock:
+            history = self._histories.get(str(job_id))
+            return history.last_sequence if history is not None else None
+
+    def get_messages(
+        self,
+        job_id: UUID,
+        images_to_keep: Optional[int] = None,
+        min_removal_threshold: int = 1,
+    ) -> Optional[List[BetaMessageParam]]:
+        """Return the job's history ready to be sent to the model, or None on a miss.
+
+        Args:
+            images_to_keep: Drop all but this many most recent screenshots from
+                the cached history before rehydrating it.
+            min_removal_threshold: Only drop screenshots in chunks of this size,
+                like _maybe_filter_to_n_most_recent_images.
+        """
+        job_key = str(job_id)
+        with self._lock:
+            history = self._histories.get(job_key)
+            if history is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._histories.move_to_end(job_key)
+
+            if images_to_keep and _count_images(history.messages) > images_to_keep:
+                # The messages are our own copies, so they can be filtered in place
+                _maybe_filter_to_n_most_recent_images(
+                    history.messages,
+                    images_to_keep,
+                    min_removal_threshold=min_removal_threshold,
+                )
+                old_size = history.size
+                history.sizes = [
+                    _message_size(message['content']) for message in history.messages
+                ]
+                self._size += history.size - old_size
+
+            messages = list(history.messages)
+
+        # Rehydrate outside the lock, this may read screenshots from the blob store
+        return [
+            BetaMessageParam(
+                role=message['role'], content=rehydrate_images(message['content'])
+            )
+            for message in messages
+        ]
+
+    def discard(self, job_id: UUID):
+        with self._lock:
+            self._discard(str(job_id))
+
+    def _discard(self, job_key: str):
+        history = self._histories.pop(job_key, None)
+        if history is not None:
+            self._size -= history.size
+
+    def _evict(self):
+        # Always keep the most recently used history, even if it alone is too large
+        while self._size > self._max_bytes and len(self._histories) > 1:
+            job_key, history = self._histories.popitem(last=False)
+            self._size -= history.size
+            self.evictions += 1
+            logger.info(f'Evicted cached message history of job {job_key}')
+
+    def metrics(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                'jobs': len(self._histories),
+                'size_bytes': self._size,
+                'max_bytes': self._max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+            }
+
+
+message_history_cache = MessageHistoryCache(
+    max_bytes=settings.MESSAGE_HISTORY_CACHE_MAX_BYTES
+)
@@ -0,0 +1,129 @@
+"""
+Process-wide registry of model provider clients.
+
+Creating a new client for every model call throws away its HTTP connection
+pool, and with it open connections and TLS sessions. Clients are instead
+created once per provider and credentials and shared by all jobs. When the
+credentials of a provider change (via the settings routes), the next call
+creates a new client. The old one is closed as soon as no call uses it any
+more, so its connections don't linger until garbage collection.
+
+Every acquire_provider_client() must be paired with release_provider_client()
+once the call is done.
+"""
+
+import asyncio
+from typing import Any, Dict, Set, Tuple
+
+from anthropic import AsyncAnthropic, AsyncAnthropicBedrock, AsyncAnthropicVertex
+
+from server.computer_use.config import APIProvider
+from server.computer_use.logging import logger
+from server.settings import settings
+
+ProviderClient = AsyncAnthropic | AsyncAnthropicBedrock | AsyncAnthropicVertex
+
+# (provider, credentials) -> client
+_clients: Dict[Tuple[Any, ...], ProviderClient] = {}
+# id(client) -> number of calls using it
+_users: Dict[int, int] = {}
+# id(client) -> replaced client, closed when its last call releases it
+_retired: Dict[int, ProviderClient] = {}
+_close_tasks: Set[asyncio.Task] = set()
+
+
+def _client_kwargs(provider: APIProvider, api_key: str) -> Dict[str, Any]:
+    """Return the client constructor arguments from the current settings."""
+    if provider == APIProvider.ANTHROPIC:
+        return {'api_key': api_key, 'max_retries': 4}
+
+    if provider == APIProvider.VERTEX:
+        # Unset values fall back to the CLOUD_ML_REGION and
+        # ANTHROPIC_VERTEX_PROJECT_ID environment variables
+        vertex_kwargs = {}
+        if settings.VERTEX_REGION:
+            vertex_kwargs['region'] = settings.VERTEX_REGION
+        if settings.VERTEX_PROJECT_ID:
+            vertex_kwargs['project_id'] = settings.VERTEX_PROJECT_ID
+        return vertex_kwargs
+
+    if provider == APIProvider.BEDROCK:
+        # AWS credentials may also be set in environment variables
+        # by the server.py initialization
+        bedrock_kwargs = {'aws_region': settings.AWS_REGION}
+        if settings.AWS_ACCESS_KEY_ID and settings.AWS_SECRET_ACCESS_KEY:
+            bedrock_kwargs['aws_access_key'] = settings.AWS_ACCESS_KEY_ID
+            bedrock_kwargs['aws_secret_key'] = settings.AWS_SECRET_ACCESS_KEY
+            if settings.AWS_SESSION_TOKEN:
+                bedrock_kwargs['aws_session_token'] = settings.AWS_SESSION_TOKEN
+        return bedrock_kwargs
+
+    raise ValueError(f'Unsupported provider: {provider}')
+
+
+async def _close(client: ProviderClient):
+    try:
+        await client.close()
+    except Exception as e:
+        logger.warning(f'Failed to close replaced provider client: {str(e)}')
+
+
+def _close_when_idle(client: ProviderClient):
+    """Close a client that is no longer handed out, once no call uses it."""
+    if _users.get(id(client)):
+        _retired[id(client)] = client
+        return
+    try:
+        task = asyncio.get_running_loop().create_task(_close(client))
+    except RuntimeError:
+        # No event loop to close it on, left to garbage collection
+        return
+    _close_tasks.add(task)
+    task.add_done_callback(_close_tasks.discard)
+
+
+def _create_client(provider: APIProvider, kwargs: Dict[str, Any]) -> ProviderClient:
+    if provider == APIProvider.ANTHROPIC:
+        client = AsyncAnthropic(**kwargs)
+    elif provider == APIProvider.VERTEX:
+        client = AsyncAnthropicVertex(**kwargs)
+    else:
+        client = AsyncAnthropicBedrock(**kwargs)
+        logger.info(
+            f'Using AsyncAnthropicBedrock client with region: {kwargs["aws_region"]}'
+        )
+    logger.info(f'Created {provider} client')
+    return client
+
+
+def acquire_provider_client(provider: APIProvider, api_key: str = '') -> ProviderClient:
+    """Return the shared client for a provider and its current credentials."""
+    kwargs = _client_kwargs(provider, api_key)
+    key = (provider, *sorted(kwargs.items()))
+
+    client = _clients.get(key)
+    if client is None:
+        # Retire clients created with outdated credentials of this provider
+        for old_key in [k for k in _clients if k[0] == provider]:
+            _close_when_idle(_clients.pop(old_key))
+        client = _clients[key] = _create_client(provider, kwargs)
+    _users[id(client)] = _users.get(id(client), 0) + 1
+    return client
+
+
+def release_provider_client(client: ProviderClient):
+    """Mark a call using client as done."""
+    users = _users.get(id(client), 0) - 1
+    if users > 0:
+        _users[id(client)] = users
+        return
+    _users.pop(id(client), None)
+    retired = _retired.pop(id(client), None)
+    if retired is not None:
+        _close_when_idle(retired)
+
+
+def clear_provider_clients():
+    """Retire all clients, e.g. after the provider settings were changed."""
+    for key in list(_clients):
+        _close_when_idle(_clients.pop(key))
@@ -0,0 +1,371 @@
+"""
+Recording and replay of API trajectories.
+
+Jobs of the same API definition version usually click through the same
+screens. When a job succeeds, the computer actions it performed are recorded
+as the trajectory of its API version and parameter names, together with a
+fingerprint of every screenshot the model saw (see screen_fingerprint()).
+Text that was typed from job parameters is recorded as a template
+(${parameter}), so the trajectory applies to other parameter values. Other
+typed text is only recorded if it is a constant from the prompt, the
+trajectory ends at text the model came up with (e.g. read from the screen).
+
+A later job with the same API version and parameter names replays the
+recorded actions directly through ToolCollection.run, without calling the
+model. At every recorded screenshot the current screen is compared with the
+recorded fingerprint. Replay stops
+- when the screen diverges from the recording,
+- when an action fails, or
+- where the model used another tool (e.g. extraction),
+and the sampling loop continues from there, with the replayed actions and
+their results in the job's message history.
+
+Enabled with settings.TRAJECTORY_REPLAY_ENABLED.
+"""
+
+import asyncio
+import base64
+import io
+import re
+from string import Template
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+from uuid import UUID
+
+from anthropic.types.beta import BetaMessageParam
+from PIL import Image
+
+from server.computer_use.logging import logger
+from server.computer_use.message_history import message_history_cache
+from server.computer_use.sampling_loop import _run_tool_use
+from server.computer_use.tools import (
+    TOOL_GROUPS_BY_VERSION,
+    ToolCollection,
+    ToolResult,
+    ToolVersion,
+)
+from server.computer_use.tools.screenshot import (
+    fingerprint_distance,
+    reset_screen_history,
+    screen_fingerprint,
+)
+from server.computer_use.utils import (
+    _beta_message_param_to_job_message_content,
+    _make_api_tool_result,
+    _run_callback,
+)
+from server.database.service import DatabaseService
+from server.settings import settings
+from server.utils.blob_store import is_blob_ref, load_blob
+
+# Only the computer tool is replayed, the trajectory ends at any other tool
+REPLAYED_TOOL = 'computer'
+
+# Parameter values shorter than this are only templated if they make up the
+# whole typed text, so e.g. '1' is not replaced inside other text
+MIN_TEMPLATE_VALUE_LENGTH = 3
+
+# An escaped '$' or a ${name} placeholder in a template
+_TEMPLATE_TOKEN = re.compile(r'\$\$|\$\{[^}]*\}')
+
+
+def parameter_template(parameters: Dict[str, Any]) -> str:
+    """Return the key of the trajectories that apply to a job's parameters."""
+    return ','.join(sorted(parameters))
+
+
+def _template_text(text: str, parameters: Dict[str, Any]) -> str:
+    """Replace parameter values in typed text by ${name} placeholders."""
+    values = {}
+    for name, value in parameters.items():
+        value = str(value)
+        if value == text or len(value) >= MIN_TEMPLATE_VALUE_LENGTH:
+            values.setdefault(value, name)
+    if not values:
+        return text.replace('$', '$$')
+
+    # Longest values first, so a value containing another one wins
+    pattern = re.compile(
+        '|'.join(re.escape(value) for value in sorted(values, key=len, reverse=True))
+    )
+    parts = []
+    position = 0
+    for match in pattern.finditer(text):
+        parts.append(text[position : match.start()].replace('$', '$$'))
+        parts.append(f'${{{values[match.group()]}}}')
+        position = match.end()
+    parts.append(text[position:].replace('$', '$$'))
+    return ''.join(parts)
+
+
+def _template_literals(template: str) -> List[str]:
+    """Return the constant parts of a template, split at its placeholders."""
+    literals = ['']
+    position = 0
+    for match in _TEMPLATE_TOKEN.finditer(template):
+        literals[-1] += template[position : match.start()]
+        if match.group() == '$$':
+            literals[-1] += '$'
+        else:
+            literals.append('')
+        position = match.end()
+    literals[-1] += template[position:]
+    return literals
+
+
+def _is_replayable_text(template: str, prompt_constants: str) -> bool:
+    """Whether typed text (as template) only consists of parameter placeholders
+    and constants from the prompt, i.e. is the same for other parameter values."""
+    return all(
+        not literal.strip() or literal.strip() in prompt_constants
+        for literal in _template_literals(template)
+    )
+
+
+def _message_text(content: Any) -> str:
+    if isinstance(content, str):
+        return content
+    return '\n\n'.join(
+        block.get('text', '')
+        for block in content or []
+        if isinstance(block, dict) and block.get('type') == 'text'
+    )
+
+
+def _fingerprint_image_data(data: str) -> str:
+    """Fingerprint a stored (blob reference) or base64 encoded screenshot."""
+    raw = load_blob(data) if is_blob_ref(data) else base64.b64decode(data)
+    return screen_fingerprint(Image.open(io.BytesIO(raw)))
+
+
+def _result_image_data(tool_result: Dict[str, Any]) -> Optional[str]:
+    for item in tool_result.get('content') or []:
+        if isinstance(item, dict) and item.get('type') == 'image':
+            return item['source']['data']
+    return None
+
+
+def build_trajectory(
+    db_messages: List[Dict[str, Any]], parameters: Dict[str, Any]
+) -> List[Dict[str, Any]]:
+    """Extract the replayable steps from a job's stored message history.
+
+    Each step is {'input': tool input}, screenshot steps also carry the
+    fingerprint of the screen the model saw ('fingerprint', None if unknown).
+    Failed actions are skipped. The trajectory ends before typed text that is
+    neither made of parameters nor a constant from the prompt (the job's first
+    message). CPU bound, call it from a worker thread.
+    """
+    prompt = next(
+        (m['message_content'] for m in db_messages if m['role'] == 'user'), ''
+    )
+    # The prompt without parameter values, joined with a separator that can't
+    # be typed, so a constant can't span two parts
+    prompt_constants = '\0'.join(
+        _template_literals(_template_text(_message_text(prompt), parameters))
+    )
+
+    tool_results = {}
+    for message in db_messages:
+        content = message['message_content']
+        if message['role'] != 'user' or not isinstance(content, list):
+            continue
+        for block in content:
+            if isinstance(block, dict) and block.get('type') == 'tool_result':
+                tool_results[block['tool_use_id']] = block
+
+    steps = []
+    fingerprint = None
+    for message in db_messages:
+        content = message['message_content']
+        if message['role'] != 'assistant' or not isinstance(content, list):
+            continue
+        for block in content:
+            if not isinstance(block, dict) or block.get('type') != 'tool_use':
+                continue
+            if block['name'] != REPLAYED_TOOL:
+                return steps
+            tool_result = tool_results.get(block['id'])
+            if tool_result is None or tool_result.get('error'):
+                continue
+
+            tool_input = dict(block['input'])
+            if tool_input.get('action') == 'screenshot':
+                # Without an image the screen was unchanged since the last one
+                image_data = _result_image_data(tool_result)
+                if image_data:
+                    try:
+                        fingerprint = _fingerprint_image_data(image_data)
+                    except Exception as e:
+                        logger.warning(f'Could not fingerprint screenshot: {str(e)}')
+                        fingerprint = None
+                steps.append({'input': tool_input, 'fingerprint': fingerprint})
+                continue
+
+            if isinstance(tool_input.get('text'), str):
+                tool_input['text'] = _template_text(tool_input['text'], parameters)
+                if tool_input.get('action') == 'type' and not _is_replayable_text(
+                    tool_input['text'], prompt_constants
+                ):
+                    # Depends on what the model saw, it has to type it again
+                    return steps
+            steps.append({'input': tool_input})
+    return steps
+
+
+async def record_trajectory(
+    *,
+    job_id: UUID,
+    db: DatabaseService,
+    version_id: str,
+    parameters: Dict[str, Any],
+):
+    """Record the actions of a successful job as trajectory of its API version."""
+    db_messages = db.get_job_messages(job_id)
+    steps = await asyncio.to_thread(build_trajectory, db_messages, parameters)
+    if not any('fingerprint' not in step for step in steps):
+        logger.info(f'Job {job_id}: No actions to record as trajectory')
+        return
+    db.save_api_trajectory(
+        UUID(version_id), parameter_template(parameters), steps, job_id
+    )
+    logger.info(
+        f'Job {job_id}: Recorded trajectory with {len(steps)} steps for API version {version_id}'
+    )
+
+
+def _step_divergence(step: Dict[str, Any], result: ToolResult) -> Optional[str]:
+    """Return why a replayed step diverged from the recording, None if it didn't.
+
+    CPU bound (fingerprints the screenshot), call it from a worker thread.
+    """
+    if result.error:
+        return f'action failed: {result.error}'
+    if (
+        step['input'].get('action') == 'screenshot'
+        and result.base64_image
+        and step.get('fingerprint')
+    ):
+        fingerprint = _fingerprint_image_data(result.base64_image)
+        distance = fingerprint_distance(fingerprint, step['fingerprint'])
+        if distance > settings.TRAJECTORY_FINGERPRINT_MAX_DISTANCE:
+            return f'screen diverged (distance {distance})'
+    return None
+
+
+def _add_message(
+    db: DatabaseService, job_id: UUID, sequence: int, message: BetaMessageParam
+):
+    content = _beta_message_param_to_job_message_content(message)
+    db.add_job_message(
+        job_id=job_id, sequence=sequence, role=message['role'], content=content
+    )
+    message_history_cache.append(job_id, sequence, message['role'], content)
+
+
+async def replay_trajectory(
+    *,
+    job_id: UUID,
+    db: DatabaseService,
+    version_id: str,
+    parameters: Dict[str, Any],
+    prompt: str | List[Dict[str, Any]],
+    session_id: str,
+    tool_version: ToolVersion,
+    output_callback: Callable[[Any], Optional[Awaitable[None]]],
+    tool_output_callback: Callable[[ToolResult, str], Optional[Awaitable[None]]],
+) -> Optional[Dict[str, Any]]:
+    """Replay the recorded trajectory of a job's API version, if there is one.
+
+    The initial prompt and all replayed actions are added to the job's message
+    history, so the sampling loop continues with an empty messages list.
+
+    Returns:
+        None if there is no trajectory (nothing was added to the history),
+        otherwise {'steps': recorded steps, 'replayed': replayed steps,
+        'diverged': whether the screen or an action diverged}
+    """
+    trajectory = db.get_api_trajectory(UUID(version_id), parameter_template(parameters))
+    if not trajectory or not trajectory['steps']:
+        return None
+
+    steps = trajectory['steps']
+    logger.info(f'Job {job_id}: Replaying trajectory with {len(steps)} steps')
+    tool_group = TOOL_GROUPS_BY_VERSION[tool_version]
+    tool_collection = ToolCollection(*(ToolCls() for ToolCls in tool_group.tools))
+    values = {name: str(value) for name, value in parameters.items()}
+
+    # The model has not seen any screenshot of this job yet
+    reset_screen_history(session_id)
+    sequence = db.get_next_message_sequence(job_id)
+    _add_message(db, job_id, sequence, BetaMessageParam(role='user', content=prompt))
+    sequence += 1
+
+    replayed = 0
+    diverged = False
+    for index, step in enumerate(steps):
+        tool_input = dict(step['input'])
+        is_screenshot = tool_input.get('action') == 'screenshot'
+        if 'text' in tool_input:
+            tool_input['text'] = Template(tool_input['text']).safe_substitute(values)
+
+        if index and not is_screenshot and settings.SCREEN_SETTLE_MODE == 'adaptive':
+            # The model took its time between actions, let the screen catch up
+            await tool_collection.run(
+                name=REPLAYED_TOOL,
+                tool_input={
+                    'action': 'settle',
+                    'duration': settings.TRAJECTORY_REPLAY_SETTLE_TIMEOUT,
+                },
+                session_id=session_id,
+            )
+
+        content_block = {
+            'type': 'tool_use',
+            'id': f'toolu_replay_{index:03d}',
+            'name': REPLAYED_TOOL,
+            'input': tool_input,
+        }
+        result, health_check_reason = await _run_tool_use(
+            content_block,
+            tool_collection=tool_collection,
+            job_id=job_id,
+            db=db,
+            session_id=session_id,
+        )
+        if result is None:
+            # The sampling loop runs into the same health check and pauses the job
+            logger.warning(
+                f'Job {job_id}: Stopping replay, target health check failed: {health_check_reason}'
+            )
+            break
+
+        await _run_callback(output_callback, content_block)
+        await _run_callback(tool_output_callback, result, content_block['id'])
+        _add_message(
+            db,
+            job_id,
+            sequence,
+            BetaMessageParam(role='assistant', content=[content_block]),
+        )
+        _add_message(
+            db,
+            job_id,
+            sequence + 1,
+            BetaMessageParam(
+                role='user',
+                content=[_make_api_tool_result(result, content_block['id'])],
+            ),
+        )
+        sequence += 2
+
+        divergence = await asyncio.to_thread(_step_divergence, step, result)
+        if divergence:
+            logger.info(
+                f'Job {job_id}: Replay diverged at step {index}, {divergence}, handing over to the model'
+            )
+            diverged = True
+            break
+        replayed += 1
+
+    db.record_api_trajectory_replay(trajectory['id'], diverged)
+    return {'steps': len(steps), 'replayed': replayed, 'diverged': diverged}
@@ -0,0 +1,144 @@
+import base64
+import io
+
+from PIL import Image, ImageDraw
+
+from server.computer_use.tools import ToolResult
+
+from .replay import _step_divergence, _template_text, build_trajectory
+
+
+def png_base64(dialog: bool = False) -> str:
+    image = Image.new('RGB', (320, 200), 'white')
+    draw = ImageDraw.Draw(image)
+    draw.rectangle((0, 0, 320, 30), fill='navy')
+    if dialog:
+        draw.rectangle((80, 50, 240, 150), fill='gray', outline='black')
+    buffer = io.BytesIO()
+    image.save(buffer, format='PNG')
+    return base64.b64encode(buffer.getvalue()).decode('ascii')
+
+
+def tool_use(tool_id, name='computer', **tool_input):
+    return {'type': 'tool_use', 'id': tool_id, 'name': name, 'input': tool_input}
+
+
+def tool_result(tool_id, image=None, error=None):
+    content = []
+    if image:
+        content.append(
+            {
+                'type': 'image',
+                'source': {'type': 'base64', 'media_type': 'image/png', 'data': image},
+            }
+        )
+    return {
+        'type': 'tool_result',
+        'tool_use_id': tool_id,
+        'content': content,
+        'error': error,
+    }
+
+
+def job_messages(prompt, *exchanges):
+    """Build a stored message history from (tool_use, tool_result) pairs."""
+    messages = [{'role': 'user', 'message_content': prompt}]
+    for block, result in exchanges:
+        messages.append({'role': 'assistant', 'message_content': [block]})
+        messages.append({'role': 'user', 'message_content': [result]})
+    return messages
+
+
+def test_template_text():
+    parameters = {'first_name': 'Jane', 'last_name': 'Doe', 'count': 1}
+    assert _template_text('Jane Doe', parameters) == '${first_name} ${last_name}'
+    # Short values only when they are the whole text
+    assert _template_text('1', parameters) == '${count}'
+    assert _template_text('Page 1', parameters) == 'Page 1'
+    assert _template_text('costs $5', parameters) == 'costs $$5'
+
+
+def test_template_text_prefers_longest_value():
+    parameters = {'city': 'York', 'full_city': 'New York'}
+    assert _template_text('New York', parameters) == '${full_city}'
+
+
+def test_build_trajectory():
+    screen = png_base64()
+    parameters = {'patient': 'Jane Doe'}
+    messages = job_messages(
+        'Search for the patient Jane Doe and open the record tab.',
+        (tool_use('t1', action='screenshot'), tool_result('t1', image=screen)),
+        (
+            tool_use('t2', action='left_click', coordinate=[10, 10]),
+            tool_result('t2', error='Click failed'),
+        ),
+        (tool_use('t3', action='type', text='Jane Doe\n'), tool_result('t3')),
+        (tool_use('t4', action='key', text='Return'), tool_result('t4')),
+        # Unchanged screen, no image
+        (tool_use('t5', action='screenshot'), tool_result('t5')),
+        (tool_use('t6', action='type', text='record'), tool_result('t6')),
+        (tool_use('t7', name='extraction', data={}), tool_result('t7')),
+        (tool_use('t8', action='screenshot'), tool_result('t8', image=screen)),
+    )
+
+    steps = build_trajectory(messages, parameters)
+
+    assert [step['input'] for step in steps] == [
+        {'action': 'screenshot'},
+        {'action': 'type', 'text': '${patient}\n'},
+        {'action': 'key', 'text': 'Return'},
+        {'action': 'screenshot'},
+        {'action': 'type', 'text': 'record'},
+    ]
+    assert steps[0]['fingerprint'] is not None
+    assert steps[3]['fingerprint'] == steps[0]['fingerprint']
+
+
+def test_build_trajectory_ends_at_text_from_the_model():
+    parameters = {'patient': 'Jane Doe'}
+    messages = job_messages(
+        [{'type': 'text', 'text': 'Find the record number of Jane Doe.'}],
+        (tool_use('t1', action='type', text='Jane Doe'), tool_result('t1')),
+        # Read from the screen, differs for other patients
+        (tool_use('t2', action='type', text='REC-4711'), tool_result('t2')),
+        (tool_use('t3', action='key', text='Return'), tool_result('t3')),
+    )
+
+    steps = build_trajectory(messages, parameters)
+
+    assert [step['input'] for step in steps] == [
+        {'action': 'type', 'text': '${patient}'}
+    ]
+
+
+def test_build_trajectory_ignores_constants_from_parameter_values():
+    # 'Doe' only appears in the prompt as part of the parameter value
+    messages = job_messages(
+        'Look up Jane Doe.',
+        (tool_use('t1', action='type', text='Doe'), tool_result('t1')),
+    )
+    assert build_trajectory(messages, {'patient': 'Jane Doe'}) == []
+
+
+def test_step_divergence():
+    recorded = build_trajectory(
+        job_messages(
+            'Open the app.',
+            (tool_use('t1', action='screenshot'), tool_result('t1', png_base64())),
+        ),
+        {},
+    )[0]
+
+    assert _step_divergence(recorded, ToolResult(base64_image=png_base64())) is None
+    assert 'screen diverged' in _step_divergence(
+        recorded, ToolResult(base64_image=png_base64(dialog=True))
+    )
+    assert _step_divergence(recorded, ToolResult(error='No display')) == (
+        'action failed: No display'
+    )
+    # Unchanged screen since the last screenshot, nothing to compare
+    assert _step_divergence(recorded, ToolResult(output='unchanged')) is None
+
+    click = {'input': {'action': 'left_click', 'coordinate': [5, 5]}}
+    assert _step_divergence(click, ToolResult(output='clicked')) is None
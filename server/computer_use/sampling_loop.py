@@ -4,7 +4,7 @@ Agentic sampling loop that calls the Anthropic API and local implementation of a
 
 import asyncio
 import json
-from typing import Any, Callable, Optional, cast
+from typing import Any, Awaitable, Callable, Optional, cast
 from uuid import UUID
 
 import httpx
@@ -14,9 +14,6 @@ from anthropic import (
     APIError,
     APIResponseValidationError,
     APIStatusError,
-    AsyncAnthropic,
-    AsyncAnthropicBedrock,
-    AsyncAnthropicVertex,
 )
 
 # Import base TextBlockParam for initial message handling
@@ -32,20 +29,28 @@ from server.computer_use.config import (
     APIProvider,
 )
 from server.computer_use.logging import logger
+from server.computer_use.message_history import message_history_cache
+from server.computer_use.provider_clients import (
+    ProviderClient,
+    acquire_provider_client,
+    release_provider_client,
+)
 from server.computer_use.tools import (
     TOOL_GROUPS_BY_VERSION,
     ToolCollection,
     ToolResult,
     ToolVersion,
 )
+from server.computer_use.tools.computer import BaseComputerTool
+from server.computer_use.tools.screenshot import reset_screen_history
 from server.computer_use.utils import (
     _beta_message_param_to_job_message_content,
     _inject_prompt_caching,
-    _job_message_to_beta_message_param,
     _load_system_prompt,
     _make_api_tool_result,
     _maybe_filter_to_n_most_recent_images,
     _response_to_params,
+    _run_callback,
 )
 
 # Import DatabaseService and serialization utils
@@ -53,13 +58,133 @@ from server.database.service import DatabaseService
 
 # Import the centralized health check function
 from server.settings import settings
-from server.utils.docker_manager import check_target_container_health
+from server.utils.target_health import get_target_health
 
 # Initialize db service - This might cause issues if DB is not ready globally.
 # Consider passing db instance instead.
 db = DatabaseService()
 
 
+async def _run_tool_use(
+    content_block: dict[str, Any],
+    *,
+    tool_collection: ToolCollection,
+    job_id: UUID,
+    db: DatabaseService,
+    session_id: Optional[str],
+) -> tuple[Optional[ToolResult], str]:
+    """
+    Check the target's health, then run the tool of a tool_use block.
+
+    Returns:
+        (result, health_check_reason): result is None if the health check failed
+    """
+    health_check_ok = False
+    health_check_reason = 'Health check prerequisites not met (session_id missing).'
+    if session_id:
+        try:
+            session_details = db.get_session(UUID(session_id))
+            if session_details and session_details.get('container_ip'):
+                container_ip = session_details['container_ip']
+                health_status = await get_target_health(container_ip)
+                health_check_ok = health_status['healthy']
+                health_check_reason = health_status['reason']
+            else:
+                health_check_reason = (
+                    f'Could not retrieve container_ip for session {session_id}.'
+                )
+                logger.warning(f'Job {job_id}: {health_check_reason}')
+        except Exception as e:
+            health_check_reason = (
+                f'Error retrieving session details for health check: {str(e)}'
+            )
+            logger.error(f'Job {job_id}: {health_check_reason}')
+    else:
+        logger.warning(
+            f'Job {job_id}: Cannot perform health check, session_id is missing.'
+        )
+
+    if not health_check_ok:
+        return None, health_check_reason
+
+    result = await tool_collection.run(
+        name=content_block['name'],
+        tool_input=cast(dict[str, Any], content_block['input']),
+        session_id=session_id,
+    )
+    return result, health_check_reason
+
+
+def _start_tool_use(content_block: dict[str, Any], **kwargs) -> asyncio.Task:
+    """
+    Run a tool_use block in a background task. The task is cancelled if the
+    calling task (the job) ends before it.
+    """
+    task = asyncio.create_task(_run_tool_use(content_block, **kwargs))
+    owner = asyncio.current_task()
+    if owner is not None:
+
+        def cancel_tool(_):
+            task.cancel()
+
+        owner.add_done_callback(cancel_tool)
+        task.add_done_callback(lambda _: owner.remove_done_callback(cancel_tool))
+    return task
+
+
+async def _stream_message(
+    client: ProviderClient,
+    request_params: dict[str, Any],
+    start_tool_use: Callable[[dict[str, Any]], asyncio.Task],
+) -> tuple[Any, httpx.Response, dict[str, asyncio.Task]]:
+    """
+    Stream a model response and start the first tool call as soon as its input
+    is complete, while the rest of the response is still arriving.
+
+    Returns:
+        (message, http_response, tool_tasks): The accumulated message, an HTTP
+        response carrying it as JSON body for logging (the streamed body has
+        been consumed) and the started tool tasks by tool_use ID
+    """
+    tool_tasks: dict[str, asyncio.Task] = {}
+    try:
+        async with client.beta.messages.stream(**request_params) as stream:
+            async for event in stream:
+                if (
+                    event.type == 'content_block_stop'
+                    and event.content_block.type == 'tool_use'
+                    and not tool_tasks
+                ):
+                    # Further tool calls run in order once the response is complete
+                    block = event.content_block.model_dump()
+                    tool_tasks[block['id']] = start_tool_use(block)
+            message = await stream.get_final_message()
+            streamed_response = stream.response
+    except BaseException:
+        for task in tool_tasks.values():
+            task.cancel()
+        raise
+
+    headers = {
+        key: value
+        for key, value in streamed_response.headers.items()
+        if key.lower()
+        not in (
+            'content-type',
+            'content-length',
+            'content-encoding',
+            'transfer-encoding',
+        )
+    }
+    http_response = httpx.Response(
+        status_code=streamed_response.status_code,
+        headers=headers,
+        json=message.model_dump(mode='json', exclude_none=True),
+        request=streamed_response.request,
+    )
+    return message, http_response, tool_tasks
+
+
 async def sampling_loop(
     *,
     # Add job_id and db service parameters
@@ -69,10 +194,11 @@ async def sampling_loop(
     provider: APIProvider,
     system_prompt_suffix: str,
     messages: list[BetaMessageParam],  # Keep for initial messages
-    output_callback: Callable[[BetaContentBlockParam], None],
-    tool_output_callback: Callable[[ToolResult, str], None],
+    output_callback: Callable[[BetaContentBlockParam], Optional[Awaitable[None]]],
+    tool_output_callback: Callable[[ToolResult, str], Optional[Awaitable[None]]],
     api_response_callback: Callable[
-        [httpx.Request, httpx.Response | object | None, Exception | None], None
+        [httpx.Request, httpx.Response | object | None, Exception | None],
+        Optional[Awaitable[None]],
     ] = None,
     max_tokens: int = 4096,
     tool_version: ToolVersion,
@@ -97,6 +223,7 @@ async def sampling_loop(
         output_callback: Function to call with output
         tool_output_callback: Function to call with tool result
         api_response_callback: Function to call after API response
+            (the callbacks may be coroutine functions, they are awaited)
         max_tokens: Maximum number of tokens to generate
         tool_version: Version of tools to use
         token_efficient_tools_beta: Whether to use token efficient tools
@@ -124,7 +251,30 @@ async def sampling_loop(
     extractions = []
     is_completed = False
 
+    enable_prompt_caching = provider == APIProvider.ANTHROPIC
+    # Every dropped screenshot changes the history from that point on and with
+    # it the cached prompt prefix. Drop them in chunks, so the cache stays
+    # valid for the steps in between.
+    image_truncation_threshold = (
+        settings.PROMPT_CACHE_IMAGE_CHUNK_SIZE if enable_prompt_caching else 1
+    )
+
+    if session_id:
+        # The model has not seen any screenshot of this session yet
+        reset_screen_history(session_id)
+
+        # Screenshots may be downscaled, the model works in their coordinates
+        session = db.get_session(UUID(session_id))
+        target = db.get_target(session['target_id']) if session else None
+        if target:
+            for tool in tool_collection.tools:
+                if isinstance(tool, BaseComputerTool):
+                    tool.use_target_display(session_id, target)
+
     current_sequence = db.get_next_message_sequence(job_id)
+    if message_history_cache.last_sequence(job_id) != current_sequence - 1:
+        # Cached history is stale (e.g. the job ran elsewhere), reload it from the DB
+        message_history_cache.discard(job_id)
     initial_messages_to_add = messages  # Use the passed messages argument
 
     for init_message in initial_messages_to_add:
@@ -135,19 +285,32 @@ async def sampling_loop(
             role=init_message.get('role'),
             content=serialized_content,
         )
+        message_history_cache.append(
+            job_id, current_sequence, init_message.get('role'), serialized_content
+        )
         logger.info(f'Added initial message seq {current_sequence} for job {job_id}')
         current_sequence += 1
 
     # TODO: Split up this very long loop into smaller functions
     while True:
-        # --- Fetch current history from DB --- START
+        # --- Fetch current history from cache or DB --- START
         try:
-            db_messages = db.get_job_messages(job_id)
-            current_messages_for_api = [
-                _job_message_to_beta_message_param(msg) for msg in db_messages
-            ]
-            # Calculate next sequence based on fetched history
-            next_sequence = (db_messages[-1]['sequence'] + 1) if db_messages else 1
+            current_messages_for_api = message_history_cache.get_messages(
+                job_id,
+                images_to_keep=only_n_most_recent_images,
+                min_removal_threshold=image_truncation_threshold,
+            )
+            if current_messages_for_api is None:
+                # Job started or resumed, or its history was evicted
+                db_messages = db.get_job_messages(job_id)
+                message_history_cache.load(job_id, db_messages)
+                current_messages_for_api = message_history_cache.get_messages(
+                    job_id,
+                    images_to_keep=only_n_most_recent_images,
+                    min_removal_threshold=image_truncation_threshold,
+                )
+            # Calculate next sequence based on the history
+            next_sequence = message_history_cache.last_sequence(job_id) + 1
         except Exception as e:
             logger.error(
                 f'Failed to fetch or deserialize messages for job {job_id}: {e}',
@@ -155,43 +318,11 @@ async def sampling_loop(
             )
             # Cannot continue without message history
             raise ValueError(f'Failed to load message history for job {job_id}') from e
-        # --- Fetch current history from DB --- END
+        # --- Fetch current history from cache or DB --- END
 
-        enable_prompt_caching = False
         betas = [tool_group.beta_flag] if tool_group.beta_flag else []
         if token_efficient_tools_beta:
             betas.append('token-efficient-tools-2025-02-19')
-        image_truncation_threshold = 1
-        # --- Client Initialization (remains the same) ---
-        # TODO: Does this need to be done for every iteration?
-        # reload pydantic variables
-        settings.__init__()
-        if provider == APIProvider.ANTHROPIC:
-            # Use AsyncAnthropic instead of Anthropic
-            client = AsyncAnthropic(api_key=api_key, max_retries=4)
-            enable_prompt_caching = True
-        elif provider == APIProvider.VERTEX:
-            # Use AsyncAnthropicVertex instead of AnthropicVertex
-            client = AsyncAnthropicVertex()
-        elif provider == APIProvider.BEDROCK:
-            # AWS credentials should be set in environment variables
-            # by the server.py initialization
-            aws_region = settings.AWS_REGION
-            aws_access_key = settings.AWS_ACCESS_KEY_ID
-            aws_secret_key = settings.AWS_SECRET_ACCESS_KEY
-            aws_session_token = settings.AWS_SESSION_TOKEN
-
-            # Initialize with available credentials
-            bedrock_kwargs = {'aws_region': aws_region}
-            if aws_access_key and aws_secret_key:
-                bedrock_kwargs['aws_access_key'] = aws_access_key
-                bedrock_kwargs['aws_secret_key'] = aws_secret_key
-                if aws_session_token:
-                    bedrock_kwargs['aws_session_token'] = aws_session_token
-
-            # Use AsyncAnthropicBedrock instead of AnthropicBedrock
-            client = AsyncAnthropicBedrock(**bedrock_kwargs)
-            logger.info(f'Using AsyncAnthropicBedrock client with region: {aws_region}')
         if enable_prompt_caching:
             betas.append(PROMPT_CACHING_BETA_FLAG)
             _inject_prompt_caching(
@@ -216,6 +347,9 @@ async def sampling_loop(
             logger.info('Sampling loop cancelled before API call')
             raise
 
+        # Clients are shared across iterations and jobs to reuse their connections.
+        # Settings are only reloaded by the settings routes, not per call.
+        client = acquire_provider_client(provider, api_key)
         try:
             # Log messages to trace tool_result issues
             logger.info(f"Job {job_id}: Sending {len(current_messages_for_api)} messages to API")
@@ -225,45 +359,63 @@ async def sampling_loop(
                         if isinstance(content_item, dict) and content_item.get('type') == 'tool_result':
                             logger.info(f"Job {job_id}: Message[{i}].content[{j}] is tool_result")
                             logger.info(f"Job {job_id}: tool_result keys: {list(content_item.keys())}")
-                            if 'cache_control' in content_item:
-                                logger.warning(f"Job {job_id}: Found cache_control in tool_result content!")
                             if 'error' in content_item and 'content' in content_item:
                                 logger.info(f"Job {job_id}: tool_result has both error and content fields")
             
             # Use original 'system' variable
-            raw_response = await client.beta.messages.with_raw_response.create(
-                max_tokens=max_tokens,
-                messages=current_messages_for_api,
-                model=model,
-                system=[system],  # Pass original system dict
-                tools=tool_collection.to_params(),
-                betas=betas,
-                temperature=0.0,
-            )
+            request_params = {
+                'max_tokens': max_tokens,
+                'messages': current_messages_for_api,
+                'model': model,
+                'system': [system],  # Pass original system dict
+                'tools': tool_collection.to_params(),
+                'betas': betas,
+                'temperature': 0.0,
+            }
+
+            if settings.MODEL_STREAMING:
+                response, http_response, early_tool_tasks = await _stream_message(
+                    client,
+                    request_params,
+                    start_tool_use=lambda block: _start_tool_use(
+                        block,
+                        tool_collection=tool_collection,
+                        job_id=job_id,
+                        db=db,
+                        session_id=session_id,
+                    ),
+                )
+            else:
+                raw_response = await client.beta.messages.with_raw_response.create(
+                    **request_params
+                )
+                response = raw_response.parse()
+                http_response = raw_response.http_response
+                early_tool_tasks = {}
 
             if api_response_callback:
-                api_response_callback(
-                    raw_response.http_response.request, raw_response.http_response, None
+                await _run_callback(
+                    api_response_callback, http_response.request, http_response, None
                 )
 
             # Add exchange to the list
             exchanges.append(
                 {
-                    'request': raw_response.http_response.request,
-                    'response': raw_response.http_response,
+                    'request': http_response.request,
+                    'response': http_response,
                 }
             )
 
         except (APIStatusError, APIResponseValidationError) as e:
             # For API errors, handle as before
             if api_response_callback:
-                api_response_callback(e.request, e.response, e)
+                await _run_callback(api_response_callback, e.request, e.response, e)
             logger.error(f'Job {job_id}: API call failed with error: {e.message}')
             raise ValueError(e.message) from e
 
         except APIError as e:
             if api_response_callback:
-                api_response_callback(e.request, e.body, e)
+                await _run_callback(api_response_callback, e.request, e.body, e)
             # Return extractions if we have them, otherwise raise an error
             raise ValueError(e.message) from e
 
@@ -271,6 +423,9 @@ async def sampling_loop(
             logger.info('API call cancelled')
             raise
 
+        finally:
+            release_provider_client(client)
+
         # Check for cancellation after API call
         try:
             # Use asyncio.sleep(0) to allow cancellation to be processed
@@ -280,7 +435,6 @@ async def sampling_loop(
             logger.info('Sampling loop cancelled after API call')
             raise
 
-        response = raw_response.parse()
         response_params = _response_to_params(response)
 
         # --- Save Assistant Message to DB --- START
@@ -299,6 +453,9 @@ async def sampling_loop(
                 ],  # Tool results are sent back as user role
                 content=serialized_message,
             )
+            message_history_cache.append(
+                job_id, next_sequence, resulting_message['role'], serialized_message
+            )
             logger.info(f'Saved assistant message seq {next_sequence} for job {job_id}')
             next_sequence += 1  # Increment sequence for potential tool results
         except Exception as e:
@@ -320,37 +477,25 @@ async def sampling_loop(
 
         found_tool_use = False
         for content_block in response_params:
-            output_callback(content_block)
+            await _run_callback(output_callback, content_block)
             if content_block['type'] == 'tool_use':
                 found_tool_use = True
 
-                # --- Target Health Check --- START
-                health_check_ok = False
-                health_check_reason = (
-                    'Health check prerequisites not met (session_id missing).'
-                )
-                if session_id:
-                    try:
-                        session_details = db.get_session(UUID(session_id))
-                        if session_details and session_details.get('container_ip'):
-                            container_ip = session_details['container_ip']
-                            health_status = await check_target_container_health(
-                                container_ip
-                            )
-                            health_check_ok = health_status['healthy']
-                            health_check_reason = health_status['reason']
-                        else:
-                            health_check_reason = f'Could not retrieve container_ip for session {session_id}.'
-                            logger.warning(f'Job {job_id}: {health_check_reason}')
-                    except Exception as e:
-                        health_check_reason = f'Error retrieving session details for health check: {str(e)}'
-                        logger.error(f'Job {job_id}: {health_check_reason}')
+                # Tool calls dispatched while the response was streaming
+                # already run, otherwise run the tool now
+                early_task = early_tool_tasks.pop(content_block['id'], None)
+                if early_task is not None:
+                    result, health_check_reason = await early_task
                 else:
-                    logger.warning(
-                        f'Job {job_id}: Cannot perform health check, session_id is missing.'
+                    result, health_check_reason = await _run_tool_use(
+                        content_block,
+                        tool_collection=tool_collection,
+                        job_id=job_id,
+                        db=db,
+                        session_id=session_id,
                     )
 
-                if not health_check_ok:
+                if result is None:
                     # REMOVE DB update, just return the specific dict
                     # db.update_job_status(job_id, "paused") # REMOVED
                     logger.warning(
@@ -361,13 +506,6 @@ async def sampling_loop(
                         'error': 'Target Health Check Failed',
                         'error_description': health_check_reason,
                     }, exchanges
-                # --- Target Health Check --- END
-
-                result = await tool_collection.run(
-                    name=content_block['name'],
-                    tool_input=cast(dict[str, Any], content_block['input']),
-                    session_id=session_id,
-                )
 
                 # --- Save Tool Result Message to DB --- START
                 try:
@@ -396,6 +534,12 @@ async def sampling_loop(
                         ],  # Tool results are sent back as user role
                         content=serialized_message,
                     )
+                    message_history_cache.append(
+                        job_id,
+                        next_sequence,
+                        resulting_message['role'],
+                        serialized_message,
+                    )
                     logger.info(
                         f'Saved tool result message seq {next_sequence} for tool {content_block["name"]} job {job_id}'
                     )
@@ -447,7 +591,7 @@ async def sampling_loop(
                         except json.JSONDecodeError as e:
                             logger.error(f'Failed to parse extraction result: {e}')
 
-                tool_output_callback(result, content_block['id'])
+                await _run_callback(tool_output_callback, result, content_block['id'])
 
         # Check if loop should terminate
         if not found_tool_use:
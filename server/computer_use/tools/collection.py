@@ -17,7 +17,8 @@ class ToolCollection:
     """A collection of anthropic-defined tools."""
 
     def __init__(self, *tools: BaseAnthropicTool):
-        self.tools = tools
+        # Fixed order, so the tool definitions are a stable prompt cache prefix
+        self.tools = tuple(sorted(tools, key=lambda tool: tool.to_params()['name']))
         self.tool_map = {tool.to_params()['name']: tool for tool in tools}
 
     def to_params(
@@ -5,8 +5,21 @@ from typing import Literal, cast
 from anthropic.types.beta import BetaToolComputerUse20241022Param, BetaToolUnionParam
 
 from server.database import db
+from server.settings import settings
 
 from .base import BaseAnthropicTool, ToolError, ToolResult
+from .screenshot import (
+    ScreenshotPolicy,
+    expect_screenshot_size,
+    frames_match,
+    process_screenshot,
+    record_screenshot_scale,
+    scale_to_screen,
+    scale_to_screenshot,
+    screen_unchanged,
+    screenshot_size,
+)
+from .text_entry import TextEntryPolicy, record_clipboard_ignored, should_paste
 from .vnc_client import vnc_pool
 
 Action_20241022 = Literal[
@@ -59,6 +72,24 @@ class BaseComputerTool(BaseAnthropicTool):
     def to_params(self) -> BetaToolComputerUse20241022Param:
         return {'name': self.name, 'type': self.api_type, **self.options}
 
+    def use_target_display(self, session_id: str, target: dict):
+        """Advertise the size of the target's screenshots as display size.
+
+        The model's coordinates refer to the (possibly downscaled) screenshots,
+        not to the target's screen.
+        """
+        try:
+            screen_size = (int(target['width']), int(target['height']))
+        except (KeyError, TypeError, ValueError):
+            logging.getLogger(__name__).warning(
+                f'Target {target.get("id")} has no valid screen size, '
+                f'advertising {self.width}x{self.height}'
+            )
+            return
+        size = screenshot_size(*screen_size, ScreenshotPolicy.for_target(target))
+        self.width, self.height = size
+        expect_screenshot_size(session_id, screen_size, size)
+
     async def __call__(
         self,
         *,
@@ -72,6 +103,42 @@ class BaseComputerTool(BaseAnthropicTool):
             session_id, action, text, coordinate, **kwargs
         )
 
+    async def _wait_until_stable(self, vnc, max_wait: float) -> tuple[float, bool]:
+        """
+        Sample the framebuffer until SCREEN_SETTLE_STABLE_FRAMES consecutive
+        frames match, or max_wait seconds have passed.
+
+        Returns:
+            (settle_time, settled): Seconds waited and whether the screen settled
+        """
+        loop = asyncio.get_running_loop()
+        started_at = loop.time()
+        deadline = started_at + max_wait
+        previous = None
+        matching_frames = 1
+        while True:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                return loop.time() - started_at, False
+            try:
+                frame = await asyncio.wait_for(vnc.capture_frame(), timeout=remaining)
+            except TimeoutError:
+                return loop.time() - started_at, False
+
+            if previous is not None and await asyncio.to_thread(
+                frames_match, previous, frame, settings.SCREEN_SETTLE_MAX_DIFF
+            ):
+                matching_frames += 1
+                if matching_frames >= settings.SCREEN_SETTLE_STABLE_FRAMES:
+                    return loop.time() - started_at, True
+            else:
+                matching_frames = 1
+            previous = frame
+
+            await asyncio.sleep(
+                max(0, min(settings.SCREEN_SETTLE_INTERVAL, deadline - loop.time()))
+            )
+
     async def _perform_vnc_action(
         self,
         session_id: str,
@@ -105,78 +172,124 @@ class BaseComputerTool(BaseAnthropicTool):
         # TODO: Get VNC password from session if needed
         vnc_password = session.get('vnc_password')
 
+        # The model's coordinates refer to the last (possibly downscaled) screenshot
+        screen_coordinate = (
+            scale_to_screen(session_id, coordinate) if coordinate else None
+        )
+
         try:
             # Get VNC connection from pool
             async with vnc_pool.get_connection(container_ip, vnc_port, vnc_password) as vnc:
                 # Perform the requested action
                 if action == 'screenshot':
-                    base64_image = await vnc.screenshot()
+                    settle_note = ''
+                    if settings.SCREEN_SETTLE_MODE == 'adaptive':
+                        # Don't capture a half-painted screen
+                        settle_time, settled = await self._wait_until_stable(
+                            vnc, settings.SCREEN_SETTLE_TIMEOUT
+                        )
+                        settle_note = (
+                            f' (screen settled after {settle_time:.2f}s)'
+                            if settled
+                            else f' (screen still changing after {settle_time:.2f}s)'
+                        )
+
+                    image = await vnc.screenshot()
+                    policy = ScreenshotPolicy.for_target(
+                        db.get_target(session.get('target_id'))
+                    )
+                    screenshot = await asyncio.to_thread(
+                        process_screenshot, image, policy
+                    )
+                    record_screenshot_scale(session_id, screenshot)
+                    if settings.SCREENSHOT_SKIP_UNCHANGED and await asyncio.to_thread(
+                        screen_unchanged, session_id, screenshot
+                    ):
+                        return ToolResult(
+                            output=f"Screen unchanged since previous screenshot{settle_note}"
+                        )
+                    logger.debug(
+                        f'Screenshot for session {session_id}: {screenshot.width}x{screenshot.height} '
+                        f'{screenshot.media_type}, scale {screenshot.scale_x:.3f}, '
+                        f'{len(screenshot.base64_image)} base64 bytes'
+                    )
                     return ToolResult(
-                        output="Screenshot taken successfully",
-                        base64_image=base64_image
+                        output=f"Screenshot taken successfully{settle_note}",
+                        base64_image=screenshot.base64_image
                     )
                 
                 elif action == 'mouse_move':
                     if not coordinate:
                         raise ToolError("Coordinate required for mouse_move")
-                    await vnc.move_mouse(coordinate[0], coordinate[1])
+                    await vnc.move_mouse(screen_coordinate[0], screen_coordinate[1])
                     return ToolResult(output=f"Mouse moved to {coordinate}")
                 
                 elif action == 'left_click':
-                    if coordinate:
-                        await vnc.move_mouse(coordinate[0], coordinate[1])
-                    await vnc.click(1)
+                    await vnc.click(1, position=screen_coordinate)
                     return ToolResult(output="Left click performed")
                 
                 elif action == 'right_click':
-                    if coordinate:
-                        await vnc.move_mouse(coordinate[0], coordinate[1])
-                    await vnc.click(3)
+                    await vnc.click(3, position=screen_coordinate)
                     return ToolResult(output="Right click performed")
                 
                 elif action == 'middle_click':
-                    if coordinate:
-                        await vnc.move_mouse(coordinate[0], coordinate[1])
-                    await vnc.click(2)
+                    await vnc.click(2, position=screen_coordinate)
                     return ToolResult(output="Middle click performed")
                 
                 elif action == 'double_click':
-                    if coordinate:
-                        await vnc.move_mouse(coordinate[0], coordinate[1])
-                    await vnc.click(1)
-                    await asyncio.sleep(0.1)
-                    await vnc.click(1)
+                    await vnc.click(1, count=2, position=screen_coordinate)
                     return ToolResult(output="Double click performed")
                 
                 elif action == 'triple_click':
-                    if coordinate:
-                        await vnc.move_mouse(coordinate[0], coordinate[1])
-                    for _ in range(3):
-                        await vnc.click(1)
-                        await asyncio.sleep(0.1)
+                    await vnc.click(1, count=3, position=screen_coordinate)
                     return ToolResult(output="Triple click performed")
                 
                 elif action == 'left_click_drag':
                     if not coordinate:
                         raise ToolError("Coordinate required for left_click_drag")
-                    await vnc.drag(coordinate[0], coordinate[1], 1)
+                    await vnc.drag(screen_coordinate[0], screen_coordinate[1], 1)
                     return ToolResult(output=f"Dragged to {coordinate}")
                 
                 elif action == 'left_mouse_down':
-                    if coordinate:
-                        await vnc.move_mouse(coordinate[0], coordinate[1])
-                    await vnc.mouse_down(1)
+                    await vnc.mouse_down(1, position=screen_coordinate)
                     return ToolResult(output="Left mouse button pressed down")
                 
                 elif action == 'left_mouse_up':
-                    if coordinate:
-                        await vnc.move_mouse(coordinate[0], coordinate[1])
-                    await vnc.mouse_up(1)
+                    await vnc.mouse_up(1, position=screen_coordinate)
                     return ToolResult(output="Left mouse button released")
                 
                 elif action == 'type':
                     if not text:
                         raise ToolError("Text required for type action")
+                    target_id = session.get('target_id')
+                    text_entry = TextEntryPolicy.for_target(db.get_target(target_id))
+                    if should_paste(target_id, text_entry, text):
+                        if text_entry.verify_timeout > 0:
+                            # Compare with a settled screen, a change still in
+                            # progress from the last action isn't the paste
+                            await self._wait_until_stable(
+                                vnc, text_entry.verify_timeout
+                            )
+                        if await vnc.paste_text(
+                            text,
+                            text_entry.paste_chord,
+                            text_entry.verify_timeout,
+                            text_entry.verify_min_change,
+                        ):
+                            return ToolResult(output=f"Typed: {text}")
+                        # The paste may still have landed, typing the text
+                        # now could enter it twice
+                        record_clipboard_ignored(target_id)
+                        return ToolResult(
+                            output=(
+                                f'Pasted: {text}\n'
+                                f'The screen did not visibly change within '
+                                f'{text_entry.verify_timeout:g}s, the application '
+                                f'may have ignored the paste. Take a screenshot to '
+                                f'check whether the text was entered before typing '
+                                f'it again.'
+                            )
+                        )
                     await vnc.type_text(text)
                     return ToolResult(output=f"Typed: {text}")
                 
@@ -194,10 +307,8 @@ class BaseComputerTool(BaseAnthropicTool):
                 
                 elif action == 'hold_key':
                     if key:
-                        # For hold_key, we'll press and release after duration
-                        await vnc.key_press(key)
-                        if duration:
-                            await asyncio.sleep(duration)
+                        # Release the key after duration
+                        await vnc.key_press(key, hold=duration or 0)
                         return ToolResult(output=f"Key held: {key}")
                     else:
                         raise ToolError("Key required for hold_key action")
@@ -206,17 +317,40 @@ class BaseComputerTool(BaseAnthropicTool):
                     if not scroll_direction:
                         raise ToolError("Scroll direction required for scroll action")
                     amount = scroll_amount or 5
-                    await vnc.scroll(scroll_direction, amount)
+                    await vnc.scroll(scroll_direction, amount, position=screen_coordinate)
                     return ToolResult(output=f"Scrolled {scroll_direction} by {amount}")
                 
                 elif action == 'cursor_position':
-                    position = await vnc.get_cursor_position()
+                    position = scale_to_screenshot(
+                        session_id, await vnc.get_cursor_position()
+                    )
                     return ToolResult(output=f"Cursor position: {position}")
                 
                 elif action == 'wait':
                     wait_time = duration or 1.0
+                    # The requested time is a minimum, a screen that is static
+                    # because the app hasn't started painting yet isn't settled
                     await asyncio.sleep(wait_time)
+                    if settings.SCREEN_SETTLE_MODE == 'adaptive':
+                        settle_time, settled = await self._wait_until_stable(
+                            vnc, settings.SCREEN_SETTLE_TIMEOUT
+                        )
+                        state = 'stable' if settled else 'still changing'
+                        return ToolResult(
+                            output=f'Waited for {wait_time} seconds, screen {state} {settle_time:.2f} seconds later'
+                        )
                     return ToolResult(output=f"Waited for {wait_time} seconds")
+
+                elif action == 'settle':
+                    # Not offered to the model. Trajectory replay lets the
+                    # screen catch up before an action, at most duration seconds
+                    settle_time, settled = await self._wait_until_stable(
+                        vnc, duration or settings.SCREEN_SETTLE_TIMEOUT
+                    )
+                    state = 'stable' if settled else 'still changing'
+                    return ToolResult(
+                        output=f'Screen {state} after {settle_time:.2f} seconds'
+                    )
                 
                 else:
                     raise ToolError(f"Unknown action: {action}")
@@ -0,0 +1,945 @@
+"""
+Asyncio client for the RFB (VNC) protocol.
+
+The client keeps an in-memory copy of the remote framebuffer up to date:
+after every FramebufferUpdate it requests the next incremental update, which
+the server sends as soon as something on the screen changes. Reading the
+screen is therefore a copy of memory, not a round trip to the server.
+
+Supported are the Raw, CopyRect, ZRLE and Tight encodings and the Cursor,
+PointerPos, DesktopSize and LastRect pseudo-encodings, with the None and VNC
+authentication security types (RFB 3.3, 3.7 and 3.8).
+
+The client asks for 32 bit true colour pixels with red, green and blue in the
+lowest three bytes (little-endian), so raw pixel data maps directly to PIL's
+'RGBX' raw mode and the compact 3 byte pixels of ZRLE and Tight to 'RGB'.
+
+Large rectangles are decoded in a worker thread and pasted into the
+framebuffer on the event loop, so decoding doesn't hold up other connections
+and the framebuffer is never changed while it is copied. The read loop waits
+for each rectangle, which keeps the stateful zlib streams in order.
+"""
+
+import asyncio
+import contextlib
+import io
+import logging
+import zlib
+from struct import pack, unpack
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+from PIL import Image
+
+logger = logging.getLogger(__name__)
+
+# Encodings, in order of preference
+ENCODING_RAW = 0
+ENCODING_COPYRECT = 1
+ENCODING_TIGHT = 7
+ENCODING_ZRLE = 16
+# Pseudo-encodings
+ENCODING_CURSOR = -239
+ENCODING_DESKTOP_SIZE = -223
+ENCODING_LAST_RECT = -224
+ENCODING_POINTER_POS = -232
+
+CLIENT_ENCODINGS = (
+    ENCODING_TIGHT,
+    ENCODING_ZRLE,
+    ENCODING_COPYRECT,
+    ENCODING_RAW,
+    ENCODING_CURSOR,
+    ENCODING_DESKTOP_SIZE,
+    ENCODING_LAST_RECT,
+    ENCODING_POINTER_POS,
+)
+
+SECURITY_NONE = 1
+SECURITY_VNC_AUTH = 2
+
+ZRLE_TILE_SIZE = 64
+# Tight data shorter than this is sent without compression
+TIGHT_MIN_TO_COMPRESS = 12
+# Rectangles with at least this many pixels are decoded in a worker thread,
+# for smaller ones the thread hand-off costs more than the decoding
+THREADED_DECODE_MIN_PIXELS = 64 * 64
+
+# X11 keysyms of named keys, by lower case name. Includes the X keysym names
+# used by xdotool (e.g. 'Return', 'Page_Down', 'Super_L') and the short names
+# of vncdotool (e.g. 'enter', 'pgdn', 'bsp').
+KEYSYMS: Dict[str, int] = {
+    'backspace': 0xFF08,
+    'bsp': 0xFF08,
+    'tab': 0xFF09,
+    'return': 0xFF0D,
+    'enter': 0xFF0D,
+    'pause': 0xFF13,
+    'scroll_lock': 0xFF14,
+    'scrlk': 0xFF14,
+    'sys_req': 0xFF15,
+    'sysrq': 0xFF15,
+    'escape': 0xFF1B,
+    'esc': 0xFF1B,
+    'home': 0xFF50,
+    'left': 0xFF51,
+    'up': 0xFF52,
+    'right': 0xFF53,
+    'down': 0xFF54,
+    'page_up': 0xFF55,
+    'pageup': 0xFF55,
+    'prior': 0xFF55,
+    'pgup': 0xFF55,
+    'page_down': 0xFF56,
+    'pagedown': 0xFF56,
+    'next': 0xFF56,
+    'pgdn': 0xFF56,
+    'end': 0xFF57,
+    'print': 0xFF61,
+    'prtsc': 0xFF61,
+    'insert': 0xFF63,
+    'ins': 0xFF63,
+    'menu': 0xFF67,
+    'num_lock': 0xFF7F,
+    'numlk': 0xFF7F,
+    'kp_enter': 0xFF8D,
+    'kpenter': 0xFF8D,
+    'shift': 0xFFE1,
+    'shift_l': 0xFFE1,
+    'lshift': 0xFFE1,
+    'shift_r': 0xFFE2,
+    'rshift': 0xFFE2,
+    'ctrl': 0xFFE3,
+    'control': 0xFFE3,
+    'control_l': 0xFFE3,
+    'ctrl_l': 0xFFE3,
+    'lctrl': 0xFFE3,
+    'control_r': 0xFFE4,
+    'ctrl_r': 0xFFE4,
+    'rctrl': 0xFFE4,
+    'caps_lock': 0xFFE5,
+    'caplk': 0xFFE5,
+    'meta': 0xFFE7,
+    'meta_l': 0xFFE7,
+    'lmeta': 0xFFE7,
+    'meta_r': 0xFFE8,
+    'rmeta': 0xFFE8,
+    'alt': 0xFFE9,
+    'alt_l': 0xFFE9,
+    'lalt': 0xFFE9,
+    'alt_r': 0xFFEA,
+    'ralt': 0xFFEA,
+    'super': 0xFFEB,
+    'super_l': 0xFFEB,
+    'lsuper': 0xFFEB,
+    'win': 0xFFEB,
+    'windows': 0xFFEB,
+    'cmd': 0xFFEB,
+    'super_r': 0xFFEC,
+    'rsuper': 0xFFEC,
+    'hyper': 0xFFED,
+    'hyper_l': 0xFFED,
+    'hyper_r': 0xFFEE,
+    'delete': 0xFFFF,
+    'del': 0xFFFF,
+    'space': 0x20,
+    'spacebar': 0x20,
+    'minus': ord('-'),
+    'plus': ord('+'),
+    'slash': ord('/'),
+    'fslash': ord('/'),
+    'backslash': ord('\\'),
+    'bslash': ord('\\'),
+    **{f'f{n}': 0xFFBE + n - 1 for n in range(1, 36)},
+    **{f'kp_{n}': 0xFFB0 + n for n in range(10)},
+    **{f'kp{n}': 0xFFB0 + n for n in range(10)},
+}
+
+# Keysyms of characters that are typed with a key of their own
+CHARACTER_KEYSYMS = {'\n': 0xFF0D, '\r': 0xFF0D, '\t': 0xFF09, '\b': 0xFF08}
+
+
+class RFBError(Exception):
+    """Protocol error or connection failure of an RFB connection."""
+
+
+def keysym_for_name(name: str) -> int:
+    """Return the keysym of a key name (e.g. 'Return', 'ctrl') or character."""
+    keysym = KEYSYMS.get(name.lower())
+    if keysym is not None:
+        return keysym
+    if len(name) == 1:
+        return keysym_for_character(name)
+    raise ValueError(f'Unknown key: {name}')
+
+
+def keysym_for_character(character: str) -> int:
+    """Return the keysym that types a character."""
+    if character in CHARACTER_KEYSYMS:
+        return CHARACTER_KEYSYMS[character]
+    code = ord(character)
+    # Latin-1 keysyms equal their code point, others are offset Unicode keysyms
+    return code if code < 0x100 else 0x01000000 | code
+
+
+def key_event_message(keysym: int, down: bool) -> bytes:
+    return pack('>BBxxI', 4, 1 if down else 0, keysym)
+
+
+def pointer_event_message(x: int, y: int, buttons: int) -> bytes:
+    return pack('>BBHH', 5, buttons, max(0, x), max(0, y))
+
+
+def client_cut_text_message(text: str) -> bytes:
+    # RFB clipboard text is Latin-1
+    data = text.encode('latin-1', errors='replace')
+    return pack('>BxxxI', 6, len(data)) + data
+
+
+class InputBatch:
+    """Input events of one action, compiled into as few writes as possible.
+
+    Events are concatenated into a single write; delay() starts a new write
+    that is sent the given number of seconds after the previous one. The
+    batch tracks the pointer state its events leave behind, starting from
+    the client's current state.
+    """
+
+    def __init__(self, pointer: Tuple[int, int], buttons: int):
+        self.pointer = pointer
+        self.buttons = buttons
+        # [seconds after the previous write, data, pointer and buttons after
+        # it if the write contains pointer events, else None]
+        self.writes: List[list] = [[0.0, bytearray(), None]]
+
+    def _add(self, data: bytes):
+        self.writes[-1][1] += data
+
+    def _add_pointer_event(self):
+        self._add(pointer_event_message(*self.pointer, self.buttons))
+        self.writes[-1][2] = (self.pointer, self.buttons)
+
+    def move(self, x: int, y: int):
+        self.pointer = (x, y)
+        self._add_pointer_event()
+
+    def press(self, button_mask: int):
+        self.buttons |= button_mask
+        self._add_pointer_event()
+
+    def release(self, button_mask: int):
+        self.buttons &= ~button_mask
+        self._add_pointer_event()
+
+    def key(self, keysym: int, down: bool):
+        self._add(key_event_message(keysym, down))
+
+    def cut_text(self, text: str):
+        self._add(client_cut_text_message(text))
+
+    def delay(self, seconds: float):
+        if seconds > 0:
+            self.writes.append([seconds, bytearray(), None])
+
+
+class RFBClient:
+    """Client side of an RFB connection with an always current framebuffer."""
+
+    def __init__(self, host: str, port: int = 5900, password: Optional[str] = None):
+        self.host = host
+        self.port = port
+        self.password = password
+        self.width = 0
+        self.height = 0
+        self.name = ''
+        # The remote screen, updated in place by the read loop
+        self.framebuffer: Optional[Image.Image] = None
+        # Shape of the remote cursor (RGBA) and its hotspot, if the server sends it
+        self.cursor: Optional[Image.Image] = None
+        self.cursor_hotspot: Tuple[int, int] = (0, 0)
+        # Pointer position, from the last pointer event sent or the server's
+        # PointerPos updates (e.g. when an application moved the pointer)
+        self.pointer: Tuple[int, int] = (0, 0)
+        self.pointer_known = False
+        self.buttons = 0
+        self.server_cut_text = ''
+        self.updates = 0
+        # While paused, updates are no longer requested after each update
+        self.updates_paused = False
+
+        self._reader: Optional[asyncio.StreamReader] = None
+        self._writer: Optional[asyncio.StreamWriter] = None
+        self._read_task: Optional[asyncio.Task] = None
+        self._update_event = asyncio.Event()
+        self._error: Optional[BaseException] = None
+        self._full_update_needed = False
+        self._zrle_stream = zlib.decompressobj()
+        self._tight_streams = [zlib.decompressobj() for _ in range(4)]
+
+    @property
+    def connected(self) -> bool:
+        return (
+            self._read_task is not None
+            and not self._read_task.done()
+            and self._error is None
+        )
+
+    async def connect(self, timeout: float = 10.0):
+        """Connect, authenticate and wait for the first framebuffer update."""
+        try:
+            await asyncio.wait_for(self._connect(), timeout)
+        except TimeoutError:
+            await self.close()
+            raise RFBError(
+                f'Timed out after {timeout}s connecting to {self.host}:{self.port}'
+            ) from None
+        except BaseException:
+            await self.close()
+            raise
+
+    async def _connect(self):
+        self._reader, self._writer = await asyncio.open_connection(self.host, self.port)
+        minor = await self._negotiate_version()
+        await self._authenticate(minor)
+
+        # ClientInit (shared session) and ServerInit
+        self._writer.write(pack('>B', 1))
+        self.width, self.height = unpack('>HH', await self._read(4))
+        await self._read(16)  # Server pixel format, replaced below
+        (name_length,) = unpack('>I', await self._read(4))
+        self.name = (await self._read(name_length)).decode('utf-8', errors='replace')
+        self.framebuffer = Image.new('RGB', (self.width, self.height))
+
+        # 32 bpp, depth 24, little-endian, true colour, red/green/blue shifts 0/8/16
+        self._writer.write(
+            pack('>BxxxBBBBHHHBBBxxx', 0, 32, 24, 0, 1, 255, 255, 255, 0, 8, 16)
+        )
+        self._writer.write(
+            pack('>BxH', 2, len(CLIENT_ENCODINGS))
+            + pack(f'>{len(CLIENT_ENCODINGS)}i', *CLIENT_ENCODINGS)
+        )
+        self._request_update(incremental=False)
+        await self._writer.drain()
+
+        first_update = self._update_event
+        self._read_task = asyncio.create_task(self._read_loop())
+        await first_update.wait()
+        self._raise_if_failed()
+        logger.info(
+            f'Connected to VNC server {self.name!r} at {self.host}:{self.port} '
+            f'({self.width}x{self.height})'
+        )
+
+    async def _negotiate_version(self) -> int:
+        version = await self._read(12)
+        if not version.startswith(b'RFB '):
+            raise RFBError(f'Not an RFB server: {version!r}')
+        try:
+            minor = int(version[8:11])
+        except ValueError:
+            raise RFBError(f'Invalid RFB version: {version!r}') from None
+        # 3.3, 3.7 and 3.8 are defined, later minor versions behave like 3.8
+        minor = 8 if minor >= 8 else 7 if minor == 7 else 3
+        self._writer.write(b'RFB 003.%03d\n' % minor)
+        return minor
+
+    async def _authenticate(self, minor: int):
+        if minor == 3:
+            (security_type,) = unpack('>I', await self._read(4))
+            if security_type == 0:
+                raise RFBError(f'Connection refused: {await self._read_reason()}')
+        else:
+            (count,) = unpack('>B', await self._read(1))
+            if count == 0:
+                raise RFBError(f'Connection refused: {await self._read_reason()}')
+            offered = await self._read(count)
+            if SECURITY_VNC_AUTH in offered and (
+                self.password or SECURITY_NONE not in offered
+            ):
+                security_type = SECURITY_VNC_AUTH
+            elif SECURITY_NONE in offered:
+                security_type = SECURITY_NONE
+            else:
+                raise RFBError(f'No supported security type in {list(offered)}')
+            self._writer.write(pack('>B', security_type))
+
+        if security_type == SECURITY_VNC_AUTH:
+            if not self.password:
+                raise RFBError('VNC server requires a password')
+            challenge = await self._read(16)
+            self._writer.write(vnc_auth_response(self.password, challenge))
+        elif security_type != SECURITY_NONE:
+            raise RFBError(f'Unsupported security type {security_type}')
+
+        # 3.8 always sends a SecurityResult, earlier versions only after VNC auth
+        if security_type == SECURITY_VNC_AUTH or minor == 8:
+            (result,) = unpack('>I', await self._read(4))
+            if result != 0:
+                reason = await self._read_reason() if minor == 8 else ''
+                raise RFBError(f'VNC authentication failed {reason}'.strip())
+
+    async def _read_reason(self) -> str:
+        (length,) = unpack('>I', await self._read(4))
+        return (await self._read(length)).decode('utf-8', errors='replace')
+
+    async def _read(self, n: int) -> bytes:
+        try:
+            return await self._reader.readexactly(n)
+        except asyncio.IncompleteReadError:
+            raise RFBError('Connection closed by VNC server') from None
+
+    def _raise_if_failed(self):
+        if self._error is not None:
+            raise RFBError(f'VNC connection failed: {self._error}') from self._error
+        if self._writer is None or self._read_task is None or self._read_task.done():
+            raise RFBError('VNC connection is closed')
+
+    async def close(self):
+        if self._read_task is not None:
+            self._read_task.cancel()
+            with contextlib.suppress(BaseException):
+                await self._read_task
+            self._read_task = None
+        if self._writer is not None:
+            self._writer.close()
+            with contextlib.suppress(OSError, RFBError):
+                await self._writer.wait_closed()
+            self._writer = None
+
+    # --- Client to server messages ---
+
+    def send(self, data: bytes):
+        """Queue messages for the server, see flush()."""
+        self._raise_if_failed()
+        self._writer.write(data)
+
+    async def flush(self):
+        """Wait until queued messages have been handed to the network."""
+        self._raise_if_failed()
+        await self._writer.drain()
+
+    def batch(self) -> InputBatch:
+        """Start a batch of input events at the current pointer state."""
+        return InputBatch(self.pointer, self.buttons)
+
+    async def send_batch(self, batch: InputBatch):
+        """Send the writes of a batch, each at its delay after the first.
+
+        Delays are measured from the start of the batch, so the time spent
+        writing does not add up over many delays.
+        """
+        loop = asyncio.get_running_loop()
+        due = loop.time()
+        for delay, data, pointer_state in batch.writes:
+            if delay:
+                due += delay
+                await asyncio.sleep(max(0.0, due - loop.time()))
+            if data:
+                self.send(bytes(data))
+                if pointer_state is not None:
+                    self.pointer, self.buttons = pointer_state
+                    self.pointer_known = True
+                await self.flush()
+
+    def _request_update(self, incremental: bool):
+        self._writer.write(
+            pack('>BBHHHH', 3, 1 if incremental else 0, 0, 0, self.width, self.height)
+        )
+
+    def pause_updates(self):
+        """Stop keeping the framebuffer current, e.g. while nobody uses it."""
+        self.updates_paused = True
+
+    def resume_updates(self):
+        """Request updates again, starting with the changes made meanwhile."""
+        if not self.updates_paused:
+            return
+        self.updates_paused = False
+        if self.connected:
+            self._request_update(incremental=not self._full_update_needed)
+            self._full_update_needed = False
+
+    # --- Framebuffer ---
+
+    def snapshot(self, cursor: bool = False) -> Image.Image:
+        """Return a copy of the current framebuffer.
+
+        With cursor, the cursor shape is drawn at the pointer position: the
+        server leaves it out of the framebuffer once the client takes the
+        Cursor pseudo-encoding.
+        """
+        self._raise_if_failed()
+        image = self.framebuffer.copy()
+        if cursor and self.cursor is not None and self.pointer_known:
+            x, y = self.pointer
+            hotspot_x, hotspot_y = self.cursor_hotspot
+            image.paste(self.cursor, (x - hotspot_x, y - hotspot_y), self.cursor)
+        return image
+
+    async def refresh(self, timeout: float) -> bool:
+        """Ask the server for its pending changes now and wait for them.
+
+        Requests a single pixel, which the server answers right away together
+        with the changes it has not sent yet. Returns False on timeout.
+        """
+        event = self._update_event
+        self.send(pack('>BBHHHH', 3, 0, 0, 0, 1, 1))
+        await self.flush()
+        return await self._wait_for(event, timeout)
+
+    async def ping(self, timeout: float):
+        """Request a single pixel and wait for the server to answer."""
+        if not await self.refresh(timeout):
+            raise RFBError(f'No answer from VNC server within {timeout}s')
+
+    async def wait_for_update(self, timeout: Optional[float] = None) -> bool:
+        """Wait for the next framebuffer update. Returns False on timeout."""
+        self._raise_if_failed()
+        return await self._wait_for(self._update_event, timeout)
+
+    async def _wait_for(self, event: asyncio.Event, timeout: Optional[float]) -> bool:
+        try:
+            await asyncio.wait_for(event.wait(), timeout)
+        except TimeoutError:
+            return False
+        self._raise_if_failed()
+        return True
+
+    def _signal_update(self):
+        event, self._update_event = self._update_event, asyncio.Event()
+        event.set()
+
+    # --- Server to client messages ---
+
+    async def _read_loop(self):
+        try:
+            while True:
+                (message_type,) = unpack('>B', await self._read(1))
+                if message_type == 0:
+                    await self._read_framebuffer_update()
+                elif message_type == 1:
+                    # SetColourMapEntries, not used with true colour
+                    _, count = unpack('>xHH', await self._read(5))
+                    await self._read(count * 6)
+                elif message_type == 2:
+                    pass  # Bell
+                elif message_type == 3:
+                    (length,) = unpack('>xxxI', await self._read(7))
+                    self.server_cut_text = (await self._read(length)).decode('latin-1')
+                else:
+                    raise RFBError(f'Unknown server message type {message_type}')
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.warning(f'VNC connection to {self.host}:{self.port} failed: {e}')
+            self._error = e
+            # Wake up everyone waiting for an update, they check _error
+            self._signal_update()
+
+    async def _read_framebuffer_update(self):
+        (count,) = unpack('>xH', await self._read(3))
+        for _ in range(count):
+            x, y, w, h, encoding = unpack('>HHHHi', await self._read(12))
+            if encoding == ENCODING_LAST_RECT:
+                break
+            await self._read_rectangle(x, y, w, h, encoding)
+
+        self.updates += 1
+        self._signal_update()
+        if self.updates_paused:
+            return
+        # Ask for the next change right away, to keep the framebuffer current
+        self._request_update(incremental=not self._full_update_needed)
+        self._full_update_needed = False
+
+    async def _decode(
+        self, pixels: int, decode: Callable[..., Image.Image], *args
+    ) -> Image.Image:
+        """Run a decoder, in a worker thread if the rectangle is large."""
+        if pixels >= THREADED_DECODE_MIN_PIXELS:
+            return await asyncio.to_thread(decode, *args)
+        return decode(*args)
+
+    async def _read_rectangle(self, x: int, y: int, w: int, h: int, encoding: int):
+        if encoding == ENCODING_RAW:
+            data = await self._read(w * h * 4)
+            image = await self._decode(
+                w * h, Image.frombytes, 'RGB', (w, h), data, 'raw', 'RGBX'
+            )
+            self._paste(image, x, y)
+        elif encoding == ENCODING_COPYRECT:
+            src_x, src_y = unpack('>HH', await self._read(4))
+            region = self.framebuffer.crop((src_x, src_y, src_x + w, src_y + h))
+            self._paste(region, x, y)
+        elif encoding == ENCODING_ZRLE:
+            (length,) = unpack('>I', await self._read(4))
+            data = await self._read(length)
+            image = await self._decode(w * h, self._decode_zrle, w, h, data)
+            self._paste(image, x, y)
+        elif encoding == ENCODING_TIGHT:
+            await self._read_tight(x, y, w, h)
+        elif encoding == ENCODING_CURSOR:
+            pixels = await self._read(w * h * 4)
+            mask = await self._read((w + 7) // 8 * h)
+            self._set_cursor(x, y, w, h, pixels, mask)
+        elif encoding == ENCODING_POINTER_POS:
+            self.pointer = (x, y)
+            self.pointer_known = True
+        elif encoding == ENCODING_DESKTOP_SIZE:
+            self._resize(w, h)
+        else:
+            raise RFBError(f'Unexpected encoding {encoding}')
+
+    def _paste(self, image: Image.Image, x: int, y: int):
+        self.framebuffer.paste(image, (x, y))
+
+    def _fill(self, color: bytes, x: int, y: int, w: int, h: int):
+        self.framebuffer.paste(tuple(color), (x, y, x + w, y + h))
+
+    def _resize(self, width: int, height: int):
+        logger.info(f'VNC desktop {self.host}:{self.port} resized to {width}x{height}')
+        framebuffer = Image.new('RGB', (width, height))
+        framebuffer.paste(self.framebuffer, (0, 0))
+        self.framebuffer = framebuffer
+        self.width, self.height = width, height
+        self._full_update_needed = True
+
+    def _set_cursor(self, x, y, w, h, pixels: bytes, mask: bytes):
+        if not w or not h:
+            self.cursor = None
+            return
+        cursor = Image.frombytes('RGB', (w, h), pixels, 'raw', 'RGBX')
+        cursor.putalpha(Image.frombytes('1', (w, h), mask).convert('L'))
+        self.cursor = cursor
+        self.cursor_hotspot = (x, y)
+
+    def _decode_zrle(self, w: int, h: int, data: bytes) -> Image.Image:
+        return _decode_zrle_tiles(self._zrle_stream.decompress(data), w, h)
+
+    async def _read_tight(self, x: int, y: int, w: int, h: int):
+        (control,) = unpack('>B', await self._read(1))
+        for stream_id in range(4):
+            if control & (1 << stream_id):
+                self._tight_streams[stream_id] = zlib.decompressobj()
+        compression = control >> 4
+
+        if compression == 0x08:
+            # Fill
+            self._fill(await self._read(3), x, y, w, h)
+            return
+        if compression == 0x09:
+            # JPEG
+            data = await self._read(await self._read_compact_length())
+            self._paste(await self._decode(w * h, _decode_jpeg, data), x, y)
+            return
+        if compression & 0x08:
+            raise RFBError(f'Invalid Tight compression control {control:#x}')
+
+        # Basic compression, with an optional filter
+        stream_id = compression & 0x03
+        filter_id = 0
+        if compression & 0x04:
+            (filter_id,) = unpack('>B', await self._read(1))
+
+        palette = None
+        if filter_id == 1:
+            (colors,) = unpack('>B', await self._read(1))
+            palette = await self._read((colors + 1) * 3)
+            size = (w + 7) // 8 * h if colors == 1 else w * h
+        elif filter_id in (0, 2):
+            size = w * h * 3
+        else:
+            raise RFBError(f'Invalid Tight filter {filter_id}')
+
+        # Data shorter than TIGHT_MIN_TO_COMPRESS is sent as is
+        compressed = size >= TIGHT_MIN_TO_COMPRESS
+        if compressed:
+            size = await self._read_compact_length()
+        data = await self._read(size)
+        image = await self._decode(
+            w * h,
+            _decode_tight_basic,
+            w,
+            h,
+            filter_id,
+            palette,
+            self._tight_streams[stream_id] if compressed else None,
+            data,
+        )
+        self._paste(image, x, y)
+
+    async def _read_compact_length(self) -> int:
+        length = 0
+        for shift in (0, 7, 14):
+            (byte,) = unpack('>B', await self._read(1))
+            if shift == 14:
+                return length | byte << 14
+            length |= (byte & 0x7F) << shift
+            if not byte & 0x80:
+                return length
+        return length
+
+
+def _decode_zrle_tiles(data: bytes, w: int, h: int) -> Image.Image:
+    """Decode the (decompressed) tiles of a ZRLE rectangle."""
+    image = Image.new('RGB', (w, h))
+    pos = 0
+    for tile_y in range(0, h, ZRLE_TILE_SIZE):
+        tile_h = min(ZRLE_TILE_SIZE, h - tile_y)
+        for tile_x in range(0, w, ZRLE_TILE_SIZE):
+            tile_w = min(ZRLE_TILE_SIZE, w - tile_x)
+            subencoding = data[pos]
+            pos += 1
+
+            if subencoding == 0:
+                size = tile_w * tile_h * 3
+                tile = Image.frombytes('RGB', (tile_w, tile_h), data[pos : pos + size])
+                pos += size
+            elif subencoding == 1:
+                color = tuple(data[pos : pos + 3])
+                pos += 3
+                image.paste(color, (tile_x, tile_y, tile_x + tile_w, tile_y + tile_h))
+                continue
+            elif 2 <= subencoding <= 16:
+                palette = data[pos : pos + subencoding * 3]
+                pos += subencoding * 3
+                bits = 1 if subencoding == 2 else 2 if subencoding <= 4 else 4
+                size = (tile_w * bits + 7) // 8 * tile_h
+                tile = Image.frombytes(
+                    'P', (tile_w, tile_h), data[pos : pos + size], 'raw', f'P;{bits}'
+                )
+                pos += size
+                tile.putpalette(palette)
+                tile = tile.convert('RGB')
+            elif subencoding == 128 or subencoding >= 130:
+                palette = None
+                if subencoding >= 130:
+                    palette = data[pos : pos + (subencoding - 128) * 3]
+                    pos += len(palette)
+                pixels, pos = _decode_zrle_rle(data, pos, tile_w * tile_h, palette)
+                tile = Image.frombytes('RGB', (tile_w, tile_h), pixels)
+            else:
+                raise RFBError(f'Invalid ZRLE subencoding {subencoding}')
+            image.paste(tile, (tile_x, tile_y))
+    return image
+
+
+def _decode_zrle_rle(
+    data: bytes, pos: int, count: int, palette: Optional[bytes]
+) -> Tuple[bytes, int]:
+    """Decode a plain (palette None) or palette RLE ZRLE tile of count pixels.
+
+    Only the run headers are parsed one by one, the pixels of all runs are
+    expanded at once.
+    """
+    # Plain RLE: offset of each run's color in data, palette RLE: its index
+    colors = []
+    runs = []
+    remaining = count
+    while remaining > 0:
+        if palette is None:
+            colors.append(pos)
+            pos += 3
+            has_run = True
+        else:
+            index = data[pos]
+            pos += 1
+            colors.append(index & 0x7F)
+            has_run = index & 0x80
+
+        run = 1
+        if has_run:
+            while True:
+                byte = data[pos]
+                pos += 1
+                run += byte
+                if byte != 255:
+                    break
+        run = min(run, remaining)
+        runs.append(run)
+        remaining -= run
+
+    if palette is None:
+        pixels = np.frombuffer(data, np.uint8)
+        offsets = np.array(colors)[:, None] + np.arange(3)
+        color_values = pixels[offsets]
+    else:
+        color_values = np.frombuffer(palette, np.uint8).reshape(-1, 3)[colors]
+    return np.repeat(color_values, runs, axis=0).tobytes(), pos
+
+
+def _decode_gradient(data: bytes, width: int, height: int) -> bytes:
+    """Undo the Tight gradient filter (each value is stored as the difference
+    to the prediction left + above - above left).
+
+    A pixel only depends on pixels left of and above it, so the pixels of
+    each anti-diagonal are decoded together, from the top left corner.
+    """
+    differences = np.frombuffer(data, np.uint8).reshape(height, width, 3)
+    # With a row of zeros above and a column of zeros left of the pixels
+    output = np.zeros((height + 1, width + 1, 3), np.int16)
+    for diagonal in range(width + height - 1):
+        ys = np.arange(max(0, diagonal - width + 1), min(diagonal, height - 1) + 1)
+        xs = diagonal - ys
+        prediction = output[ys + 1, xs] + output[ys, xs + 1] - output[ys, xs]
+        output[ys + 1, xs + 1] = (
+            differences[ys, xs] + np.clip(prediction, 0, 255)
+        ) & 0xFF
+    return output[1:, 1:].astype(np.uint8).tobytes()
+
+
+def _decode_tight_basic(
+    w: int,
+    h: int,
+    filter_id: int,
+    palette: Optional[bytes],
+    stream,
+    data: bytes,
+) -> Image.Image:
+    """Decode a Tight rectangle with basic compression, decompressing data
+    with the rectangle's zlib stream first unless it was sent as is."""
+    if stream is not None:
+        data = stream.decompress(data)
+    if filter_id == 1:
+        raw_mode = 'P;1' if len(palette) == 6 else 'P'
+        image = Image.frombytes('P', (w, h), data, 'raw', raw_mode)
+        image.putpalette(palette)
+        return image.convert('RGB')
+    if filter_id == 2:
+        data = _decode_gradient(data, w, h)
+    return Image.frombytes('RGB', (w, h), data)
+
+
+def _decode_jpeg(data: bytes) -> Image.Image:
+    return Image.open(io.BytesIO(data)).convert('RGB')
+
+
+def vnc_auth_response(password: str, challenge: bytes) -> bytes:
+    key = password.encode('latin-1', errors='replace')[:8].ljust(8, b'\x00')
+    key = bytes(int(f'{byte:08b}'[::-1], 2) for byte in key)
+    subkeys = _des_subkeys(key)
+    return _des_encrypt_block(subkeys, challenge[:8]) + _des_encrypt_block(
+        subkeys, challenge[8:16]
+    )
+
+
+_DES_IP = (
+    58, 50, 42, 34, 26, 18, 10, 2, 60, 52, 44, 36, 28, 20, 12, 4,
+    62, 54, 46, 38, 30, 22, 14, 6, 64, 56, 48, 40, 32, 24, 16, 8,
+    57, 49, 41, 33, 25, 17, 9, 1, 59, 51, 43, 35, 27, 19, 11, 3,
+    61, 53, 45, 37, 29, 21, 13, 5, 63, 55, 47, 39, 31, 23, 15, 7,
+)  # fmt: skip
+_DES_FP = (
+    40, 8, 48, 16, 56, 24, 64, 32, 39, 7, 47, 15, 55, 23, 63, 31,
+    38, 6, 46, 14, 54, 22, 62, 30, 37, 5, 45, 13, 53, 21, 61, 29,
+    36, 4, 44, 12, 52, 20, 60, 28, 35, 3, 43, 11, 51, 19, 59, 27,
+    34, 2, 42, 10, 50, 18, 58, 26, 33, 1, 41, 9, 49, 17, 57, 25,
+)  # fmt: skip
+_DES_E = (
+    32, 1, 2, 3, 4, 5, 4, 5, 6, 7, 8, 9, 8, 9, 10, 11,
+    12, 13, 12, 13, 14, 15, 16, 17, 16, 17, 18, 19, 20, 21, 20, 21,
+    22, 23, 24, 25, 24, 25, 26, 27, 28, 29, 28, 29, 30, 31, 32, 1,
+)  # fmt: skip
+_DES_P = (
+    16, 7, 20, 21, 29, 12, 28, 17, 1, 15, 23, 26, 5, 18, 31, 10,
+    2, 8, 24, 14, 32, 27, 3, 9, 19, 13, 30, 6, 22, 11, 4, 25,
+)  # fmt: skip
+_DES_PC1 = (
+    57, 49, 41, 33, 25, 17, 9, 1, 58, 50, 42, 34, 26, 18,
+    10, 2, 59, 51, 43, 35, 27, 19, 11, 3, 60, 52, 44, 36,
+    63, 55, 47, 39, 31, 23, 15, 7, 62, 54, 46, 38, 30, 22,
+    14, 6, 61, 53, 45, 37, 29, 21, 13, 5, 28, 20, 12, 4,
+)  # fmt: skip
+_DES_PC2 = (
+    14, 17, 11, 24, 1, 5, 3, 28, 15, 6, 21, 10,
+    23, 19, 12, 4, 26, 8, 16, 7, 27, 20, 13, 2,
+    41, 52, 31, 37, 47, 55, 30, 40, 51, 45, 33, 48,
+    44, 49, 39, 56, 34, 53, 46, 42, 50, 36, 29, 32,
+)  # fmt: skip
+_DES_SHIFTS = (1, 1, 2, 2, 2, 2, 2, 2, 1, 2, 2, 2, 2, 2, 2, 1)
+_DES_SBOXES = (
+    (
+        14, 4, 13, 1, 2, 15, 11, 8, 3, 10, 6, 12, 5, 9, 0, 7,
+        0, 15, 7, 4, 14, 2, 13, 1, 10, 6, 12, 11, 9, 5, 3, 8,
+        4, 1, 14, 8, 13, 6, 2, 11, 15, 12, 9, 7, 3, 10, 5, 0,
+        15, 12, 8, 2, 4, 9, 1, 7, 5, 11, 3, 14, 10, 0, 6, 13,
+    ),
+    (
+        15, 1, 8, 14, 6, 11, 3, 4, 9, 7, 2, 13, 12, 0, 5, 10,
+        3, 13, 4, 7, 15, 2, 8, 14, 12, 0, 1, 10, 6, 9, 11, 5,
+        0, 14, 7, 11, 10, 4, 13, 1, 5, 8, 12, 6, 9, 3, 2, 15,
+        13, 8, 10, 1, 3, 15, 4, 2, 11, 6, 7, 12, 0, 5, 14, 9,
+    ),
+    (
+        10, 0, 9, 14, 6, 3, 15, 5, 1, 13, 12, 7, 11, 4, 2, 8,
+        13, 7, 0, 9, 3, 4, 6, 10, 2, 8, 5, 14, 12, 11, 15, 1,
+        13, 6, 4, 9, 8, 15, 3, 0, 11, 1, 2, 12, 5, 10, 14, 7,
+        1, 10, 13, 0, 6, 9, 8, 7, 4, 15, 14, 3, 11, 5, 2, 12,
+    ),
+    (
+        7, 13, 14, 3, 0, 6, 9, 10, 1, 2, 8, 5, 11, 12, 4, 15,
+        13, 8, 11, 5, 6, 15, 0, 3, 4, 7, 2, 12, 1, 10, 14, 9,
+        10, 6, 9, 0, 12, 11, 7, 13, 15, 1, 3, 14, 5, 2, 8, 4,
+        3, 15, 0, 6, 10, 1, 13, 8, 9, 4, 5, 11, 12, 7, 2, 14,
+    ),
+    (
+        2, 12, 4, 1, 7, 10, 11, 6, 8, 5, 3, 15, 13, 0, 14, 9,
+        14, 11, 2, 12, 4, 7, 13, 1, 5, 0, 15, 10, 3, 9, 8, 6,
+        4, 2, 1, 11, 10, 13, 7, 8, 15, 9, 12, 5, 6, 3, 0, 14,
+        11, 8, 12, 7, 1, 14, 2, 13, 6, 15, 0, 9, 10, 4, 5, 3,
+    ),
+    (
+        12, 1, 10, 15, 9, 2, 6, 8, 0, 13, 3, 4, 14, 7, 5, 11,
+        10, 15, 4, 2, 7, 12, 9, 5, 6, 1, 13, 14, 0, 11, 3, 8,
+        9, 14, 15, 5, 2, 8, 12, 3, 7, 0, 4, 10, 1, 13, 11, 6,
+        4, 3, 2, 12, 9, 5, 15, 10, 11, 14, 1, 7, 6, 0, 8, 13,
+    ),
+    (
+        4, 11, 2, 14, 15, 0, 8, 13, 3, 12, 9, 7, 5, 10, 6, 1,
+        13, 0, 11, 7, 4, 9, 1, 10, 14, 3, 5, 12, 2, 15, 8, 6,
+        1, 4, 11, 13, 12, 3, 7, 14, 10, 15, 6, 8, 0, 5, 9, 2,
+        6, 11, 13, 8, 1, 4, 10, 7, 9, 5, 0, 15, 14, 2, 3, 12,
+    ),
+    (
+        13, 2, 8, 4, 6, 15, 11, 1, 10, 9, 3, 14, 5, 0, 12, 7,
+        1, 15, 13, 8, 10, 3, 7, 4, 12, 5, 6, 11, 0, 14, 9, 2,
+        7, 11, 4, 1, 9, 12, 14, 2, 0, 6, 10, 13, 15, 3, 5, 8,
+        2, 1, 14, 7, 4, 10, 8, 13, 15, 12, 9, 0, 3, 5, 6, 11,
+    ),
+)  # fmt: skip
+
+
+def _permute(value: int, table, input_bits: int) -> int:
+    result = 0
+    for position in table:
+        result = (result << 1) | ((value >> (input_bits - position)) & 1)
+    return result
+
+
+def _des_subkeys(key: bytes):
+    key_bits = _permute(int.from_bytes(key, 'big'), _DES_PC1, 64)
+    c, d = key_bits >> 28, key_bits & 0xFFFFFFF
+    subkeys = []
+    for shift in _DES_SHIFTS:
+        c = ((c << shift) | (c >> (28 - shift))) & 0xFFFFFFF
+        d = ((d << shift) | (d >> (28 - shift))) & 0xFFFFFFF
+        subkeys.append(_permute((c << 28) | d, _DES_PC2, 56))
+    return subkeys
+
+
+def _des_round(right: int, subkey: int) -> int:
+    expanded = _permute(right, _DES_E, 32) ^ subkey
+    output = 0
+    for i, sbox in enumerate(_DES_SBOXES):
+        chunk = (expanded >> (42 - 6 * i)) & 0x3F
+        row = ((chunk >> 4) & 0x2) | (chunk & 0x1)
+        output = (output << 4) | sbox[row * 16 + ((chunk >> 1) & 0xF)]
+    return _permute(output, _DES_P, 32)
+
+
+def _des_encrypt_block(subkeys, block: bytes) -> bytes:
+    bits = _permute(int.from_bytes(block, 'big'), _DES_IP, 64)
+    left, right = bits >> 32, bits & 0xFFFFFFFF
+    for subkey in subkeys:
+        left, right = right, left ^ _des_round(right, subkey)
+    return _permute((right << 32) | left, _DES_FP, 64).to_bytes(8, 'big')
@@ -0,0 +1,294 @@
+import asyncio
+import random
+import zlib
+from struct import pack
+
+import pytest
+from PIL import Image, ImageChops
+
+from .rfb import (
+    ENCODING_TIGHT,
+    ENCODING_ZRLE,
+    InputBatch,
+    RFBClient,
+    _decode_gradient,
+    pointer_event_message,
+    vnc_auth_response,
+)
+
+
+def make_client(width: int, height: int) -> RFBClient:
+    client = RFBClient('localhost')
+    client.width, client.height = width, height
+    client.framebuffer = Image.new('RGB', (width, height))
+    return client
+
+
+def read_rectangle(client, data, x, y, w, h, encoding):
+    async def read():
+        reader = asyncio.StreamReader()
+        reader.feed_data(data)
+        reader.feed_eof()
+        client._reader = reader
+        await client._read_rectangle(x, y, w, h, encoding)
+        assert reader.at_eof(), 'rectangle not read completely'
+
+    asyncio.run(read())
+
+
+def random_image(w, h, seed=0):
+    pixels = random.Random(seed).randbytes(w * h * 3)
+    return Image.frombytes('RGB', (w, h), pixels)
+
+
+def run_length(run):
+    """ZRLE run length bytes of a run of run pixels."""
+    run -= 1
+    return bytes([255] * (run // 255) + [run % 255])
+
+
+def pack_rows(rows, bits):
+    """Pack rows of palette indexes, first pixel in the high bits, every row
+    padded to whole bytes."""
+    data = bytearray()
+    for row in rows:
+        length = (len(row) * bits + 7) // 8
+        value = int(''.join(f'{index:0{bits}b}' for index in row), 2)
+        data += (value << (length * 8 - len(row) * bits)).to_bytes(length, 'big')
+    return bytes(data)
+
+
+def compact_length(length):
+    data = bytearray([length & 0x7F])
+    if length > 0x7F:
+        data[0] |= 0x80
+        data.append(length >> 7 & 0x7F)
+        if length > 0x3FFF:
+            data[1] |= 0x80
+            data.append(length >> 14)
+    return bytes(data)
+
+
+def assert_same(a, b):
+    assert ImageChops.difference(a, b).getbbox() is None
+
+
+def test_zrle_tiles():
+    # 140x66 pixels are six tiles, 64x64, 64x64 and 12x64 in the first row,
+    # 64x2, 64x2 and 12x2 in the second
+    expected = Image.new('RGB', (140, 66))
+    data = bytearray()
+
+    # Raw
+    tile = random_image(64, 64, seed=1)
+    data += b'\x00' + tile.tobytes()
+    expected.paste(tile, (0, 0))
+
+    # Plain RLE, with run lengths of one and several bytes
+    runs = [(bytes([1, 1, 1]), 1), (bytes([2, 2, 2]), 255), (bytes([3, 3, 3]), 256)]
+    runs.append((bytes([4, 4, 4]), 64 * 64 - 512))
+    data += b'\x80'
+    for color, run in runs:
+        data += color + run_length(run)
+    pixels = b''.join(color * run for color, run in runs)
+    expected.paste(Image.frombytes('RGB', (64, 64), pixels), (64, 0))
+
+    # Packed palette, 3 colors with 2 bits per pixel
+    palette = [bytes([255, 0, 0]), bytes([0, 255, 0]), bytes([0, 0, 255])]
+    rng = random.Random(2)
+    rows = [[rng.randrange(3) for _ in range(12)] for _ in range(64)]
+    data += b'\x03' + b''.join(palette) + pack_rows(rows, 2)
+    pixels = b''.join(palette[index] for row in rows for index in row)
+    expected.paste(Image.frombytes('RGB', (12, 64), pixels), (128, 0))
+
+    # Solid
+    data += b'\x01' + bytes([10, 20, 30])
+    expected.paste((10, 20, 30), (0, 64, 64, 66))
+
+    # Palette RLE, single pixels and runs
+    palette = [bytes([50, 60, 70]), bytes([80, 90, 100])]
+    data += bytes([128 + 2]) + b''.join(palette)
+    data += bytes([0, 1, 0x80]) + run_length(125) + bytes([1])
+    pixels = palette[0] + palette[1] + palette[0] * 125 + palette[1]
+    expected.paste(Image.frombytes('RGB', (64, 2), pixels), (64, 64))
+
+    # Packed palette, 2 colors with 1 bit per pixel and rows padded to bytes
+    palette = [bytes([7, 8, 9]), bytes([9, 8, 7])]
+    rows = [[0] * 6 + [1] * 6, [1] * 12]
+    data += b'\x02' + b''.join(palette) + pack_rows(rows, 1)
+    pixels = b''.join(palette[index] for row in rows for index in row)
+    expected.paste(Image.frombytes('RGB', (12, 2), pixels), (128, 64))
+
+    compressor = zlib.compressobj()
+    compressed = compressor.compress(bytes(data)) + compressor.flush(zlib.Z_SYNC_FLUSH)
+    client = make_client(150, 70)
+    read_rectangle(
+        client,
+        pack('>I', len(compressed)) + compressed,
+        5,
+        3,
+        140,
+        66,
+        ENCODING_ZRLE,
+    )
+
+    assert_same(client.framebuffer.crop((5, 3, 145, 69)), expected)
+    assert client.framebuffer.getpixel((4, 2)) == (0, 0, 0)
+
+
+def test_zrle_stream_continues_across_rectangles():
+    compressor = zlib.compressobj()
+    client = make_client(4, 4)
+    for color in ((1, 2, 3), (4, 5, 6)):
+        compressed = compressor.compress(b'\x01' + bytes(color))
+        compressed += compressor.flush(zlib.Z_SYNC_FLUSH)
+        data = pack('>I', len(compressed)) + compressed
+        read_rectangle(client, data, 0, 0, 4, 4, ENCODING_ZRLE)
+        assert client.framebuffer.getpixel((3, 3)) == color
+
+
+def test_tight_fill():
+    client = make_client(20, 10)
+    read_rectangle(client, bytes([0x80, 9, 8, 7]), 2, 3, 5, 4, ENCODING_TIGHT)
+    assert client.framebuffer.getpixel((2, 3)) == (9, 8, 7)
+    assert client.framebuffer.getpixel((6, 6)) == (9, 8, 7)
+    assert client.framebuffer.getpixel((7, 7)) == (0, 0, 0)
+
+
+def test_tight_palette():
+    colors = [bytes([255, 255, 255]), bytes([0, 0, 128])]
+    rng = random.Random(3)
+    rows = [[rng.randrange(2) for _ in range(13)] for _ in range(9)]
+    compressor = zlib.compressobj()
+    compressed = compressor.compress(pack_rows(rows, 1))
+    compressed += compressor.flush(zlib.Z_SYNC_FLUSH)
+    # Stream 1 with the palette filter, 2 colors with 1 bit per pixel
+    data = bytes([0x50, 1, 1]) + b''.join(colors)
+    data += compact_length(len(compressed)) + compressed
+
+    client = make_client(13, 9)
+    read_rectangle(client, data, 0, 0, 13, 9, ENCODING_TIGHT)
+
+    expected = b''.join(colors[index] for row in rows for index in row)
+    assert client.framebuffer.tobytes() == expected
+
+
+def test_tight_palette_many_colors():
+    colors = [bytes([i * 40, 0, 255 - i * 40]) for i in range(5)]
+    rng = random.Random(6)
+    indexes = bytes(rng.randrange(5) for _ in range(10 * 10))
+    compressor = zlib.compressobj()
+    compressed = compressor.compress(indexes) + compressor.flush(zlib.Z_SYNC_FLUSH)
+    # Stream 2 with the palette filter, one byte per pixel
+    data = bytes([0x60, 1, 4]) + b''.join(colors)
+    data += compact_length(len(compressed)) + compressed
+
+    client = make_client(10, 10)
+    read_rectangle(client, data, 0, 0, 10, 10, ENCODING_TIGHT)
+
+    assert client.framebuffer.tobytes() == b''.join(colors[i] for i in indexes)
+
+
+def gradient_encode(image):
+    """Tight gradient filter, by its definition."""
+    w, h = image.size
+    pixels = image.tobytes()
+    row = w * 3
+    data = bytearray(len(pixels))
+    for i, value in enumerate(pixels):
+        x, y = i % row // 3, i // row
+        left = pixels[i - 3] if x else 0
+        above = pixels[i - row] if y else 0
+        above_left = pixels[i - row - 3] if x and y else 0
+        prediction = min(max(left + above - above_left, 0), 255)
+        data[i] = (value - prediction) & 0xFF
+    return bytes(data)
+
+
+@pytest.mark.parametrize('size', [(1, 1), (1, 7), (9, 1), (12, 8), (5, 30)])
+def test_decode_gradient(size):
+    image = random_image(*size, seed=sum(size))
+    assert _decode_gradient(gradient_encode(image), *size) == image.tobytes()
+
+
+def test_tight_gradient():
+    # Large enough to be decoded in a worker thread
+    image = random_image(80, 60, seed=4)
+    compressor = zlib.compressobj()
+    encoded = gradient_encode(image)
+    compressed = compressor.compress(encoded) + compressor.flush(zlib.Z_SYNC_FLUSH)
+    data = bytes([0x40, 2]) + compact_length(len(compressed)) + compressed
+
+    client = make_client(80, 60)
+    read_rectangle(client, data, 0, 0, 80, 60, ENCODING_TIGHT)
+
+    assert client.framebuffer.tobytes() == image.tobytes()
+
+
+def test_tight_uncompressed_data():
+    # Less than 12 bytes of pixel data are sent as is
+    image = random_image(3, 1, seed=5)
+    client = make_client(3, 1)
+    read_rectangle(client, b'\x00' + image.tobytes(), 0, 0, 3, 1, ENCODING_TIGHT)
+    assert client.framebuffer.tobytes() == image.tobytes()
+
+
+@pytest.mark.parametrize('length', [0, 1, 0x7F, 0x80, 0x3FFF, 0x4000, 0x3FFFFF])
+def test_compact_length(length):
+    async def read():
+        reader = asyncio.StreamReader()
+        reader.feed_data(compact_length(length) + b'rest')
+        reader.feed_eof()
+        client = RFBClient('localhost')
+        client._reader = reader
+        return await client._read_compact_length(), await reader.read()
+
+    assert asyncio.run(read()) == (length, b'rest')
+
+
+def test_vnc_auth_response():
+    # FIPS 81 test vector: key 133457799BBCDFF1 encrypts 0123456789ABCDEF to
+    # 85E813540F0AB405. VNC authentication mirrors the bits of each password
+    # byte to get the key
+    password = bytes([0xC8, 0x2C, 0xEA, 0x9E, 0xD9, 0x3D, 0xFB, 0x8F]).decode('latin-1')
+    challenge = bytes.fromhex('0123456789ABCDEF') * 2
+    response = vnc_auth_response(password, challenge)
+    assert response == bytes.fromhex('85E813540F0AB405') * 2
+
+    # Passwords are cut to 8 bytes and padded with zeros, an all zero key
+    # encrypts zeros to 8CA64DE9C1B123A7
+    assert vnc_auth_response('', bytes(16)) == bytes.fromhex('8CA64DE9C1B123A7') * 2
+    assert vnc_auth_response(password + 'ignored', challenge) == response
+
+
+def test_input_batch():
+    batch = InputBatch(pointer=(1, 2), buttons=0)
+    batch.move(10, 20)
+    batch.press(1)
+    batch.delay(0.05)
+    batch.release(1)
+    batch.key(0xFF0D, True)
+    batch.key(0xFF0D, False)
+    batch.delay(0)  # No delay, same write
+    batch.cut_text('hi')
+
+    assert len(batch.writes) == 2
+    delay, data, pointer_state = batch.writes[0]
+    assert delay == 0.0
+    assert bytes(data) == pointer_event_message(10, 20, 0) + pointer_event_message(
+        10, 20, 1
+    )
+    assert pointer_state == ((10, 20), 1)
+
+    delay, data, pointer_state = batch.writes[1]
+    assert delay == 0.05
+    assert bytes(data) == (
+        bytes([5, 0, 0, 10, 0, 20])
+        + bytes([4, 1, 0, 0, 0, 0, 0xFF, 0x0D])
+        + bytes([4, 0, 0, 0, 0, 0, 0xFF, 0x0D])
+        + bytes([6, 0, 0, 0, 0, 0, 0, 2])
+        + b'hi'
+    )
+    assert pointer_state == ((10, 20), 0)
+    assert batch.pointer == (10, 20)
+    assert batch.buttons == 0
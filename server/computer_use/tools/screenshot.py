@@ -0,0 +1,255 @@
+"""
+Screenshot processing before screenshots are sent to the model.
+
+The VNC client returns full-resolution screenshots as images. Depending on
+the screenshot policy they are downscaled to fit a maximum resolution,
+optionally reduced to a color palette and encoded as PNG, WebP or JPEG.
+
+Policy defaults come from settings (SCREENSHOT_*) and can be overridden per
+target with the target's screenshot_policy, e.g.:
+
+    {"max_width": 1024, "max_height": 768, "format": "webp", "quality": 80}
+
+When a screenshot is downscaled, the model sees it, and clicks, in the scaled
+coordinate space. The computer tool advertises the scaled size of the target's
+screen (screenshot_size()) as its display size. The scale factors of the last
+screenshot are recorded per session, and scale_to_screen() maps the model's
+coordinates back.
+
+screen_unchanged() compares a screenshot with the last one sent to the model
+in the same session, so unchanged screens do not have to be sent again.
+
+screen_fingerprint() reduces a screenshot to a compact perceptual hash, used to
+recognize screens across jobs (see server/computer_use/replay.py).
+"""
+
+import base64
+import io
+import logging
+from dataclasses import dataclass, field
+from typing import Dict, Optional, Sequence, Tuple
+
+from PIL import Image, ImageChops
+
+from server.settings import settings
+
+logger = logging.getLogger(__name__)
+
+# Gray level difference up to which a pixel counts as unchanged (e.g. noise
+# from lossy encoding of the framebuffer)
+PIXEL_DIFF_THRESHOLD = 16
+
+# Width and height of the difference hash grid, fingerprints have
+# 2 * FINGERPRINT_SIZE ** 2 bits
+FINGERPRINT_SIZE = 16
+# Gray level difference from which neighbouring cells count as an edge
+FINGERPRINT_EDGE_THRESHOLD = 2
+
+# format -> (PIL format, media type)
+SCREENSHOT_FORMATS = {
+    'png': ('PNG', 'image/png'),
+    'webp': ('WEBP', 'image/webp'),
+    'jpeg': ('JPEG', 'image/jpeg'),
+}
+
+
+@dataclass(frozen=True, kw_only=True)
+class ScreenshotPolicy:
+    """How screenshots are scaled and encoded. 0 disables a limit."""
+
+    max_width: int = 0
+    max_height: int = 0
+    format: str = 'png'
+    quality: int = 80  # For webp and jpeg
+    palette_colors: int = 0  # Quantize to this many colors, 0 keeps full color
+
+    @classmethod
+    def for_target(cls, target: Optional[dict]) -> 'ScreenshotPolicy':
+        """Return the settings defaults, overridden by the target's policy."""
+        values = {
+            'max_width': settings.SCREENSHOT_MAX_WIDTH,
+            'max_height': settings.SCREENSHOT_MAX_HEIGHT,
+            'format': settings.SCREENSHOT_FORMAT,
+            'quality': settings.SCREENSHOT_QUALITY,
+            'palette_colors': settings.SCREENSHOT_PALETTE_COLORS,
+        }
+        overrides = (target or {}).get('screenshot_policy') or {}
+        for key, value in overrides.items():
+            if key in values:
+                values[key] = value
+            else:
+                logger.warning(f'Ignoring unknown screenshot policy option {key}')
+        if values['format'] not in SCREENSHOT_FORMATS:
+            logger.warning(
+                f'Unknown screenshot format {values["format"]}, using png instead'
+            )
+            values['format'] = 'png'
+        return cls(**values)
+
+
+@dataclass(frozen=True, kw_only=True)
+class ProcessedScreenshot:
+    base64_image: str
+    media_type: str
+    width: int
+    height: int
+    # Screenshot pixels per screen pixel
+    scale_x: float = 1.0
+    scale_y: float = 1.0
+    # Grayscale version of the screenshot, for change detection
+    frame: Optional[Image.Image] = field(default=None, repr=False, compare=False)
+
+
+def screenshot_size(
+    width: int, height: int, policy: ScreenshotPolicy
+) -> Tuple[int, int]:
+    """Return the size screenshots of a width x height screen are sent at."""
+    scale = 1.0
+    if policy.max_width > 0:
+        scale = min(scale, policy.max_width / width)
+    if policy.max_height > 0:
+        scale = min(scale, policy.max_height / height)
+    if scale >= 1.0:
+        return width, height
+    return max(1, round(width * scale)), max(1, round(height * scale))
+
+
+def process_screenshot(
+    image: Image.Image, policy: ScreenshotPolicy
+) -> ProcessedScreenshot:
+    """Scale and encode a screenshot according to policy.
+
+    CPU bound, call it from a worker thread.
+    """
+    width, height = image.size
+    new_width, new_height = screenshot_size(width, height, policy)
+    if (new_width, new_height) != (width, height):
+        image = image.resize((new_width, new_height), Image.Resampling.LANCZOS)
+
+    image = image.convert('RGB')
+    frame = image.convert('L')
+    if policy.palette_colors and policy.format != 'jpeg':
+        image = image.quantize(colors=policy.palette_colors)
+
+    pil_format, media_type = SCREENSHOT_FORMATS[policy.format]
+    save_kwargs = {}
+    if policy.format in ('webp', 'jpeg'):
+        save_kwargs['quality'] = policy.quality
+    buffer = io.BytesIO()
+    image.save(buffer, format=pil_format, **save_kwargs)
+
+    return ProcessedScreenshot(
+        base64_image=base64.b64encode(buffer.getvalue()).decode('ascii'),
+        media_type=media_type,
+        width=new_width,
+        height=new_height,
+        scale_x=new_width / width,
+        scale_y=new_height / height,
+        frame=frame,
+    )
+
+
+# session_id -> (scale_x, scale_y) of the last screenshot sent to the model
+_session_scales: Dict[str, Tuple[float, float]] = {}
+
+
+def record_screenshot_scale(session_id: str, screenshot: ProcessedScreenshot):
+    _session_scales[str(session_id)] = (screenshot.scale_x, screenshot.scale_y)
+
+
+def expect_screenshot_size(
+    session_id: str, screen_size: Tuple[int, int], size: Tuple[int, int]
+):
+    """Map coordinates as for screenshots of size taken from a screen of
+    screen_size, until the next screenshot records its actual scale."""
+    _session_scales[str(session_id)] = (
+        size[0] / screen_size[0],
+        size[1] / screen_size[1],
+    )
+
+
+def scale_to_screen(session_id: str, coordinate: Sequence[int]) -> Tuple[int, int]:
+    """Map coordinates in the last screenshot of a session to screen coordinates."""
+    scale_x, scale_y = _session_scales.get(str(session_id), (1.0, 1.0))
+    return round(coordinate[0] / scale_x), round(coordinate[1] / scale_y)
+
+
+def scale_to_screenshot(session_id: str, coordinate: Sequence[int]) -> Tuple[int, int]:
+    """Map screen coordinates to coordinates in the last screenshot of a session."""
+    scale_x, scale_y = _session_scales.get(str(session_id), (1.0, 1.0))
+    return round(coordinate[0] * scale_x), round(coordinate[1] * scale_y)
+
+
+def frames_match(previous: Image.Image, frame: Image.Image, max_diff: float) -> bool:
+    """Return True if at most max_diff (fraction) of the pixels of two grayscale
+    frames differ by more than PIXEL_DIFF_THRESHOLD gray levels."""
+    if previous.size != frame.size:
+        return False
+    changed = ImageChops.difference(previous, frame).point(
+        lambda value: 255 if value > PIXEL_DIFF_THRESHOLD else 0
+    )
+    return changed.histogram()[255] <= max_diff * frame.width * frame.height
+
+
+# session_id -> frame of the last screenshot sent to the model
+_last_frames: Dict[str, Image.Image] = {}
+
+
+def screen_unchanged(session_id: str, screenshot: ProcessedScreenshot) -> bool:
+    """Return True if the screenshot shows the same screen as the last one sent
+    to the model in this session.
+
+    At most SCREENSHOT_UNCHANGED_MAX_DIFF of the pixels may differ by more than
+    PIXEL_DIFF_THRESHOLD gray levels. Otherwise the screenshot becomes the new
+    reference frame. CPU bound, call it from a worker thread.
+    """
+    session_id = str(session_id)
+    previous = _last_frames.get(session_id)
+    frame = screenshot.frame
+    if frame is None:
+        _last_frames.pop(session_id, None)
+        return False
+
+    if previous is not None and frames_match(
+        previous, frame, settings.SCREENSHOT_UNCHANGED_MAX_DIFF
+    ):
+        return True
+
+    _last_frames[session_id] = frame
+    return False
+
+
+def screen_fingerprint(image: Image.Image) -> str:
+    """Return a difference hash of a screen as hex string.
+
+    Two bits per cell of a FINGERPRINT_SIZE grid tell whether the cell is
+    brighter or darker than its right neighbour. The cells average large
+    areas, so the hash is robust against scaling, encoding noise and changed
+    text, but changes with the layout of the screen (e.g. an opened dialog).
+    """
+    small = image.convert('L').resize(
+        (FINGERPRINT_SIZE + 1, FINGERPRINT_SIZE), Image.Resampling.BOX
+    )
+    pixels = list(small.getdata())
+    bits = 0
+    for row in range(FINGERPRINT_SIZE):
+        offset = row * (FINGERPRINT_SIZE + 1)
+        for col in range(FINGERPRINT_SIZE):
+            edge = pixels[offset + col] - pixels[offset + col + 1]
+            bits = (
+                (bits << 2)
+                | (edge > FINGERPRINT_EDGE_THRESHOLD) << 1
+                | (edge < -FINGERPRINT_EDGE_THRESHOLD)
+            )
+    return f'{bits:0{FINGERPRINT_SIZE**2 // 2}x}'
+
+
+def fingerprint_distance(a: str, b: str) -> int:
+    """Return the number of differing bits of two screen fingerprints."""
+    return bin(int(a, 16) ^ int(b, 16)).count('1')
+
+
+def reset_screen_history(session_id: str):
+    """Forget the last screenshot of a session, e.g. when a new conversation
+    with the model starts, so the next screenshot is always sent."""
+    _last_frames.pop(str(session_id), None)
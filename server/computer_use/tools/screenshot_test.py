@@ -0,0 +1,65 @@
+import base64
+import io
+
+from PIL import Image
+
+from .computer import ComputerTool20250124
+from .screenshot import (
+    ScreenshotPolicy,
+    process_screenshot,
+    record_screenshot_scale,
+    scale_to_screen,
+    screenshot_size,
+)
+
+
+def test_screenshot_size():
+    policy = ScreenshotPolicy(max_width=1280, max_height=800)
+    assert screenshot_size(1024, 768, policy) == (1024, 768)
+    assert screenshot_size(1920, 1080, policy) == (1280, 720)
+    assert screenshot_size(1600, 1200, policy) == (1067, 800)
+    assert screenshot_size(1920, 1080, ScreenshotPolicy()) == (1920, 1080)
+
+
+def test_process_screenshot():
+    image = Image.new('RGB', (1920, 1080), 'white')
+    image.putpixel((1919, 1079), (0, 0, 0))
+    policy = ScreenshotPolicy(max_width=1280, max_height=800, format='webp')
+
+    screenshot = process_screenshot(image, policy)
+
+    encoded = Image.open(io.BytesIO(base64.b64decode(screenshot.base64_image)))
+    assert encoded.format == 'WEBP'
+    assert encoded.size == (screenshot.width, screenshot.height) == (1280, 720)
+    assert screenshot.media_type == 'image/webp'
+    assert screenshot.frame.size == (1280, 720)
+
+
+def test_advertised_display_matches_screenshots(monkeypatch):
+    monkeypatch.setattr(
+        ScreenshotPolicy,
+        'for_target',
+        classmethod(lambda cls, target: cls(max_width=1280, max_height=800)),
+    )
+    tool = ComputerTool20250124()
+    target = {'id': 't', 'width': '1920', 'height': '1080'}
+
+    tool.use_target_display('session', target)
+
+    params = tool.to_params()
+    assert (params['display_width_px'], params['display_height_px']) == (1280, 720)
+    # Before the first screenshot, coordinates are mapped as for the advertised size
+    assert scale_to_screen('session', (1279, 719)) == (1918, 1078)
+
+    screenshot = process_screenshot(
+        Image.new('RGB', (1920, 1080)), ScreenshotPolicy.for_target(target)
+    )
+    record_screenshot_scale('session', screenshot)
+    assert (screenshot.width, screenshot.height) == (1280, 720)
+    assert scale_to_screen('session', (640, 360)) == (960, 540)
+
+
+def test_advertised_display_without_screen_size():
+    tool = ComputerTool20250124()
+    tool.use_target_display('other-session', {'id': 't', 'width': None})
+    assert tool.to_params()['display_width_px'] == 1024
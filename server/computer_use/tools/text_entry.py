@@ -0,0 +1,99 @@
+"""
+Choice between typing and pasting text for the 'type' action.
+
+Typing sends a key press and release per character. Long texts are faster
+to send through the clipboard: the text is sent as RFB ClientCutText, which
+the VNC server puts on the target's clipboard, followed by a paste key chord.
+
+Policy defaults come from settings (TYPE_PASTE_*) and can be overridden per
+target with the target's text_entry_policy, e.g.:
+
+    {"paste_min_length": 40, "paste_chord": "shift+Insert"}
+
+Some applications ignore the clipboard. When a paste does not change more
+than verify_min_change (fraction) of the pixels of the settled screen within
+verify_timeout seconds, the paste is reported as unverified. It may still have
+landed (e.g. repainted late), so the text is not typed again blindly, the
+model checks the screen instead. The target is remembered for
+TYPE_PASTE_IGNORED_TTL_SECONDS, later texts for it are typed right away.
+"""
+
+import logging
+import time
+from dataclasses import dataclass
+from typing import Dict, Optional
+
+from server.settings import settings
+
+logger = logging.getLogger(__name__)
+
+# target id -> monotonic time when one of its pastes went unverified
+_clipboard_ignored: Dict[str, float] = {}
+
+
+@dataclass(frozen=True, kw_only=True)
+class TextEntryPolicy:
+    """When texts are pasted instead of typed. 0 never pastes."""
+
+    paste_min_length: int = 0
+    paste_chord: str = 'ctrl+v'
+    verify_timeout: float = 2.0  # 0 trusts every paste
+    verify_min_change: float = 0.0002
+
+    @classmethod
+    def for_target(cls, target: Optional[dict]) -> 'TextEntryPolicy':
+        """Return the settings defaults, overridden by the target's policy."""
+        values = {
+            'paste_min_length': settings.TYPE_PASTE_MIN_LENGTH,
+            'paste_chord': settings.TYPE_PASTE_CHORD,
+            'verify_timeout': settings.TYPE_PASTE_VERIFY_TIMEOUT,
+            'verify_min_change': settings.TYPE_PASTE_VERIFY_MIN_CHANGE,
+        }
+        overrides = (target or {}).get('text_entry_policy') or {}
+        for key, value in overrides.items():
+            if key in values:
+                values[key] = value
+            else:
+                logger.warning(f'Ignoring unknown text entry policy option {key}')
+        return cls(**values)
+
+
+def _pasteable(text: str) -> bool:
+    # ClientCutText is Latin-1. Control characters (e.g. a newline submitting
+    # a form) must keep their key press semantics, so such texts are typed
+    try:
+        text.encode('latin-1')
+    except UnicodeEncodeError:
+        return False
+    return text.isprintable()
+
+
+def should_paste(target_id, policy: TextEntryPolicy, text: str) -> bool:
+    """Return True if text should be pasted rather than typed on a target."""
+    return (
+        policy.paste_min_length > 0
+        and len(text) >= policy.paste_min_length
+        and not _recently_ignored(str(target_id))
+        and _pasteable(text)
+    )
+
+
+def _recently_ignored(target_id: str) -> bool:
+    ignored_at = _clipboard_ignored.get(target_id)
+    if ignored_at is None:
+        return False
+    if time.monotonic() - ignored_at < settings.TYPE_PASTE_IGNORED_TTL_SECONDS:
+        return True
+    # Try pasting again, e.g. the slow repaint was a one-off
+    del _clipboard_ignored[target_id]
+    return False
+
+
+def record_clipboard_ignored(target_id):
+    """Type texts on a target for a while, its application seems to have
+    ignored a paste."""
+    logger.warning(
+        f'Target {target_id} did not visibly react to a clipboard paste, '
+        f'typing texts for the next {settings.TYPE_PASTE_IGNORED_TTL_SECONDS:.0f}s'
+    )
+    _clipboard_ignored[str(target_id)] = time.monotonic()
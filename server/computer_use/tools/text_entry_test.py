@@ -0,0 +1,25 @@
+from . import text_entry
+from .text_entry import TextEntryPolicy, record_clipboard_ignored, should_paste
+
+
+def test_should_paste():
+    policy = TextEntryPolicy(paste_min_length=10)
+    assert should_paste('target', policy, 'a long enough text')
+    assert not should_paste('target', policy, 'short')
+    # Typed to keep the key press semantics of the newline
+    assert not should_paste('target', policy, 'a long enough text\n')
+    assert not should_paste('target', policy, 'a long enough text ✓')
+    assert not should_paste('target', TextEntryPolicy(), 'a long enough text')
+
+
+def test_clipboard_ignored_expires(monkeypatch):
+    now = 1000.0
+    monkeypatch.setattr(text_entry.time, 'monotonic', lambda: now)
+    policy = TextEntryPolicy(paste_min_length=1)
+
+    record_clipboard_ignored('slow-target')
+    assert not should_paste('slow-target', policy, 'text')
+    assert should_paste('other-target', policy, 'text')
+
+    now += text_entry.settings.TYPE_PASTE_IGNORED_TTL_SECONDS
+    assert should_paste('slow-target', policy, 'text')
@@ -1,197 +1,477 @@
 """
 VNC client implementation for computer tools.
+
+VNCClient runs on the asyncio RFB client in rfb.py, which keeps an in-memory
+copy of the remote screen current while the connection is in use. Screenshots
+encode that copy, input events are written straight to the connection.
 """
 
 import asyncio
-import base64
-import io
 import logging
-import os
+import re
+import time
+from collections import OrderedDict
 from contextlib import asynccontextmanager
-from typing import Optional, Tuple
+from typing import Any, Dict, List, Optional, Set, Tuple
 
 from PIL import Image
-from vncdotool import api
+
+from server.computer_use.tools.rfb import (
+    RFBClient,
+    RFBError,
+    keysym_for_character,
+    keysym_for_name,
+)
+from server.computer_use.tools.screenshot import frames_match
+from server.settings import settings
+from server.utils.health_probes import LatencyHistogram
+from server.utils.target_health import invalidate_target_health, record_target_health
 
 logger = logging.getLogger(__name__)
 
+# Mouse buttons 4 to 7 are the scroll wheel
+SCROLL_BUTTONS = {'up': 4, 'down': 5, 'left': 6, 'right': 7}
+
+# Separators of key chords like 'ctrl+shift+t', a leading or doubled
+# separator is the key itself (e.g. '+' or 'ctrl++')
+KEY_CHORD_SEPARATOR = re.compile(r'(?<!^)(?<![+-])[+-]')
+
+
+def _button_mask(button: int) -> int:
+    return 1 << (button - 1)
+
+
+def parse_key_chord(key: str) -> List[int]:
+    """Return the keysyms of a key or key chord, e.g. 'Return' or 'ctrl+s'."""
+    names = KEY_CHORD_SEPARATOR.split(key.strip() or key)
+    return [keysym_for_name(name) for name in names]
+
 
 class VNCClient:
-    """Wrapper around vncdotool for async operations."""
-    
+    """Async VNC client for the computer tools."""
+
     def __init__(self, host: str, port: int = 5900, password: Optional[str] = None):
         self.host = host
         self.port = port
         self.password = password
-        self._client = None
+        self._rfb: Optional[RFBClient] = None
         self._lock = asyncio.Lock()
-    
+
     async def connect(self):
         """Connect to VNC server."""
         async with self._lock:
-            if self._client is None:
-                loop = asyncio.get_event_loop()
-                # vncdotool is synchronous, so we run it in an executor
-                self._client = await loop.run_in_executor(
-                    None,
-                    api.connect,
-                    f"{self.host}::{self.port}",
-                    self.password
-                )
-                logger.info(f"Connected to VNC server at {self.host}:{self.port}")
-    
+            if self._rfb is None:
+                rfb = RFBClient(self.host, self.port, self.password)
+                await rfb.connect(timeout=settings.VNC_CONNECT_TIMEOUT)
+                self._rfb = rfb
+                logger.info(f'Connected to VNC server at {self.host}:{self.port}')
+
     async def disconnect(self):
         """Disconnect from VNC server."""
         async with self._lock:
-            if self._client:
-                loop = asyncio.get_event_loop()
-                await loop.run_in_executor(None, self._client.disconnect)
-                self._client = None
-                logger.info(f"Disconnected from VNC server at {self.host}:{self.port}")
-    
-    async def ensure_connected(self):
+            if self._rfb is not None:
+                await self._rfb.close()
+                self._rfb = None
+                logger.info(f'Disconnected from VNC server at {self.host}:{self.port}')
+
+    @property
+    def connected(self) -> bool:
+        return self._rfb is not None and self._rfb.connected
+
+    def pause_updates(self):
+        """Stop receiving screen updates until resume_updates()."""
+        if self._rfb is not None:
+            self._rfb.pause_updates()
+
+    def resume_updates(self):
+        if self._rfb is not None:
+            self._rfb.resume_updates()
+
+    async def ping(self, timeout: float):
+        """Check that the VNC server still answers, raises RFBError if not."""
+        rfb = await self.ensure_connected()
+        await rfb.ping(timeout)
+
+    async def ensure_connected(self) -> RFBClient:
         """Ensure we're connected to the VNC server."""
-        if self._client is None:
+        if self._rfb is None:
             await self.connect()
-    
-    async def screenshot(self) -> str:
-        """Take a screenshot and return as base64 encoded PNG."""
-        await self.ensure_connected()
-        loop = asyncio.get_event_loop()
-        
-        # Capture screenshot to a temporary file
-        import tempfile
-        with tempfile.NamedTemporaryFile(suffix='.png', delete=False) as tmp:
-            tmp_path = tmp.name
-        
-        try:
-            # vncdotool saves screenshot to file
-            await loop.run_in_executor(None, self._client.captureScreen, tmp_path)
-            
-            # Read and encode the image
-            with open(tmp_path, 'rb') as f:
-                image_data = f.read()
-            
-            # Convert to base64
-            base64_image = base64.b64encode(image_data).decode('utf-8')
-            return base64_image
-        finally:
-            # Clean up temp file
-            if os.path.exists(tmp_path):
-                os.unlink(tmp_path)
-    
+        return self._rfb
+
+    async def screenshot(self) -> Image.Image:
+        """Take a screenshot, including the cursor, as RGB image.
+
+        The image is a copy, the read loop can't change it while it is
+        processed. It is encoded once, by process_screenshot().
+        """
+        rfb = await self.ensure_connected()
+        # Changes the server has not sent yet would be missing, e.g. right
+        # after an action. On timeout the screen is taken as it is
+        await rfb.refresh(settings.VNC_SCREENSHOT_REFRESH_TIMEOUT)
+        return rfb.snapshot(cursor=True)
+
+    async def capture_frame(self) -> Image.Image:
+        """Return the current framebuffer as grayscale image.
+
+        Cheaper than screenshot(), which waits for pending updates. Used to
+        detect when the screen stops changing.
+        """
+        rfb = await self.ensure_connected()
+        return rfb.snapshot().convert('L')
+
     async def move_mouse(self, x: int, y: int):
         """Move mouse to absolute coordinates."""
-        await self.ensure_connected()
-        loop = asyncio.get_event_loop()
-        await loop.run_in_executor(None, self._client.mouseMove, x, y)
-    
-    async def click(self, button: int = 1):
-        """Click mouse button (1=left, 2=middle, 3=right)."""
-        await self.ensure_connected()
-        loop = asyncio.get_event_loop()
-        # A click is a press followed by a release
-        await loop.run_in_executor(None, self._client.mouseDown, button)
-        await asyncio.sleep(0.05)  # Small delay between press and release
-        await loop.run_in_executor(None, self._client.mouseUp, button)
-    
-    async def mouse_down(self, button: int = 1):
-        """Press mouse button down."""
-        await self.ensure_connected()
-        loop = asyncio.get_event_loop()
-        await loop.run_in_executor(None, self._client.mouseDown, button)
-    
-    async def mouse_up(self, button: int = 1):
-        """Release mouse button."""
-        await self.ensure_connected()
-        loop = asyncio.get_event_loop()
-        await loop.run_in_executor(None, self._client.mouseUp, button)
-    
+        rfb = await self.ensure_connected()
+        batch = rfb.batch()
+        batch.move(x, y)
+        await rfb.send_batch(batch)
+
+    async def click(
+        self,
+        button: int = 1,
+        count: int = 1,
+        position: Optional[Tuple[int, int]] = None,
+    ):
+        """Click mouse button (1=left, 2=middle, 3=right) count times, at
+        position if given."""
+        rfb = await self.ensure_connected()
+        delay = settings.VNC_INPUT_EVENT_DELAY
+        mask = _button_mask(button)
+        batch = rfb.batch()
+        if position:
+            batch.move(*position)
+        for i in range(count):
+            if i:
+                batch.delay(delay)
+            batch.press(mask)
+            batch.delay(delay)
+            batch.release(mask)
+        await rfb.send_batch(batch)
+
+    async def mouse_down(
+        self, button: int = 1, position: Optional[Tuple[int, int]] = None
+    ):
+        """Press mouse button down, at position if given."""
+        rfb = await self.ensure_connected()
+        batch = rfb.batch()
+        if position:
+            batch.move(*position)
+        batch.press(_button_mask(button))
+        await rfb.send_batch(batch)
+
+    async def mouse_up(
+        self, button: int = 1, position: Optional[Tuple[int, int]] = None
+    ):
+        """Release mouse button, at position if given."""
+        rfb = await self.ensure_connected()
+        batch = rfb.batch()
+        if position:
+            batch.move(*position)
+        batch.release(_button_mask(button))
+        await rfb.send_batch(batch)
+
     async def drag(self, x: int, y: int, button: int = 1):
-        """Drag mouse to coordinates."""
-        await self.ensure_connected()
-        loop = asyncio.get_event_loop()
-        await loop.run_in_executor(None, self._client.mouseDrag, x, y, button)
-    
+        """Drag mouse from the current position to coordinates."""
+        rfb = await self.ensure_connected()
+        delay = settings.VNC_INPUT_EVENT_DELAY
+        mask = _button_mask(button)
+        batch = rfb.batch()
+        batch.press(mask)
+        batch.delay(delay)
+        batch.move(x, y)
+        batch.delay(delay)
+        batch.release(mask)
+        await rfb.send_batch(batch)
+
     async def type_text(self, text: str):
         """Type text."""
-        await self.ensure_connected()
-        loop = asyncio.get_event_loop()
-        await loop.run_in_executor(None, self._client.type, text)
-    
-    async def key_press(self, key: str):
-        """Press a special key."""
-        await self.ensure_connected()
-        loop = asyncio.get_event_loop()
-        await loop.run_in_executor(None, self._client.keyPress, key)
-    
-    async def scroll(self, direction: str, amount: int = 5):
-        """Scroll in a direction."""
-        await self.ensure_connected()
-        loop = asyncio.get_event_loop()
-        
-        # Map direction to scroll button
-        scroll_map = {
-            'up': 4,
-            'down': 5,
-            'left': 6,
-            'right': 7
-        }
-        button = scroll_map.get(direction, 5)
-        
-        # Send multiple scroll events
-        for _ in range(amount):
-            await loop.run_in_executor(None, self._client.mousePress, button)
-            await asyncio.sleep(0.01)  # Small delay between scrolls
-    
+        rfb = await self.ensure_connected()
+        batch = rfb.batch()
+        for character in text:
+            keysym = keysym_for_character(character)
+            batch.key(keysym, True)
+            batch.key(keysym, False)
+        await rfb.send_batch(batch)
+
+    async def paste_text(
+        self,
+        text: str,
+        chord: str = 'ctrl+v',
+        verify_timeout: float = 0.0,
+        min_change: float = 0.0,
+    ) -> bool:
+        """Put text on the clipboard and paste it with a key chord.
+
+        With a verify_timeout, waits at most that long for more than
+        min_change (fraction) of the pixels to change. Returns False if they
+        didn't, i.e. the paste was likely ignored. The screen should be
+        settled before, changes still in progress would pass for the paste.
+        """
+        keysyms = parse_key_chord(chord)
+        rfb = await self.ensure_connected()
+        before = rfb.snapshot().convert('L') if verify_timeout > 0 else None
+
+        batch = rfb.batch()
+        batch.cut_text(text)
+        for keysym in keysyms:
+            batch.key(keysym, True)
+        for keysym in reversed(keysyms):
+            batch.key(keysym, False)
+        await rfb.send_batch(batch)
+        if before is None:
+            return True
+
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + verify_timeout
+        while (remaining := deadline - loop.time()) > 0:
+            if not await rfb.wait_for_update(remaining):
+                break
+            frame = rfb.snapshot().convert('L')
+            if not await asyncio.to_thread(frames_match, before, frame, min_change):
+                return True
+        return False
+
+    async def key_press(self, key: str, hold: float = 0.0):
+        """Press a key or key chord (e.g. 'Return', 'ctrl+s'), holding it down
+        for hold seconds."""
+        keysyms = parse_key_chord(key)
+        rfb = await self.ensure_connected()
+        batch = rfb.batch()
+        for keysym in keysyms:
+            batch.key(keysym, True)
+        batch.delay(max(hold, settings.VNC_INPUT_EVENT_DELAY))
+        for keysym in reversed(keysyms):
+            batch.key(keysym, False)
+        await rfb.send_batch(batch)
+
+    async def scroll(
+        self,
+        direction: str,
+        amount: int = 5,
+        position: Optional[Tuple[int, int]] = None,
+    ):
+        """Scroll in a direction, at position if given."""
+        rfb = await self.ensure_connected()
+        delay = settings.VNC_INPUT_EVENT_DELAY
+        mask = _button_mask(SCROLL_BUTTONS.get(direction, 5))
+        batch = rfb.batch()
+        if position:
+            batch.move(*position)
+        # Every wheel tick is a press and release of the scroll button
+        for i in range(amount):
+            if i:
+                batch.delay(delay)
+            batch.press(mask)
+            batch.release(mask)
+        await rfb.send_batch(batch)
+
     async def get_cursor_position(self) -> Tuple[int, int]:
-        """Get current cursor position."""
-        # vncdotool doesn't provide cursor position directly
-        # We'll need to track it ourselves or use a workaround
-        # For now, return a default position
-        logger.warning("Cursor position tracking not implemented, returning (0, 0)")
-        return (0, 0)
+        """Get current cursor position, without a round trip to the server."""
+        rfb = await self.ensure_connected()
+        if not rfb.pointer_known:
+            logger.warning(
+                f'Cursor position on {self.host}:{self.port} not known yet, returning {rfb.pointer}'
+            )
+        return rfb.pointer
 
 
 # Connection pool for VNC clients
 class VNCConnectionPool:
-    """Manage VNC connections to different containers."""
-    
+    """Manage VNC connections to different containers.
+
+    Connections are opened under a lock per host:port, so a slow or
+    unreachable host only delays the callers waiting for that host. Open
+    connections are kept in least recently used order: connections idle for
+    VNC_POOL_IDLE_TTL_SECONDS are closed, and the least recently used idle
+    connection is closed when more than VNC_POOL_MAX_SIZE are open.
+
+    A background task pings idle connections every VNC_POOL_KEEPALIVE_INTERVAL
+    seconds and drops broken ones, so they are reopened before the next action
+    instead of failing it. Connections nobody has checked out don't receive
+    screen updates.
+    """
+
     def __init__(self):
-        self._connections = {}
-        self._lock = asyncio.Lock()
-    
+        # key -> client, least recently used first
+        self._connections: OrderedDict[str, VNCClient] = OrderedDict()
+        self._last_used: Dict[str, float] = {}
+        self._in_use: Dict[str, int] = {}
+        self._key_locks: Dict[str, asyncio.Lock] = {}
+        # Keys whose connection broke, their next connection is a reconnect
+        self._broken: Set[str] = set()
+        self._keepalive_task: Optional[asyncio.Task] = None
+
+        self.hits = 0
+        self.misses = 0
+        self.reconnects = 0
+        self.idle_evictions = 0
+        self.lru_evictions = 0
+        self.keepalive_failures = 0
+        self.connect_latency = LatencyHistogram()
+
+    def _checkout(self, key: str) -> Optional[VNCClient]:
+        client = self._connections.get(key)
+        if client is None or not client.connected:
+            return None
+        self._connections.move_to_end(key)
+        self.hits += 1
+        return client
+
     @asynccontextmanager
-    async def get_connection(self, host: str, port: int = 5900, password: Optional[str] = None):
+    async def get_connection(
+        self, host: str, port: int = 5900, password: Optional[str] = None
+    ):
         """Get or create a VNC connection."""
-        key = f"{host}:{port}"
-        
-        async with self._lock:
-            if key not in self._connections:
-                client = VNCClient(host, port, password)
-                await client.connect()
-                self._connections[key] = client
-            
-            client = self._connections[key]
-        
+        key = f'{host}:{port}'
+
+        client = self._checkout(key)
+        if client is None:
+            async with self._key_locks.setdefault(key, asyncio.Lock()):
+                # Another caller may have connected while we waited for the lock
+                client = self._checkout(key)
+                if client is None:
+                    client = await self._connect(key, host, port, password)
+
+        self._in_use[key] = self._in_use.get(key, 0) + 1
+        client.resume_updates()
         try:
             yield client
+            # A working VNC connection is as good as a health probe
+            record_target_health(host, True, f'VNC port {port} is accessible.')
         except Exception as e:
-            logger.error(f"Error using VNC connection to {key}: {e}")
-            # Remove failed connection from pool
-            async with self._lock:
-                if key in self._connections:
-                    await self._connections[key].disconnect()
-                    del self._connections[key]
+            # Errors of the action itself (e.g. an unknown key) leave the
+            # connection intact
+            if isinstance(e, (OSError, RFBError)) or not client.connected:
+                logger.error(f'Error using VNC connection to {key}: {e}')
+                invalidate_target_health(host)
+                await self._drop(key, client, broken=True)
+            raise
+        finally:
+            self._in_use[key] -= 1
+            if not self._in_use[key]:
+                del self._in_use[key]
+                client.pause_updates()
+            self._last_used[key] = time.monotonic()
+
+    async def _connect(
+        self, key: str, host: str, port: int, password: Optional[str]
+    ) -> VNCClient:
+        self.misses += 1
+        stale = self._connections.get(key)
+        if stale is not None:
+            # The read loop noticed that the connection broke
+            await self._drop(key, stale, broken=True)
+        if key in self._broken:
+            self._broken.discard(key)
+            self.reconnects += 1
+
+        client = VNCClient(host, port, password)
+        started_at = time.perf_counter()
+        try:
+            await client.connect()
+        except Exception:
+            self.connect_latency.observe(
+                (time.perf_counter() - started_at) * 1000, False
+            )
+            self._broken.add(key)
+            invalidate_target_health(host)
             raise
-    
+        self.connect_latency.observe((time.perf_counter() - started_at) * 1000, True)
+
+        self._connections[key] = client
+        self._last_used[key] = time.monotonic()
+        await self._evict_least_recently_used()
+        self._start_keepalive()
+        return client
+
+    async def _drop(self, key: str, client: VNCClient, broken: bool = False):
+        """Close a connection and remove it from the pool, if it is still there."""
+        if self._connections.get(key) is client:
+            del self._connections[key]
+            self._last_used.pop(key, None)
+            if broken:
+                self._broken.add(key)
+        await client.disconnect()
+
+    async def _evict_least_recently_used(self):
+        for key in list(self._connections):
+            if len(self._connections) <= settings.VNC_POOL_MAX_SIZE:
+                return
+            if key not in self._in_use:
+                logger.info(f'Closing least recently used VNC connection to {key}')
+                self.lru_evictions += 1
+                await self._drop(key, self._connections[key])
+
+    def _start_keepalive(self):
+        if settings.VNC_POOL_KEEPALIVE_INTERVAL <= 0:
+            return
+        if self._keepalive_task is None or self._keepalive_task.done():
+            self._keepalive_task = asyncio.create_task(self._keepalive_loop())
+
+    async def _keepalive_loop(self):
+        while self._connections:
+            await asyncio.sleep(settings.VNC_POOL_KEEPALIVE_INTERVAL)
+            try:
+                await self._sweep()
+            except Exception as e:
+                logger.error(f'Error in VNC pool keepalive: {str(e)}')
+
+    async def _sweep(self):
+        """Close idle connections and ping the remaining unused ones."""
+        now = time.monotonic()
+        to_ping = []
+        for key, client in list(self._connections.items()):
+            if key in self._in_use:
+                continue
+            if now - self._last_used.get(key, now) > settings.VNC_POOL_IDLE_TTL_SECONDS:
+                logger.info(f'Closing idle VNC connection to {key}')
+                self.idle_evictions += 1
+                await self._drop(key, client)
+            else:
+                to_ping.append((key, client))
+
+        results = await asyncio.gather(
+            *(client.ping(settings.VNC_CONNECT_TIMEOUT) for _, client in to_ping),
+            return_exceptions=True,
+        )
+        for (key, client), result in zip(to_ping, results, strict=True):
+            if isinstance(result, BaseException):
+                logger.warning(f'VNC keepalive to {key} failed: {result}')
+                self.keepalive_failures += 1
+                invalidate_target_health(client.host)
+                await self._drop(key, client, broken=True)
+            else:
+                record_target_health(
+                    client.host, True, f'VNC port {client.port} is accessible.'
+                )
+
+    def metrics(self) -> Dict[str, Any]:
+        requests = self.hits + self.misses
+        return {
+            'size': len(self._connections),
+            'max_size': settings.VNC_POOL_MAX_SIZE,
+            'in_use': len(self._in_use),
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': round(self.hits / requests, 4) if requests else None,
+            'reconnects': self.reconnects,
+            'idle_evictions': self.idle_evictions,
+            'lru_evictions': self.lru_evictions,
+            'keepalive_failures': self.keepalive_failures,
+            'connect_latency': self.connect_latency.to_dict(),
+        }
+
     async def close_all(self):
         """Close all connections."""
-        async with self._lock:
-            for client in self._connections.values():
-                await client.disconnect()
-            self._connections.clear()
+        if self._keepalive_task is not None:
+            self._keepalive_task.cancel()
+            self._keepalive_task = None
+        connections = list(self._connections.values())
+        self._connections.clear()
+        self._last_used.clear()
+        for client in connections:
+            await client.disconnect()
 
 
 # Global connection pool
-vnc_pool = VNCConnectionPool()
\ No newline at end of file
+vnc_pool = VNCConnectionPool()
@@ -0,0 +1,28 @@
+import pytest
+
+from .vnc_client import parse_key_chord
+
+
+@pytest.mark.parametrize(
+    'key, keysyms',
+    [
+        ('Return', [0xFF0D]),
+        ('a', [ord('a')]),
+        ('ctrl+s', [0xFFE3, ord('s')]),
+        ('ctrl-shift-t', [0xFFE3, 0xFFE1, ord('t')]),
+        ('super+Page_Down', [0xFFEB, 0xFF56]),
+        ('+', [ord('+')]),
+        ('-', [ord('-')]),
+        ('ctrl++', [0xFFE3, ord('+')]),
+        ('ctrl+-', [0xFFE3, ord('-')]),
+        (' ', [ord(' ')]),
+        (' alt+F4 ', [0xFFE9, 0xFFC1]),
+    ],
+)
+def test_parse_key_chord(key, keysyms):
+    assert parse_key_chord(key) == keysyms
+
+
+def test_parse_key_chord_unknown_key():
+    with pytest.raises(ValueError):
+        parse_key_chord('ctrl+nokey')
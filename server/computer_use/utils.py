@@ -2,9 +2,11 @@
 Utility functions for Computer Use API Gateway.
 """
 
+import base64
+import inspect
 import json
 from datetime import datetime
-from typing import Any, Dict, cast
+from typing import Any, Callable, Dict, cast
 
 from anthropic.types.beta import (
     BetaCacheControlEphemeralParam,
@@ -21,6 +23,18 @@ from anthropic.types.beta import (
 from server.computer_use.logging import logger
 from server.computer_use.tools import ToolResult
 from server.database.models import JobMessage
+from server.utils.blob_store import (
+    dehydrate_images,
+    guess_image_media_type,
+    rehydrate_images,
+)
+
+
+async def _run_callback(callback: Callable[..., Any], *args: Any) -> None:
+    """Call an output callback, awaiting it if it is a coroutine function."""
+    result = callback(*args)
+    if inspect.isawaitable(result):
+        await result
 
 
 def _load_system_prompt(system_prompt_suffix: str = '') -> str:
@@ -84,23 +98,37 @@ def _inject_prompt_caching(
     messages: list[BetaMessageParam],
 ):
     """
-    Set cache breakpoints for the 3 most recent turns
+    Set cache breakpoints for the 3 most recent user turns
     one cache breakpoint is left for tools/system prompt, to be shared across sessions
+
+    In a computer use loop almost every user turn only carries tool results. The
+    breakpoint is then set on the last tool_result block itself, which the API
+    permits (unlike cache_control inside a tool_result's content).
+
+    If the first message is a prompt built by build_prompt_blocks, its first
+    block is the API's prompt template, identical across jobs. It takes one of
+    the 3 breakpoints, so the next job of the same API reads it from the cache.
     """
 
     breakpoints_remaining = 3
-    for message in reversed(messages):
-        if message['role'] == 'user' and isinstance(
-            content := message['content'], list
+    if messages and messages[0]['role'] == 'user':
+        prompt = messages[0]['content']
+        if (
+            isinstance(prompt, list)
+            and len(prompt) > 1
+            and prompt[0].get('type') == 'text'
         ):
-            # Skip if ANY content item is a tool_result (they don't support cache_control on content)
-            has_tool_result = any(
-                isinstance(item, dict) and item.get('type') == 'tool_result'
-                for item in content
+            prompt[0]['cache_control'] = BetaCacheControlEphemeralParam(
+                {'type': 'ephemeral'}
             )
-            if has_tool_result:
-                continue
-                
+            breakpoints_remaining -= 1
+
+    for message in reversed(messages):
+        if (
+            message['role'] == 'user'
+            and isinstance(content := message['content'], list)
+            and content
+        ):
             if breakpoints_remaining:
                 breakpoints_remaining -= 1
                 content[-1]['cache_control'] = BetaCacheControlEphemeralParam(
@@ -241,7 +269,10 @@ def _make_api_tool_result(
                 'type': 'image',
                 'source': {
                     'type': 'base64',
-                    'media_type': 'image/png',
+                    # Screenshots may be re-encoded, see tools/screenshot.py
+                    'media_type': guess_image_media_type(
+                        base64.b64decode(result.base64_image[:16])
+                    ),
                     'data': result.base64_image,
                 },
             }
@@ -263,10 +294,10 @@ def _maybe_prepend_system_tool_result(result: ToolResult, result_text: str):
 
 def _job_message_to_beta_message_param(job_message: JobMessage) -> BetaMessageParam:
     """Converts a JobMessage dictionary (or model instance) to a BetaMessageParam TypedDict."""
-    # Deserialize from JSON to plain dict
+    # Deserialize from JSON to plain dict, loading screenshots from the blob store
     restored = {
         'role': job_message.get('role'),
-        'content': job_message.get('message_content'),
+        'content': rehydrate_images(job_message.get('message_content')),
     }
     # Optional: cast for type checkers (runtime it's still just a dict)
     restored = cast(BetaMessageParam, restored)
@@ -280,5 +311,6 @@ def _beta_message_param_to_job_message_content(
     """
     Converts a BetaMessageParam TypedDict into components needed for a JobMessage
     (role and serialized message_content). Does not create a JobMessage DB model instance.
+    Screenshots are moved to the blob store and replaced by references.
     """
-    return beta_param.get('content')
+    return dehydrate_images(beta_param.get('content'))
@@ -4,7 +4,7 @@ Core functionality for AI chat processing, shared between FastAPI and Streamlit
 
 import logging
 from datetime import datetime
-from typing import Any, Callable, Optional
+from typing import Any, Awaitable, Callable, Optional
 
 import httpx
 from anthropic.types.beta import BetaMessageParam
@@ -14,6 +14,8 @@ from server.computer_use import (
     get_tool_version,
     sampling_loop,
 )
+from server.computer_use.message_history import message_history_cache
+from server.computer_use.replay import record_trajectory, replay_trajectory
 from server.computer_use.tools import ToolResult
 from server.database import db
 from server.models.base import (
@@ -72,13 +74,16 @@ class APIGatewayCore:
     async def execute_api(
         self,
         job_id: str,
-        tool_callback: Optional[Callable[[ToolResult, str], None]] = None,
+        tool_callback: Optional[
+            Callable[[ToolResult, str], Optional[Awaitable[None]]]
+        ] = None,
         api_response_callback: Optional[
             Callable[
-                [httpx.Request, httpx.Response | object | None, Exception | None], None
+                [httpx.Request, httpx.Response | object | None, Exception | None],
+                Optional[Awaitable[None]],
             ]
         ] = None,
-        output_callback: Optional[Callable[[Any], None]] = None,
+        output_callback: Optional[Callable[[Any], Optional[Awaitable[None]]]] = None,
         session_id: str = None,
     ) -> APIResponse:
         """Execute an API by name with the given parameters."""
@@ -122,7 +127,13 @@ class APIGatewayCore:
             )
 
             # This is a new job or has no history, build the initial prompt
-            prompt_text = api_def.build_prompt(job_parameters)
+            if settings.PROMPT_STABLE_PREFIX:
+                # Template first and parameters last, for a shared cache prefix
+                prompt_content = api_def.build_prompt_blocks(job_parameters)
+                prompt_text = '\n\n'.join(block['text'] for block in prompt_content)
+            else:
+                prompt_text = api_def.build_prompt(job_parameters)
+                prompt_content = prompt_text
             logger.info(f'Job {job_id}: Sending initial prompt to model: {prompt_text}')
 
             # Add the initial prompt to standard job logs
@@ -138,7 +149,7 @@ class APIGatewayCore:
                 db.update_job(job_id, {'api_definition_version_id': version_id})
 
             # Create the initial message list for sampling_loop
-            messages = [BetaMessageParam(role='user', content=prompt_text)]
+            messages = [BetaMessageParam(role='user', content=prompt_content)]
         else:
             # Job is being resumed, pass empty messages list to sampling_loop
             logger.info(
@@ -152,6 +163,35 @@ class APIGatewayCore:
         # The 'messages' list is now correctly populated (either with initial prompt or empty)
 
         try:
+            if (
+                messages
+                and settings.TRAJECTORY_REPLAY_ENABLED
+                and api_def.version_id
+                and session_id
+            ):
+                # Replay the recorded actions of an earlier job, the model
+                # takes over where the screen diverges or at the extraction
+                replay = await replay_trajectory(
+                    job_id=job_id,
+                    db=db,
+                    version_id=api_def.version_id,
+                    parameters=job_parameters,
+                    prompt=prompt_content,
+                    session_id=session_id,
+                    tool_version=self.tool_version,
+                    output_callback=output_callback or (lambda x: None),
+                    tool_output_callback=tool_callback or (lambda x, y: None),
+                )
+                if replay is not None:
+                    add_job_log(
+                        job_id,
+                        'system',
+                        f'Replayed {replay["replayed"]} of {replay["steps"]} recorded steps'
+                        + (', screen diverged' if replay['diverged'] else ''),
+                    )
+                    # The prompt and replayed steps are already in the history
+                    messages = []
+
             # Execute the API call - sampling_loop will handle saving the messages if it receives any
             result, exchanges = await sampling_loop(
                 job_id=job_id,
@@ -214,6 +254,20 @@ class APIGatewayCore:
                 update_data['result'] = result  # Store the successful extraction
                 logger.info(f'Job {job_id} completed successfully.')
 
+                version_id = job_data.get('api_definition_version_id') or (
+                    api_def.version_id
+                )
+                if settings.TRAJECTORY_REPLAY_ENABLED and version_id:
+                    try:
+                        await record_trajectory(
+                            job_id=job_id,
+                            db=db,
+                            version_id=version_id,
+                            parameters=job_parameters,
+                        )
+                    except Exception as e:
+                        logger.error(f'Job {job_id}: Failed to record trajectory: {e}')
+
             # Add final status to update data
             update_data['status'] = final_status.value
 
@@ -268,4 +322,7 @@ class APIGatewayCore:
                 extraction=None,
                 exchanges=[],  # Exchanges might not be available if error was early
             )
+        finally:
+            # The history is reloaded from the DB if the job is resumed
+            message_history_cache.discard(job_id)
         # --- Process results --- END (Removed original block)
@@ -54,6 +54,10 @@ class Target(Base):
     pool_type = Column(String, nullable=True)
     connection_type = Column(String, nullable=False, default='pool')
     tailscale_authkey = Column(String, nullable=True)
+    # Overrides of the SCREENSHOT_* settings, see computer_use/tools/screenshot.py
+    screenshot_policy = Column(SQLiteJSON, nullable=True)
+    # Overrides of the TYPE_PASTE_* settings, see computer_use/tools/text_entry.py
+    text_entry_policy = Column(SQLiteJSON, nullable=True)
     created_at = Column(DateTime, default=datetime.now)
     updated_at = Column(DateTime, default=datetime.now, onupdate=datetime.now)
     is_archived = Column(Boolean, default=False)
@@ -158,6 +162,14 @@ class Job(Base):
     completed_at = Column(DateTime, nullable=True)
     total_input_tokens = Column(Integer, nullable=True)
     total_output_tokens = Column(Integer, nullable=True)
+    total_cache_creation_tokens = Column(Integer, nullable=True)
+    total_cache_read_tokens = Column(Integer, nullable=True)
+    # Lease held by the worker executing the job (JOB_QUEUE_MODE='database')
+    lease_owner = Column(String, nullable=True)
+    lease_expires_at = Column(DateTime, nullable=True)
+    heartbeat_at = Column(DateTime, nullable=True)
+
+    __table_args__ = (Index('ix_jobs_status_target_id', 'status', 'target_id'),)
 
     target = relationship('Target', back_populates='jobs')
     session = relationship('Session', back_populates='jobs')
@@ -201,3 +213,34 @@ class JobMessage(Base):
     job = relationship('Job', back_populates='messages')
 
     __table_args__ = (Index('ix_jobmessage_job_id_sequence', 'job_id', 'sequence'),)
+
+
+class APITrajectory(Base):
+    """Actions of a successful job, replayed by later jobs of the same API version."""
+
+    __tablename__ = 'api_trajectories'
+
+    id = Column(UUID, primary_key=True, default=uuid.uuid4)
+    api_definition_version_id = Column(
+        UUID, ForeignKey('api_definition_versions.id'), nullable=False
+    )
+    # Sorted, comma separated names of the job parameters
+    parameter_template = Column(String, nullable=False)
+    # Actions and screen fingerprints, see server/computer_use/replay.py
+    steps = Column(SQLiteJSON, nullable=False, default=[])
+    source_job_id = Column(UUID, nullable=True)
+    replay_count = Column(Integer, default=0)
+    divergence_count = Column(Integer, default=0)
+    created_at = Column(DateTime, default=datetime.now)
+    updated_at = Column(DateTime, default=datetime.now, onupdate=datetime.now)
+
+    __table_args__ = (
+        Index(
+            'ix_api_trajectories_version_template',
+            'api_definition_version_id',
+            'parameter_template',
+            unique=True,
+        ),
+    )
+
+    api_definition_version = relationship('APIDefinitionVersion')
@@ -1,16 +1,18 @@
 import logging
+import threading
 from datetime import datetime, timedelta
 from typing import Any, Dict, List
 from uuid import UUID
 
-from sqlalchemy import Integer, cast, create_engine, func
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy import Integer, cast, create_engine, exists, func, or_
+from sqlalchemy.orm import aliased, sessionmaker
 
 from server.settings import settings
 
 from .models import (
     APIDefinition,
     APIDefinitionVersion,
+    APITrajectory,
     Base,
     Job,
     JobLog,
@@ -19,6 +21,20 @@ from .models import (
     Target,
 )
 
+# Job states that pause the queue of their target
+BLOCKING_JOB_STATUSES = ('error', 'paused')
+
+# Process-wide index of targets whose queue is paused, shared by all
+# DatabaseService instances. Maps target id -> number of blocking jobs.
+# Built lazily (or at startup) and kept current by create_job/update_job.
+_paused_target_counts: Dict[str, int] | None = None
+_paused_target_lock = threading.Lock()
+
+
+def _status_value(status):
+    """Normalize a JobStatus enum or plain string to its stored value."""
+    return getattr(status, 'value', status)
+
 
 class DatabaseService:
     def __init__(self, db_url=None):
@@ -95,22 +111,86 @@ class DatabaseService:
             if target:
                 session.delete(target)
                 session.commit()
+                with _paused_target_lock:
+                    if _paused_target_counts is not None:
+                        _paused_target_counts.pop(str(target_id), None)
                 return True
             return False
         finally:
             session.close()
 
+    def rebuild_paused_target_index(self):
+        """Rebuild the paused-target index from a single aggregated query."""
+        global _paused_target_counts
+
+        session = self.Session()
+        try:
+            with _paused_target_lock:
+                rows = (
+                    session.query(Job.target_id, func.count(Job.id))
+                    .filter(Job.status.in_(BLOCKING_JOB_STATUSES))
+                    .group_by(Job.target_id)
+                    .all()
+                )
+                _paused_target_counts = {
+                    str(target_id): count for target_id, count in rows
+                }
+                return set(_paused_target_counts)
+        finally:
+            session.close()
+
+    def _track_job_status_change(self, target_id, old_status, new_status):
+        """Keep the paused-target index in sync with a job status transition."""
+        was_blocking = _status_value(old_status) in BLOCKING_JOB_STATUSES
+        is_blocking = _status_value(new_status) in BLOCKING_JOB_STATUSES
+        if was_blocking == is_blocking:
+            return
+
+        with _paused_target_lock:
+            # Not built yet - it will pick up the change when it is
+            if _paused_target_counts is None:
+                return
+            target_key = str(target_id)
+            count = _paused_target_counts.get(target_key, 0)
+            count += 1 if is_blocking else -1
+            if count > 0:
+                _paused_target_counts[target_key] = count
+            else:
+                _paused_target_counts.pop(target_key, None)
+
+    def list_paused_target_ids(self):
+        """Return the ids of all targets whose queue is paused."""
+        if _paused_target_counts is None:
+            return self.rebuild_paused_target_index()
+        with _paused_target_lock:
+            return set(_paused_target_counts)
+
+    def is_target_paused(self, target_id):
+        """Check in constant time if a target's queue is paused by ERROR or PAUSED jobs."""
+        if _paused_target_counts is None:
+            self.rebuild_paused_target_index()
+        return str(target_id) in _paused_target_counts
+
     def is_target_queue_paused(self, target_id):
         """Check if a target's queue should be paused by looking for jobs in ERROR or PAUSED state.
         Returns a dictionary with blocking status and information.
         """
-        from server.models.base import JobStatus
-
-        blocking_states = [JobStatus.ERROR.value, JobStatus.PAUSED.value]
+        # Only hit the database for the details if the index says it is paused.
+        # In database queue mode other replicas change job statuses, so the
+        # process-local index may be stale
+        if settings.JOB_QUEUE_MODE != 'database' and not self.is_target_paused(
+            target_id
+        ):
+            return {
+                'is_paused': False,
+                'blocking_jobs': [],
+                'blocking_jobs_count': 0,
+                'blocking_job_ids': [],
+            }
 
         # Check if any jobs for this target are in blocking states (ERROR or PAUSED)
         blocking_jobs = self.list_jobs_by_status_and_target(
-            target_id, blocking_states, limit=100
+            target_id, list(BLOCKING_JOB_STATUSES), limit=100
         )
 
         # Return detailed information
@@ -199,6 +279,7 @@ class DatabaseService:
             job = Job(**job_data)
             session.add(job)
             session.commit()
+            self._track_job_status_change(job.target_id, None, job.status)
             return self._to_dict(job)
         finally:
             session.close()
@@ -250,6 +331,24 @@ class DatabaseService:
         finally:
             session.close()
 
+    def iter_jobs_by_status(self, status, batch_size: int = 500):
+        """Stream all jobs with the given status, oldest first.
+
+        Rows are fetched in batches of batch_size instead of being loaded at once.
+        """
+        session = self.Session()
+        try:
+            query = (
+                session.query(Job)
+                .filter(Job.status == status)
+                .order_by(Job.created_at.asc())
+                .yield_per(batch_size)
+            )
+            for job in query:
+                yield self._to_dict(job)
+        finally:
+            session.close()
+
     def list_target_jobs(self, target_id, limit: int = 10, offset: int = 0):
         session = self.Session()
         try:
@@ -359,11 +458,13 @@ class DatabaseService:
             if not job:
                 return None
 
+            old_status = job.status
             for key, value in job_data.items():
                 setattr(job, key, value)
             job.updated_at = datetime.now()
 
             session.commit()
+            self._track_job_status_change(job.target_id, old_status, job.status)
             return self._to_dict(job)
         finally:
             session.close()
@@ -371,6 +472,180 @@ class DatabaseService:
     def update_job_status(self, job_id, status):
         return self.update_job(job_id, {'status': status})
 
+    # Job lease methods (JOB_QUEUE_MODE='database')
+    def _claimable_job_filters(self, now):
+        """Filters selecting queued jobs a worker may claim right now.
+
+        A job is claimable if it is not leased (or its lease expired), no other
+        job of its target holds a live lease and its target's queue is not
+        paused by ERROR or PAUSED jobs.
+        """
+        other = aliased(Job)
+        target_leased = exists().where(
+            other.target_id == Job.target_id,
+            other.id != Job.id,
+            other.lease_owner.isnot(None),
+            other.lease_expires_at > now,
+        )
+        blocking = aliased(Job)
+        target_paused = exists().where(
+            blocking.target_id == Job.target_id,
+            blocking.status.in_(BLOCKING_JOB_STATUSES),
+        )
+        return [
+            Job.status == 'queued',
+            or_(Job.lease_owner.is_(None), Job.lease_expires_at <= now),
+            ~target_leased,
+            ~target_paused,
+        ]
+
+    def claim_next_job(self, worker_id, lease_seconds, batch_size=20):
+        """Atomically lease the oldest claimable queued job to a worker.
+
+        The lease itself is a compare-and-set UPDATE that re-checks all claim
+        conditions, which is atomic on SQLite since writes are serialized. On
+        PostgreSQL candidate rows are selected with FOR UPDATE SKIP LOCKED and
+        the target row is locked as well, so concurrent workers never lease two
+        jobs of the same target and skip targets another worker is claiming.
+
+        Returns the leased job as a dictionary, or None if nothing is claimable.
+        """
+        is_postgres = self.engine.dialect.name == 'postgresql'
+        session = self.Session()
+        try:
+            now = datetime.now()
+            candidates = (
+                session.query(Job.id, Job.target_id)
+                .filter(*self._claimable_job_filters(now))
+                .order_by(Job.created_at)
+                .limit(batch_size)
+            )
+            if is_postgres:
+                candidates = candidates.with_for_update(of=Job, skip_locked=True)
+
+            for job_id, target_id in candidates.all():
+                if is_postgres:
+                    # Serialize claims per target; skip targets being claimed elsewhere
+                    target_locked = (
+                        session.query(Target.id)
+                        .filter(Target.id == target_id)
+                        .with_for_update(skip_locked=True)
+                        .first()
+                    )
+                    if not target_locked:
+                        continue
+
+                claimed = (
+                    session.query(Job)
+                    .filter(Job.id == job_id, *self._claimable_job_filters(now))
+                    .update(
+                        {
+                            'lease_owner': worker_id,
+                            'lease_expires_at': now + timedelta(seconds=lease_seconds),
+                            'heartbeat_at': now,
+                        },
+                        synchronize_session=False,
+                    )
+                )
+                if claimed:
+                    session.commit()
+                    job = session.query(Job).filter(Job.id == job_id).first()
+                    return self._to_dict(job)
+
+            session.rollback()
+            return None
+        finally:
+            session.close()
+
+    def renew_job_lease(self, job_id, worker_id, lease_seconds):
+        """Extend a worker's lease on a job. Returns False if the lease was lost."""
+        session = self.Session()
+        try:
+            now = datetime.now()
+            renewed = (
+                session.query(Job)
+                .filter(Job.id == job_id, Job.lease_owner == worker_id)
+                .update(
+                    {
+                        'lease_expires_at': now + timedelta(seconds=lease_seconds),
+                        'heartbeat_at': now,
+                    },
+                    synchronize_session=False,
+                )
+            )
+            session.commit()
+            return renewed > 0
+        finally:
+            session.close()
+
+    def release_job_lease(self, job_id, worker_id=None):
+        """Release the lease on a job, optionally only if held by the given worker."""
+        session = self.Session()
+        try:
+            query = session.query(Job).filter(Job.id == job_id)
+            if worker_id is not None:
+                query = query.filter(Job.lease_owner == worker_id)
+            released = query.update(
+                {'lease_owner': None, 'lease_expires_at': None},
+                synchronize_session=False,
+            )
+            session.commit()
+            return released > 0
+        finally:
+            session.close()
+
+    def recover_expired_job_leases(self):
+        """Fail RUNNING jobs whose worker stopped renewing its lease.
+
+        Queued jobs with an expired lease need no recovery, they are claimable
+        again. Running jobs are moved to ERROR, which pauses their target's
+        queue until the job is resolved or resumed, as for any failed job.
+
+        Returns the recovered jobs as dictionaries.
+        """
+        session = self.Session()
+        try:
+            now = datetime.now()
+            expired_jobs = (
+                session.query(Job)
+                .filter(
+                    Job.status == 'running',
+                    Job.lease_owner.isnot(None),
+                    Job.lease_expires_at <= now,
+                )
+                .all()
+            )
+            recovered = []
+            for job in expired_jobs:
+                # Compare-and-set so only one worker recovers each job
+                updated = (
+                    session.query(Job)
+                    .filter(
+                        Job.id == job.id,
+                        Job.lease_owner == job.lease_owner,
+                        Job.lease_expires_at <= now,
+                    )
+                    .update(
+                        {
+                            'status': 'error',
+                            'error': f'Worker {job.lease_owner} stopped renewing its lease',
+                            'lease_owner': None,
+                            'lease_expires_at': None,
+                            'completed_at': now,
+                            'updated_at': now,
+                        },
+                        synchronize_session=False,
+                    )
+                )
+                if updated:
+                    recovered.append(job)
+            session.commit()
+            for job in recovered:
+                self._track_job_status_change(job.target_id, 'running', 'error')
+            return [{'id': job.id, 'target_id': job.target_id} for job in recovered]
+        finally:
+            session.close()
+
     # Job Log methods
     def create_job_log(self, log_data):
         session = self.Session()
@@ -382,6 +657,15 @@ class DatabaseService:
         finally:
             session.close()
 
+    def create_job_logs(self, logs_data):
+        """Insert several job logs in a single transaction."""
+        session = self.Session()
+        try:
+            session.add_all([JobLog(**log_data) for log_data in logs_data])
+            session.commit()
+        finally:
+            session.close()
+
     def list_job_logs(self, job_id, exclude_http_exchanges=True):
         session = self.Session()
         try:
@@ -465,6 +749,25 @@ class DatabaseService:
         finally:
             session.close()
 
+    def iter_blob_ref_sources(self, batch_size: int = 500):
+        """Stream the JSON values of all columns that can hold blob references.
+
+        Used to find the blobs still referenced before collecting the others.
+        """
+        session = self.Session()
+        try:
+            for content, content_trimmed in session.query(
+                JobLog.content, JobLog.content_trimmed
+            ).yield_per(batch_size):
+                yield content
+                yield content_trimmed
+            for (message_content,) in session.query(
+                JobMessage.message_content
+            ).yield_per(batch_size):
+                yield message_content
+        finally:
+            session.close()
+
     # API Definition Services
     async def get_api_definitions(self, include_archived=False):
         """Get all API definitions."""
@@ -787,6 +1090,77 @@ class DatabaseService:
 
     # --- End Job Message Methods ---
 
+    # --- API Trajectory Methods ---
+    def get_api_trajectory(
+        self, version_id: UUID, parameter_template: str
+    ) -> Dict[str, Any] | None:
+        """Get the recorded trajectory of an API version and parameter template."""
+        session = self.Session()
+        try:
+            trajectory = (
+                session.query(APITrajectory)
+                .filter(
+                    APITrajectory.api_definition_version_id == version_id,
+                    APITrajectory.parameter_template == parameter_template,
+                )
+                .first()
+            )
+            return self._to_dict(trajectory)
+        finally:
+            session.close()
+
+    def save_api_trajectory(
+        self,
+        version_id: UUID,
+        parameter_template: str,
+        steps: List[Dict[str, Any]],
+        source_job_id: UUID,
+    ) -> Dict[str, Any]:
+        """Create or replace the trajectory of an API version and parameter template."""
+        session = self.Session()
+        try:
+            trajectory = (
+                session.query(APITrajectory)
+                .filter(
+                    APITrajectory.api_definition_version_id == version_id,
+                    APITrajectory.parameter_template == parameter_template,
+                )
+                .first()
+            )
+            if trajectory is None:
+                trajectory = APITrajectory(
+                    api_definition_version_id=version_id,
+                    parameter_template=parameter_template,
+                )
+                session.add(trajectory)
+            trajectory.steps = steps
+            trajectory.source_job_id = source_job_id
+            session.commit()
+            return self._to_dict(trajectory)
+        finally:
+            session.close()
+
+    def record_api_trajectory_replay(self, trajectory_id: UUID, diverged: bool):
+        """Count a replay of a trajectory, and whether the screen diverged."""
+        session = self.Session()
+        try:
+            trajectory = (
+                session.query(APITrajectory)
+                .filter(APITrajectory.id == trajectory_id)
+                .first()
+            )
+            if trajectory:
+                trajectory.replay_count = (trajectory.replay_count or 0) + 1
+                if diverged:
+                    trajectory.divergence_count = (
+                        trajectory.divergence_count or 0
+                    ) + 1
+                session.commit()
+        finally:
+            session.close()
+
+    # --- End API Trajectory Methods ---
+
     # Example usage:
     # db = DatabaseService()
 
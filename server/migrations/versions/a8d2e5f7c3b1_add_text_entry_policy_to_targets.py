@@ -0,0 +1,32 @@
+"""add text entry policy to targets
+
+Revision ID: a8d2e5f7c3b1
+Revises: f1c5a9d3b7e2
+Create Date: 2026-10-18 19:00:00.000000
+
+"""
+
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = 'a8d2e5f7c3b1'
+down_revision = 'f1c5a9d3b7e2'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # Check if column exists before adding
+    conn = op.get_bind()
+    inspector = sa.inspect(conn)
+    targets_columns = [column['name'] for column in inspector.get_columns('targets')]
+
+    if 'text_entry_policy' not in targets_columns:
+        op.add_column(
+            'targets', sa.Column('text_entry_policy', sa.JSON(), nullable=True)
+        )
+
+
+def downgrade() -> None:
+    op.drop_column('targets', 'text_entry_policy')
@@ -0,0 +1,45 @@
+"""add lease columns to jobs
+
+Revision ID: c4d1e8a2b7f3
+Revises: 01e7df5c3660
+Create Date: 2026-10-18 10:00:00.000000
+
+"""
+
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = 'c4d1e8a2b7f3'
+down_revision = '01e7df5c3660'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # Check if columns exist before adding
+    conn = op.get_bind()
+    inspector = sa.inspect(conn)
+    jobs_columns = [column['name'] for column in inspector.get_columns('jobs')]
+    jobs_indexes = [index['name'] for index in inspector.get_indexes('jobs')]
+
+    # Lease columns used by workers claiming jobs from the database
+    if 'lease_owner' not in jobs_columns:
+        op.add_column('jobs', sa.Column('lease_owner', sa.String(), nullable=True))
+    if 'lease_expires_at' not in jobs_columns:
+        op.add_column(
+            'jobs', sa.Column('lease_expires_at', sa.DateTime(), nullable=True)
+        )
+    if 'heartbeat_at' not in jobs_columns:
+        op.add_column('jobs', sa.Column('heartbeat_at', sa.DateTime(), nullable=True))
+
+    # Workers look up claimable and blocking jobs by status and target
+    if 'ix_jobs_status_target_id' not in jobs_indexes:
+        op.create_index('ix_jobs_status_target_id', 'jobs', ['status', 'target_id'])
+
+
+def downgrade() -> None:
+    op.drop_index('ix_jobs_status_target_id', table_name='jobs')
+    op.drop_column('jobs', 'heartbeat_at')
+    op.drop_column('jobs', 'lease_expires_at')
+    op.drop_column('jobs', 'lease_owner')
@@ -0,0 +1,32 @@
+"""add screenshot policy to targets
+
+Revision ID: d7a3f1c9e5b2
+Revises: c4d1e8a2b7f3
+Create Date: 2026-10-18 14:00:00.000000
+
+"""
+
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = 'd7a3f1c9e5b2'
+down_revision = 'c4d1e8a2b7f3'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # Check if column exists before adding
+    conn = op.get_bind()
+    inspector = sa.inspect(conn)
+    targets_columns = [column['name'] for column in inspector.get_columns('targets')]
+
+    if 'screenshot_policy' not in targets_columns:
+        op.add_column(
+            'targets', sa.Column('screenshot_policy', sa.JSON(), nullable=True)
+        )
+
+
+def downgrade() -> None:
+    op.drop_column('targets', 'screenshot_policy')
@@ -0,0 +1,51 @@
+"""add api_trajectories table
+
+Revision ID: e3b8c6a4f1d7
+Revises: d7a3f1c9e5b2
+Create Date: 2026-10-18 16:00:00.000000
+
+"""
+
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = 'e3b8c6a4f1d7'
+down_revision = 'd7a3f1c9e5b2'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # Check if table exists before creating
+    conn = op.get_bind()
+    inspector = sa.inspect(conn)
+
+    if not inspector.has_table('api_trajectories'):
+        op.create_table(
+            'api_trajectories',
+            sa.Column('id', sa.TEXT(), nullable=False),
+            sa.Column('api_definition_version_id', sa.TEXT(), nullable=False),
+            sa.Column('parameter_template', sa.String(), nullable=False),
+            sa.Column('steps', sa.JSON(), nullable=False),
+            sa.Column('source_job_id', sa.TEXT(), nullable=True),
+            sa.Column('replay_count', sa.Integer(), nullable=True),
+            sa.Column('divergence_count', sa.Integer(), nullable=True),
+            sa.Column('created_at', sa.DateTime(), nullable=True),
+            sa.Column('updated_at', sa.DateTime(), nullable=True),
+            sa.ForeignKeyConstraint(
+                ['api_definition_version_id'], ['api_definition_versions.id']
+            ),
+            sa.PrimaryKeyConstraint('id'),
+        )
+        op.create_index(
+            'ix_api_trajectories_version_template',
+            'api_trajectories',
+            ['api_definition_version_id', 'parameter_template'],
+            unique=True,
+        )
+
+
+def downgrade() -> None:
+    op.drop_index('ix_api_trajectories_version_template', table_name='api_trajectories')
+    op.drop_table('api_trajectories')
@@ -0,0 +1,38 @@
+"""add cache token columns to jobs
+
+Revision ID: f1c5a9d3b7e2
+Revises: e3b8c6a4f1d7
+Create Date: 2026-10-18 17:00:00.000000
+
+"""
+
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = 'f1c5a9d3b7e2'
+down_revision = 'e3b8c6a4f1d7'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # Check if columns exist before adding
+    conn = op.get_bind()
+    inspector = sa.inspect(conn)
+    jobs_columns = [column['name'] for column in inspector.get_columns('jobs')]
+
+    if 'total_cache_creation_tokens' not in jobs_columns:
+        op.add_column(
+            'jobs',
+            sa.Column('total_cache_creation_tokens', sa.Integer(), nullable=True),
+        )
+    if 'total_cache_read_tokens' not in jobs_columns:
+        op.add_column(
+            'jobs', sa.Column('total_cache_read_tokens', sa.Integer(), nullable=True)
+        )
+
+
+def downgrade() -> None:
+    op.drop_column('jobs', 'total_cache_read_tokens')
+    op.drop_column('jobs', 'total_cache_creation_tokens')
@@ -98,6 +98,35 @@ IMPORTANT INSTRUCTIONS FOR RETURNING RESULTS:
 
         return prompt_text
 
+    def build_prompt_blocks(self, job_parameters: Dict[str, Any]) -> List[Dict[str, Any]]:
+        """Build the prompt as a stable prefix followed by the parameter values.
+
+        Unlike build_prompt, the template is sent with its placeholders, so the
+        first block is byte-identical for all jobs of this API version and can
+        be cached by the provider across jobs. The parameter values follow in
+        a second block.
+        """
+        job_parameters = job_parameters.copy()
+        if '{now}' in self.full_prompt_template:
+            job_parameters['now'] = datetime.now()
+
+        if job_parameters:
+            values = '\n'.join(
+                f'- {name}: {value if value is not None else ""}'
+                for name, value in job_parameters.items()
+            )
+            parameters_text = (
+                'The placeholders ({name} or {{name}}) in the instructions above '
+                f'stand for these parameter values:\n{values}'
+            )
+        else:
+            parameters_text = 'This request has no parameters.'
+
+        return [
+            {'type': 'text', 'text': self.full_prompt_template},
+            {'type': 'text', 'text': parameters_text},
+        ]
+
 
 class TargetType(str, Enum):
     RDP = 'rdp'
@@ -131,6 +160,8 @@ class Target(BaseModel):
     width: int = 1024
     height: int = 768
     novnc_port: str = "6080"
+    screenshot_policy: Optional[Dict[str, Any]] = None
+    text_entry_policy: Optional[Dict[str, Any]] = None
     created_at: datetime = Field(default_factory=datetime.now)
     updated_at: datetime = Field(default_factory=datetime.now)
     is_archived: bool = False
@@ -162,6 +193,8 @@ class TargetCreate(BaseModel):
     width: int = 1024
     height: int = 768
     novnc_port: str = "6080"
+    screenshot_policy: Optional[Dict[str, Any]] = None
+    text_entry_policy: Optional[Dict[str, Any]] = None
 
 
 class TargetUpdate(BaseModel):
@@ -178,6 +211,8 @@ class TargetUpdate(BaseModel):
     width: Optional[int] = None
     height: Optional[int] = None
     novnc_port: Optional[str] = None
+    screenshot_policy: Optional[Dict[str, Any]] = None
+    text_entry_policy: Optional[Dict[str, Any]] = None
 
 
 class Session(BaseModel):
@@ -254,6 +289,10 @@ class Job(BaseModel):
     api_definition_version_id: Optional[UUID] = None
     total_input_tokens: Optional[int] = None
     total_output_tokens: Optional[int] = None
+    # Prompt cache usage, unweighted token counts
+    total_cache_creation_tokens: Optional[int] = None
+    total_cache_read_tokens: Optional[int] = None
+    cache_hit_rate: Optional[float] = None  # Share of prompt tokens read from cache
     duration_seconds: Optional[float] = None  # Duration in seconds
 
 
@@ -14,14 +14,22 @@ from uuid import UUID
 
 from fastapi import APIRouter, HTTPException
 
+from server.computer_use.message_history import message_history_cache
+from server.computer_use.tools.vnc_client import vnc_pool
 from server.database import db
+from server.settings import settings
+from server.utils import job_execution
+from server.utils.health_probes import probe_latency_metrics
 from server.utils.job_execution import (
-    job_processor_task,
+    is_job_processor_running,
     job_queue,
     job_queue_lock,
     process_job_queue,
     running_job_tasks,
+    target_lanes,
 )
+from server.utils.job_log_writer import job_log_writer
+from server.utils.prompt_cache_metrics import prompt_cache_metrics
 
 # Set up logging
 logger = logging.getLogger(__name__)
@@ -41,16 +49,22 @@ async def diagnose_job_queue():
     diagnostics = {
         'timestamp': datetime.now().isoformat(),
         'queue_size': 0,
-        'is_processor_running': job_processor_task is not None
-        and not job_processor_task.done(),
+        'queued_per_target': {},
+        'is_processor_running': is_job_processor_running(),
+        'max_concurrent_jobs': settings.MAX_CONCURRENT_JOBS,
+        'job_queue_mode': settings.JOB_QUEUE_MODE,
+        'target_lanes': {},
         'running_jobs': {},
         'queued_jobs': [],
         'available_sessions': [],
         'session_states_count': {},
         'processor_task_status': 'Not initialized',
+        'job_log_writer': job_log_writer.metrics(),
+        'message_history_cache': message_history_cache.metrics(),
     }
 
     # Get processor task status
+    job_processor_task = job_execution.job_processor_task
     if job_processor_task is not None:
         if job_processor_task.done():
             try:
@@ -86,6 +100,16 @@ async def diagnose_job_queue():
                 'created_at': job.created_at.isoformat() if job.created_at else None,
             }
             diagnostics['queued_jobs'].append(job_info)
+        for target_id in job_queue.target_ids():
+            diagnostics['queued_per_target'][target_id] = job_queue.target_size(
+                target_id
+            )
+        # Get the lane state of every target with queued or running jobs
+        for target_id, lane in target_lanes.items():
+            diagnostics['target_lanes'][target_id] = {
+                'task_done': lane.done(),
+                'task_cancelled': lane.cancelled(),
+            }
 
     # Get running jobs information
     for job_id, task in running_job_tasks.items():
@@ -164,7 +188,7 @@ async def start_job_processor():
     This endpoint can be used to manually start the job queue processor if it's
     not running or has stopped due to an exception.
     """
-    global job_processor_task
+    job_processor_task = job_execution.job_processor_task
     processor_info = {
         'timestamp': datetime.now().isoformat(),
         'previous_state': 'Not initialized',
@@ -193,7 +217,7 @@ async def start_job_processor():
 
     # Start the processor
     try:
-        job_processor_task = asyncio.create_task(process_job_queue())
+        job_execution.job_processor_task = asyncio.create_task(process_job_queue())
         processor_info['action_taken'] = 'Started new job processor task'
         processor_info['current_state'] = 'Running'
 
@@ -207,6 +231,33 @@ async def start_job_processor():
     return processor_info
 
 
+@diagnostics_router.get('/diagnostics/health-probes')
+async def diagnose_health_probes():
+    """Get latency histograms of the target health probes, per probed port."""
+    return {
+        'timestamp': datetime.now().isoformat(),
+        'probes': probe_latency_metrics(),
+    }
+
+
+@diagnostics_router.get('/diagnostics/prompt-cache')
+async def diagnose_prompt_cache():
+    """Get prompt cache token counts and hit rates, per API."""
+    return {
+        'timestamp': datetime.now().isoformat(),
+        'apis': prompt_cache_metrics(),
+    }
+
+
+@diagnostics_router.get('/diagnostics/vnc-pool')
+async def diagnose_vnc_pool():
+    """Get VNC connection pool usage, evictions and connect latency."""
+    return {
+        'timestamp': datetime.now().isoformat(),
+        'pool': vnc_pool.metrics(),
+    }
+
+
 @diagnostics_router.get('/diagnostics/targets/{target_id}/sessions')
 async def check_target_sessions(target_id: UUID):
     """Check if a target has available sessions.
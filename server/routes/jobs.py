@@ -19,28 +19,37 @@ Example:
 import asyncio
 import json
 import logging
+import re
 from datetime import datetime
 from typing import Annotated, Any, Dict, List, Optional
 from uuid import UUID
 
-from fastapi import APIRouter, Body, HTTPException, Request
+from fastapi import APIRouter, Body, HTTPException, Request, Response
 from pydantic import BaseModel
 
 from server.core import APIGatewayCore
 from server.database.service import DatabaseService
 from server.models.base import Job, JobCreate, JobStatus
 from server.settings import settings
+from server.utils.blob_store import (
+    BLOB_REF_PREFIX,
+    guess_image_media_type,
+    load_blob,
+    rehydrate_images,
+)
 from server.utils.job_execution import (
     add_job_log,
+    dispatched_job_ids,
     enqueue_job,
-    job_processor_task,
+    is_job_processor_running,
     job_queue,
     job_queue_initializer,
     job_queue_lock,
     process_next_job,
     running_job_tasks,
+    target_lanes,
 )
-from server.utils.job_utils import compute_job_metrics
+from server.utils.job_utils import compute_job_metrics, reconstruct_http_exchanges
 
 # Set up logging
 logger = logging.getLogger(__name__)
@@ -223,6 +232,8 @@ async def get_job(target_id: UUID, job_id: UUID):
             {
                 'total_input_tokens': metrics['total_input_tokens'],
                 'total_output_tokens': metrics['total_output_tokens'],
+                'total_cache_creation_tokens': metrics['total_cache_creation_tokens'],
+                'total_cache_read_tokens': metrics['total_cache_read_tokens'],
             },
         )
 
@@ -234,6 +245,13 @@ async def get_queue_status():
     """Get the current status of the job queue."""
     async with job_queue_lock:
         queue_size = len(job_queue)
+        queued_per_target = {
+            target_id: job_queue.target_size(target_id)
+            for target_id in job_queue.target_ids()
+        }
+        running_jobs_count = len(running_job_tasks)
+        active_lanes = len(target_lanes)
+        dispatched_count = len(dispatched_job_ids)
         running_job_dict = None
         if running_job_tasks:
             running_job_id_str = next(iter(running_job_tasks.keys()), None)
@@ -252,15 +270,12 @@ async def get_queue_status():
 
     # Check for inconsistencies between database and memory queue
     # Count jobs with QUEUED status in the database
-    all_jobs = db.list_jobs(
-        limit=1000
-    )  # Get a larger number to ensure we get all queued jobs
-    db_queued_count = sum(
-        1 for job in all_jobs if job.get('status') == JobStatus.QUEUED.value
-    )
+    db_queued_count = db.count_jobs(filters={'status': JobStatus.QUEUED.value})
 
-    # If database shows queued jobs but memory queue is empty or different size, resynchronize
-    if db_queued_count != queue_size:
+    # If database shows queued jobs but memory queue is empty or different size, resynchronize.
+    # Dispatched jobs left the memory queue but stay QUEUED in the database
+    # until they start, so they may account for the difference
+    if not queue_size <= db_queued_count <= queue_size + dispatched_count:
         logger.warning(
             f'Queue inconsistency detected: {queue_size} jobs in memory vs {db_queued_count} in database'
         )
@@ -270,9 +285,12 @@ async def get_queue_status():
     return {
         'queue_size': queue_size,
         'queued_in_db': db_queued_count,
+        'queued_per_target': queued_per_target,
         'running_job': running_job_dict,  # Return the dict
-        'is_processor_running': job_processor_task is not None
-        and not job_processor_task.done(),
+        'running_jobs_count': running_jobs_count,
+        'active_lanes': active_lanes,
+        'max_concurrent_jobs': settings.MAX_CONCURRENT_JOBS,
+        'is_processor_running': is_job_processor_running(),
     }
 
 
@@ -319,6 +337,19 @@ async def interrupt_job(target_id: UUID, job_id: UUID, request: Request):
                     logger.warning(
                         f'Tried to interrupt job {job_id_str}, but task was already done.'
                     )
+            elif settings.JOB_QUEUE_MODE == 'database' and job_dict.get('lease_owner'):
+                # The job runs on another replica; revoking its lease makes that
+                # worker cancel it on its next heartbeat
+                db.release_job_lease(job_id)
+                interrupted = True
+                logger.info(
+                    f'Revoked lease of job {job_id_str} held by worker {job_dict["lease_owner"]}'
+                )
+                add_job_log(
+                    job_id_str,
+                    'system',
+                    f'Job interrupt requested, stopping it on worker {job_dict["lease_owner"]}.',
+                )
             else:
                 logger.warning(
                     f'Tried to interrupt job {job_id_str}, but it was not found in running tasks.'
@@ -334,10 +365,7 @@ async def interrupt_job(target_id: UUID, job_id: UUID, request: Request):
     # Remove from queue if queued
     elif current_status == JobStatus.QUEUED:
         async with job_queue_lock:
-            global job_queue
-            initial_queue_size = len(job_queue)
-            job_queue = [j for j in job_queue if j.id != job_id]
-            if len(job_queue) < initial_queue_size:
+            if job_queue.remove(job_id) is not None:
                 interrupted = True
                 db.update_job_status(job_id, JobStatus.ERROR)
                 add_job_log(
@@ -418,10 +446,7 @@ async def cancel_job(target_id: UUID, job_id: UUID, request: Request):
     # Only allow cancellation on QUEUED and PENDING states
     if current_status == JobStatus.QUEUED:
         async with job_queue_lock:
-            global job_queue
-            initial_queue_size = len(job_queue)
-            job_queue = [j for j in job_queue if j.id != job_id]
-            if len(job_queue) < initial_queue_size:
+            if job_queue.remove(job_id) is not None:
                 canceled = True
                 db.update_job_status(job_id, JobStatus.CANCELED)
                 add_job_log(job_id_str, 'system', 'Job canceled by user request.')
@@ -489,22 +514,52 @@ async def get_job_logs(target_id: UUID, job_id: UUID, request: Request):
 
     # Get logs, excluding http_exchange logs as they are accessed via separate endpoint
     logs_data = db.list_job_logs(job_id, exclude_http_exchanges=True)
+    # Load the screenshots of tool logs from the blob store for display
+    for log in logs_data:
+        if log.get('log_type') == 'tool_use':
+            log['content'] = rehydrate_images(log['content'])
     # Convert list of dicts to list of JobLogEntry models
     return [JobLogEntry(**log) for log in logs_data]
 
 
+@job_router.get(
+    '/blobs/{blob_key}',
+    include_in_schema=not settings.HIDE_INTERNAL_API_ENDPOINTS_IN_DOC,
+)
+async def get_blob(blob_key: str):
+    """Get a screenshot referenced from job logs or HTTP exchanges.
+
+    Args:
+        blob_key: The SHA-256 hex digest of the blob, i.e. the reference without
+            its 'blob:sha256:' prefix
+    """
+    if not re.fullmatch(r'[0-9a-f]{64}', blob_key):
+        raise HTTPException(status_code=400, detail='Invalid blob key')
+    try:
+        data = load_blob(f'{BLOB_REF_PREFIX}{blob_key}')
+    except KeyError:
+        raise HTTPException(status_code=404, detail='Blob not found') from None
+    return Response(content=data, media_type=guess_image_media_type(data))
+
+
 @job_router.get(
     '/targets/{target_id}/jobs/{job_id}/http_exchanges/',
     response_model=List[HttpExchangeLog],
     include_in_schema=not settings.HIDE_INTERNAL_API_ENDPOINTS_IN_DOC,
 )
-async def get_job_http_exchanges(target_id: UUID, job_id: UUID):
+async def get_job_http_exchanges(
+    target_id: UUID, job_id: UUID, full_bodies: bool = True
+):
     """
     Get HTTP exchange logs for a specific job.
 
+    Request bodies are stored as deltas against the previous exchange of the job.
+
     Args:
         target_id: ID of the target
         job_id: ID of the job
+        full_bodies: Reconstruct the complete request bodies from the deltas,
+            pass false to get the bodies as stored
     """
     # Check if target exists
     if not db.get_target(target_id):
@@ -518,6 +573,8 @@ async def get_job_http_exchanges(target_id: UUID, job_id: UUID):
     # Get the exchanges with trimmed content by default for efficiency,
     # or with full content if specifically requested
     exchange_logs_data = db.list_job_http_exchanges(job_id, use_trimmed=True)
+    if full_bodies:
+        exchange_logs_data = reconstruct_http_exchanges(exchange_logs_data)
 
     # Convert list of dicts to list of HttpExchangeLog models
     # Ensure the content is parsed correctly if stored as JSON string
@@ -606,9 +663,8 @@ async def resolve_job(
             f'No more paused/error jobs for target {target_id}, queue can resume',
         )
 
-        # Process the next job if any
-        asyncio.create_task(process_next_job())
-
+        # Wake the target's lane to process the next job if any
+        await process_next_job(target_id)
 
     return updated_job
 
@@ -625,11 +681,8 @@ async def resync_queue():
         old_queue_size = len(job_queue)
 
     # Count jobs with QUEUED status in the database before resync
-    all_jobs = db.list_jobs(
-        limit=1000
-    )  # Get a larger number to ensure we get all queued jobs
-    db_queued_count_before = sum(
-        1 for job in all_jobs if job.get('status') == JobStatus.QUEUED.value
+    db_queued_count_before = db.count_jobs(
+        filters={'status': JobStatus.QUEUED.value}
     )
 
     # Check if there's an inconsistency
@@ -644,14 +697,11 @@ async def resync_queue():
     # Get updated queue status after resync
     async with job_queue_lock:
         new_queue_size = len(job_queue)
-        is_processor_running = (
-            job_processor_task is not None and not job_processor_task.done()
-        )
+        is_processor_running = is_job_processor_running()
 
     # Count jobs with QUEUED status in the database after resync
-    all_jobs = db.list_jobs(limit=1000)
-    db_queued_count_after = sum(
-        1 for job in all_jobs if job.get('status') == JobStatus.QUEUED.value
+    db_queued_count_after = db.count_jobs(
+        filters={'status': JobStatus.QUEUED.value}
     )
 
     return {
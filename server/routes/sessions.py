@@ -828,5 +828,10 @@ async def update_session_state(session_id: UUID, state: str):
     if state == 'destroying':
         db.update_session(session_id, {'is_archived': True})
 
+    # Wake the target's job lane so queued jobs react to the new state
+    from server.utils.job_execution import notify_target_lane
+
+    notify_target_lane(session['target_id'])
+
     # Return updated session
     return db.get_session(session_id)
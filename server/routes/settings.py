@@ -11,6 +11,7 @@ from server.computer_use.config import (
     APIProvider,
     get_default_model_name,
 )
+from server.computer_use.provider_clients import clear_provider_clients
 from server.settings import settings
 
 
@@ -180,6 +181,9 @@ async def update_provider_settings(request: UpdateProviderRequest):
     # Set as active provider
     settings.API_PROVIDER = provider_enum.value
 
+    # Clients created with the previous credentials are no longer used
+    clear_provider_clients()
+
     return {
         'status': 'success',
         'message': f'Provider {request.provider} configured successfully',
@@ -12,6 +12,7 @@ from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import JSONResponse
 
 from server.computer_use import APIProvider
+from server.computer_use.tools.vnc_client import vnc_pool
 from server.database import db
 from server.routes import api_router, job_router, target_router
 from server.routes.diagnostics import diagnostics_router
@@ -19,7 +20,9 @@ from server.routes.sessions import session_router, websocket_router
 from server.routes.settings import settings_router
 from server.routes.vnc import vnc_router
 from server.utils.auth import get_api_key
+from server.utils.blob_store import collect_garbage, find_blob_keys
 from server.utils.job_execution import job_queue_initializer
+from server.utils.job_log_writer import job_log_writer
 from server.utils.session_monitor import start_session_monitor
 
 from .settings import settings
@@ -267,6 +270,12 @@ app.include_router(vnc_router)
 
 
 
+def collect_unreferenced_blobs():
+    """Delete the blobs not referenced by any job log or message."""
+    referenced_keys = find_blob_keys(db.iter_blob_ref_sources())
+    return collect_garbage(referenced_keys)
+
+
 # Scheduled task to prune old logs
 async def prune_old_logs():
     """Prune logs older than 7 days."""
@@ -287,6 +296,10 @@ async def prune_old_logs():
             days_to_keep = settings.LOG_RETENTION_DAYS
             deleted_count = db.prune_old_logs(days=days_to_keep)
             logger.info(f'Pruned {deleted_count} logs older than {days_to_keep} days')
+
+            # Delete the screenshots no remaining log or message references
+            deleted_blobs = await asyncio.to_thread(collect_unreferenced_blobs)
+            logger.info(f'Deleted {deleted_blobs} unreferenced blobs')
         except Exception as e:
             logger.error(f'Error pruning logs: {str(e)}')
             await asyncio.sleep(3600)  # Sleep for an hour and try again
@@ -306,11 +319,27 @@ async def startup_event():
     # No need to load API definitions on startup anymore
     # They will be loaded on demand when needed
 
+    if (
+        settings.JOB_QUEUE_MODE == 'database'
+        and settings.BLOB_STORE_BACKEND == 'filesystem'
+    ):
+        logger.warning(
+            f'Blobs are stored in {settings.BLOB_STORE_PATH}, make sure all '
+            'replicas share this directory'
+        )
+
     # Initialize job queue from database
     await job_queue_initializer()
     logger.info('Initialized job queue from database')
 
 
+@app.on_event('shutdown')
+async def shutdown_event():
+    """Flush pending job logs and close VNC connections on server shutdown."""
+    job_log_writer.stop()
+    await vnc_pool.close_all()
+
+
 if __name__ == '__main__':
     import uvicorn
 
@@ -39,6 +39,123 @@ class Settings(BaseSettings):
     CONTAINER_ORCHESTRATOR: str = 'docker'  # 'docker' or 'kubernetes'
 
     LOG_RETENTION_DAYS: int = 7
+
+    # Maximum number of jobs executed concurrently across all targets
+    # (each target still runs at most one job at a time)
+    MAX_CONCURRENT_JOBS: int = 10
+
+    # 'memory': queued jobs are scheduled in-process (single replica)
+    # 'database': workers claim jobs from the jobs table with leases (multi-replica)
+    JOB_QUEUE_MODE: str = 'memory'
+    JOB_WORKER_ID: str | None = None  # Defaults to <hostname>-<pid>
+    JOB_LEASE_SECONDS: int = 60
+    JOB_HEARTBEAT_INTERVAL: int = 15
+    JOB_WORKER_POLL_INTERVAL: float = 2.0
+
+    # Job logs are written in batches by a background thread
+    JOB_LOG_QUEUE_SIZE: int = 10000
+    JOB_LOG_BATCH_SIZE: int = 100
+    JOB_LOG_FLUSH_INTERVAL_MS: int = 200
+    # Backpressure on worker threads before a log is dropped (callers on the
+    # event loop never wait)
+    JOB_LOG_ENQUEUE_TIMEOUT: float = 1.0
+
+    # Screenshots are stored once by content hash, logs and messages reference them.
+    # With JOB_QUEUE_MODE='database' every replica must see the same blobs, so
+    # BLOB_STORE_PATH has to be on shared storage (or use a shared backend)
+    BLOB_STORE_BACKEND: str = 'filesystem'
+    BLOB_STORE_PATH: str = 'server/blobs'
+
+    # Upper bound for the in-process cache of recently loaded blobs
+    BLOB_CACHE_MAX_BYTES: int = 16 * 1024 * 1024
+
+    # Upper bound for the sampling loop's in-process message history cache
+    MESSAGE_HISTORY_CACHE_MAX_BYTES: int = 64 * 1024 * 1024
+
+    # Send the API prompt template unchanged and the job's parameter values
+    # after it, so all jobs of an API share a cacheable prompt prefix. Opt-in,
+    # as the model then sees the prompt in a different form
+    PROMPT_STABLE_PREFIX: bool = False
+
+    # With prompt caching, old screenshots are dropped from the history in
+    # chunks of this size, so the cached prefix stays valid in between
+    PROMPT_CACHE_IMAGE_CHUNK_SIZE: int = 4
+
+    # Stream model responses and start the first tool call as soon as its
+    # input is complete, instead of waiting for the whole response
+    MODEL_STREAMING: bool = False
+
+    # Target health is re-probed at most this often before tool calls
+    TARGET_HEALTH_TTL_SECONDS: float = 10.0
+
+    # VNC connections to targets are kept open and reused. Idle connections
+    # are closed after VNC_POOL_IDLE_TTL_SECONDS, the least recently used one
+    # when more than VNC_POOL_MAX_SIZE are open. Idle connections are pinged
+    # every VNC_POOL_KEEPALIVE_INTERVAL seconds (0 disables it), connecting and
+    # pings time out after VNC_CONNECT_TIMEOUT seconds
+    VNC_CONNECT_TIMEOUT: float = 10.0
+    VNC_POOL_IDLE_TTL_SECONDS: float = 300.0
+    VNC_POOL_MAX_SIZE: int = 64
+    VNC_POOL_KEEPALIVE_INTERVAL: float = 30.0
+    # Seconds between the press and release of buttons and keys, and between
+    # repeated clicks and scroll ticks. With 0 every action is sent in a single
+    # write; raise it for applications that miss events arriving all at once
+    VNC_INPUT_EVENT_DELAY: float = 0.0
+    # Before a screenshot, wait at most this many seconds for the VNC server to
+    # send the changes it has not sent yet
+    VNC_SCREENSHOT_REFRESH_TIMEOUT: float = 0.5
+
+    # 'type' texts of at least TYPE_PASTE_MIN_LENGTH characters (0 disables it)
+    # are sent through the clipboard and pasted with TYPE_PASTE_CHORD. If the
+    # screen doesn't change within TYPE_PASTE_VERIFY_TIMEOUT seconds, the model
+    # is told to check whether the text arrived, and texts for the target are
+    # typed for the next TYPE_PASTE_IGNORED_TTL_SECONDS. More than
+    # TYPE_PASTE_VERIFY_MIN_CHANGE (fraction) of the pixels must change, so a
+    # blinking caret doesn't count. Targets can override these with their
+    # text_entry_policy
+    TYPE_PASTE_MIN_LENGTH: int = 0
+    TYPE_PASTE_CHORD: str = 'ctrl+v'
+    TYPE_PASTE_VERIFY_TIMEOUT: float = 2.0
+    TYPE_PASTE_VERIFY_MIN_CHANGE: float = 0.0002
+    TYPE_PASTE_IGNORED_TTL_SECONDS: float = 3600.0
+
+    # Screenshots sent to the model are downscaled to fit this resolution
+    # (0 disables a limit) and encoded as 'png', 'webp' or 'jpeg'. The computer
+    # tool advertises the downscaled size of the target's screen, and the
+    # model's coordinates are scaled back. Targets can override these with
+    # their screenshot_policy
+    SCREENSHOT_MAX_WIDTH: int = 1280
+    SCREENSHOT_MAX_HEIGHT: int = 800
+    SCREENSHOT_FORMAT: str = 'png'
+    SCREENSHOT_QUALITY: int = 80
+    # Quantize PNG/WebP screenshots to this many colors (smaller, but lossy),
+    # 0 keeps full color
+    SCREENSHOT_PALETTE_COLORS: int = 0
+    # Don't send a screenshot again if at most this fraction of its pixels
+    # changed since the previous one sent to the model (small gray level
+    # differences, e.g. encoding noise, are ignored). Small text changes only
+    # touch a few pixels, so keep this at or close to 0
+    SCREENSHOT_SKIP_UNCHANGED: bool = True
+    SCREENSHOT_UNCHANGED_MAX_DIFF: float = 0.0
+
+    # 'adaptive': screenshots, and the wait action after the requested
+    # duration, sample the screen until SCREEN_SETTLE_STABLE_FRAMES consecutive
+    # frames match, at most for SCREEN_SETTLE_TIMEOUT seconds.
+    # 'fixed': screenshots are taken right away and wait sleeps
+    SCREEN_SETTLE_MODE: str = 'adaptive'
+    SCREEN_SETTLE_INTERVAL: float = 0.1
+    SCREEN_SETTLE_STABLE_FRAMES: int = 3
+    SCREEN_SETTLE_TIMEOUT: float = 10.0
+    SCREEN_SETTLE_MAX_DIFF: float = 0.0
+
+    # Record the actions of successful jobs and replay them in later jobs of
+    # the same API version before calling the model. A screen matches its
+    # recording if at most TRAJECTORY_FINGERPRINT_MAX_DISTANCE of the 512
+    # fingerprint bits differ. Replayed actions wait at most
+    # TRAJECTORY_REPLAY_SETTLE_TIMEOUT for the screen to settle (adaptive mode)
+    TRAJECTORY_REPLAY_ENABLED: bool = False
+    TRAJECTORY_FINGERPRINT_MAX_DISTANCE: int = 4
+    TRAJECTORY_REPLAY_SETTLE_TIMEOUT: float = 2.0
     SHOW_DOCS: bool = True
     HIDE_INTERNAL_API_ENDPOINTS_IN_DOC: bool = False
 
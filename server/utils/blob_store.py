@@ -0,0 +1,303 @@
+"""
+Content-addressed blob store for screenshots.
+
+Screenshots are stored once, keyed by the SHA-256 of their bytes, and job logs,
+job messages and HTTP exchange logs only keep a reference string in place of
+the base64 data:
+
+    blob:sha256:<hex digest>
+
+dehydrate_images() replaces base64 image data in a JSON-like structure with
+references, rehydrate_images() puts the base64 data back. Rehydration is done
+lazily, only where the bytes are needed (the sampling loop sending the history
+to the model, the UI showing a screenshot).
+
+The backend is selected with settings.BLOB_STORE_BACKEND. Additional backends
+can be registered with register_blob_store_backend().
+
+Blobs are shared between jobs, so they are not deleted together with the logs
+referencing them: collect_garbage() deletes the blobs no row references
+anymore, after the daily log pruning.
+"""
+
+import base64
+import binascii
+import contextlib
+import copy
+import hashlib
+import json
+import logging
+import os
+import re
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, Iterator, Set, Tuple
+
+from server.settings import settings
+
+logger = logging.getLogger(__name__)
+
+BLOB_REF_PREFIX = 'blob:sha256:'
+BLOB_REF_PATTERN = re.compile(r'blob:sha256:([0-9a-f]{64})')
+
+# Blobs younger than this are never collected: they are stored before the log
+# or message row referencing them is written
+BLOB_GC_MIN_AGE_SECONDS = 24 * 3600
+
+
+class BlobStore:
+    """Interface of a blob store backend."""
+
+    def put(self, key: str, data: bytes) -> None:
+        raise NotImplementedError
+
+    def get(self, key: str) -> bytes:
+        """Return the blob's bytes. Raises KeyError if the blob does not exist."""
+        raise NotImplementedError
+
+    def exists(self, key: str) -> bool:
+        raise NotImplementedError
+
+    def iter_blobs(self) -> Iterator[Tuple[str, float]]:
+        """Yield (key, time the blob was last stored) for every blob."""
+        raise NotImplementedError
+
+    def delete(self, key: str) -> None:
+        raise NotImplementedError
+
+
+class FilesystemBlobStore(BlobStore):
+    """Stores blobs as files in a directory, sharded by the first two hex digits."""
+
+    def __init__(self, root: str):
+        self.root = Path(root)
+
+    def _path(self, key: str) -> Path:
+        return self.root / key[:2] / key
+
+    def put(self, key: str, data: bytes) -> None:
+        path = self._path(key)
+        if path.exists():
+            # Storing an existing blob again protects it from garbage collection
+            os.utime(path)
+            return
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # Write to a temporary file first so readers never see a partial blob
+        fd, tmp_path = tempfile.mkstemp(dir=path.parent)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+    def get(self, key: str) -> bytes:
+        try:
+            return self._path(key).read_bytes()
+        except FileNotFoundError as e:
+            raise KeyError(key) from e
+
+    def exists(self, key: str) -> bool:
+        return self._path(key).exists()
+
+    def iter_blobs(self) -> Iterator[Tuple[str, float]]:
+        for path in self.root.glob('??/*'):
+            # Skip temporary files of writes in progress
+            if len(path.name) != 64:
+                continue
+            try:
+                yield path.name, path.stat().st_mtime
+            except FileNotFoundError:
+                continue
+
+    def delete(self, key: str) -> None:
+        with contextlib.suppress(FileNotFoundError):
+            self._path(key).unlink()
+
+
+BLOB_STORE_BACKENDS: Dict[str, Callable[[], BlobStore]] = {
+    'filesystem': lambda: FilesystemBlobStore(settings.BLOB_STORE_PATH),
+}
+
+_blob_store: BlobStore | None = None
+
+
+def register_blob_store_backend(name: str, factory: Callable[[], BlobStore]):
+    """Make a blob store backend selectable via settings.BLOB_STORE_BACKEND."""
+    BLOB_STORE_BACKENDS[name] = factory
+
+
+def get_blob_store() -> BlobStore:
+    global _blob_store
+    if _blob_store is None:
+        backend = settings.BLOB_STORE_BACKEND
+        if backend not in BLOB_STORE_BACKENDS:
+            raise ValueError(f'Unknown blob store backend: {backend}')
+        _blob_store = BLOB_STORE_BACKENDS[backend]()
+        logger.info(f'Using {backend} blob store')
+    return _blob_store
+
+
+def is_blob_ref(value: Any) -> bool:
+    return isinstance(value, str) and value.startswith(BLOB_REF_PREFIX)
+
+
+def store_base64_image(base64_data: str) -> str:
+    """Store base64 encoded image data and return its blob reference.
+
+    Not cached: putting an existing blob is cheap and marks it as in use for
+    collect_garbage().
+    """
+    data = base64.b64decode(base64_data, validate=True)
+    key = hashlib.sha256(data).hexdigest()
+    get_blob_store().put(key, data)
+    return f'{BLOB_REF_PREFIX}{key}'
+
+
+# Recently loaded blobs, bounded by settings.BLOB_CACHE_MAX_BYTES
+_blob_cache: 'OrderedDict[str, bytes]' = OrderedDict()
+_blob_cache_bytes = 0
+_blob_cache_lock = threading.Lock()
+
+
+def _load_blob(key: str) -> bytes:
+    global _blob_cache_bytes
+    with _blob_cache_lock:
+        data = _blob_cache.get(key)
+        if data is not None:
+            _blob_cache.move_to_end(key)
+            return data
+    data = get_blob_store().get(key)
+    if len(data) > settings.BLOB_CACHE_MAX_BYTES:
+        return data
+    with _blob_cache_lock:
+        if key not in _blob_cache:
+            _blob_cache[key] = data
+            _blob_cache_bytes += len(data)
+        while _blob_cache_bytes > settings.BLOB_CACHE_MAX_BYTES:
+            _, evicted = _blob_cache.popitem(last=False)
+            _blob_cache_bytes -= len(evicted)
+    return data
+
+
+def load_blob(ref: str) -> bytes:
+    """Return the bytes of a blob reference."""
+    return _load_blob(ref[len(BLOB_REF_PREFIX) :])
+
+
+def load_base64_image(ref: str) -> str:
+    """Return the base64 encoded data of a blob reference."""
+    return base64.b64encode(load_blob(ref)).decode('ascii')
+
+
+def find_blob_keys(values: Iterable[Any]) -> Set[str]:
+    """Return the keys of all blob references in the given JSON-like values."""
+    keys = set()
+    for value in values:
+        if value is None:
+            continue
+        text = value if isinstance(value, str) else json.dumps(value)
+        if BLOB_REF_PREFIX in text:
+            keys.update(BLOB_REF_PATTERN.findall(text))
+    return keys
+
+
+def collect_garbage(
+    referenced_keys: Set[str], min_age_seconds: float = BLOB_GC_MIN_AGE_SECONDS
+) -> int:
+    """Delete the blobs not in referenced_keys, return the number deleted.
+
+    referenced_keys must be collected before calling this, blobs stored (or
+    stored again) within the last min_age_seconds are kept regardless.
+    """
+    global _blob_cache_bytes
+    store = get_blob_store()
+    cutoff = time.time() - min_age_seconds
+    deleted = 0
+    for key, stored_at in store.iter_blobs():
+        if key in referenced_keys or stored_at >= cutoff:
+            continue
+        store.delete(key)
+        deleted += 1
+        with _blob_cache_lock:
+            data = _blob_cache.pop(key, None)
+            if data is not None:
+                _blob_cache_bytes -= len(data)
+    return deleted
+
+
+def guess_image_media_type(data: bytes) -> str:
+    """Guess the media type of image bytes from their magic number."""
+    if data.startswith(b'\xff\xd8\xff'):
+        return 'image/jpeg'
+    if data[:4] == b'RIFF' and data[8:12] == b'WEBP':
+        return 'image/webp'
+    return 'image/png'
+
+
+def _store_or_keep(base64_data: Any) -> Any:
+    if not isinstance(base64_data, str) or not base64_data or is_blob_ref(base64_data):
+        return base64_data
+    try:
+        return store_base64_image(base64_data)
+    except (binascii.Error, ValueError):
+        # Not actually base64 data (e.g. already trimmed), keep as is
+        return base64_data
+
+
+def _load_or_keep(ref: Any) -> Any:
+    if not is_blob_ref(ref):
+        return ref
+    try:
+        return load_base64_image(ref)
+    except KeyError:
+        logger.warning(f'Blob {ref} not found in blob store')
+        return ref
+
+
+def _map_images(data: Any, transform: Callable[[Any], Any]) -> Any:
+    """Apply transform to every image payload in a JSON-like structure, in place."""
+    if isinstance(data, dict):
+        if (
+            data.get('type') == 'image'
+            and isinstance(data.get('source'), dict)
+            and data['source'].get('type') == 'base64'
+            and 'data' in data['source']
+        ):
+            data['source']['data'] = transform(data['source']['data'])
+        for key, value in data.items():
+            if key == 'base64_image':
+                data[key] = transform(value)
+            elif isinstance(value, (dict, list)):
+                _map_images(value, transform)
+    elif isinstance(data, list):
+        for item in data:
+            _map_images(item, transform)
+    return data
+
+
+def dehydrate_images(data: Any) -> Any:
+    """Return a copy of data with base64 images replaced by blob references."""
+    return _map_images(copy.deepcopy(data), _store_or_keep)
+
+
+def rehydrate_images(data: Any) -> Any:
+    """Return a copy of data with blob references replaced by base64 images."""
+    return _map_images(copy.deepcopy(data), _load_or_keep)
+
+
+def dehydrate_http_body(body: Any) -> Any:
+    """Replace base64 images in an HTTP body (JSON string or dict) with references."""
+    if isinstance(body, str):
+        try:
+            body_json = json.loads(body)
+        except json.JSONDecodeError:
+            return body
+        return json.dumps(_map_images(body_json, _store_or_keep))
+    if isinstance(body, (dict, list)):
+        return dehydrate_images(body)
+    return body
@@ -5,13 +5,14 @@ Docker container management utilities for session management.
 import asyncio
 import json
 import logging
-import socket
 import subprocess
 import time
 from typing import Dict, Optional, Tuple
 
 import httpx
 
+from server.utils.health_probes import first_successful_probe, http_probe, tcp_probe
+
 logger = logging.getLogger(__name__)
 
 # Port to use for the computer API inside the container
@@ -30,71 +31,53 @@ async def check_vnc_port(host: str, port: int = 5900, timeout: float = 5.0) -> b
     Returns:
         True if port is accessible, False otherwise
     """
-    try:
-        # Create a TCP socket
-        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        sock.settimeout(timeout)
-        
-        # Try to connect
-        result = sock.connect_ex((host, port))
-        sock.close()
-        
-        return result == 0
-    except socket.gaierror:
-        logger.debug(f"Failed to resolve hostname: {host}")
-        return False
-    except Exception as e:
-        logger.debug(f"Socket error checking VNC port on {host}:{port}: {str(e)}")
-        return False
+    return await tcp_probe(host, port, timeout)
 
 
 async def check_target_container_health(container_ip_or_name: str) -> dict:
     """
     Check the health of a target container via VNC port and HTTP endpoints.
 
+    The VNC ports and HTTP endpoints are probed concurrently, the first probe
+    that succeeds decides.
+
     Args:
         container_ip_or_name: The IP address or container name.
-        session_id: The UUID or string ID of the session (optional, for logging).
 
     Returns:
         A dictionary with keys:
           'healthy': bool (True if health check passed, False otherwise)
           'reason': str (Details about the health status or error)
     """
-    # First try VNC port check (primary health indicator)
-    vnc_healthy = await check_vnc_port(container_ip_or_name, 5900, timeout=3.0)
-    if vnc_healthy:
-        logger.info(f'VNC port check passed for target {container_ip_or_name}')
-        return {'healthy': True, 'reason': 'VNC port 5900 is accessible.'}
-    
-    # Try alternative VNC ports that some targets might use
-    alt_vnc_ports = [5901, 5902]
-    for port in alt_vnc_ports:
-        if await check_vnc_port(container_ip_or_name, port, timeout=2.0):
-            logger.info(f'VNC port check passed for target {container_ip_or_name} on port {port}')
-            return {'healthy': True, 'reason': f'VNC port {port} is accessible.'}
-    
-    # Fallback to HTTP health endpoints
+    # VNC port (primary health indicator) and alternative VNC ports that some
+    # targets might use
+    vnc_ports = [(5900, 3.0), (5901, 2.0), (5902, 2.0)]
+    # HTTP health endpoints
     health_urls = [
         f'http://{container_ip_or_name}:6081/api/health',  # Linux target health endpoint
         f'http://{container_ip_or_name}:6080/',  # Wine/Android target noVNC endpoint
         f'http://{container_ip_or_name}:8088/health',  # Legacy endpoint
     ]
-    
+
     async with httpx.AsyncClient(timeout=5.0) as client:
-        for health_url in health_urls:
-            try:
-                health_response = await client.get(health_url)
-                if health_response.status_code == 200:
-                    logger.info(f'HTTP health check passed for target {container_ip_or_name} at {health_url}')
-                    return {'healthy': True, 'reason': 'HTTP health check successful.'}
-            except httpx.TimeoutException:
-                logger.debug(f'HTTP health check timeout for {health_url}')
-                continue
-            except httpx.RequestError as e:
-                logger.debug(f'HTTP health check error for {health_url}: {str(e)}')
-                continue
-    
+        reason = await first_successful_probe(
+            [
+                (
+                    f'VNC port {port} is accessible.',
+                    check_vnc_port(container_ip_or_name, port, timeout=timeout),
+                )
+                for port, timeout in vnc_ports
+            ]
+            + [
+                ('HTTP health check successful.', http_probe(client, health_url))
+                for health_url in health_urls
+            ]
+        )
+
+    if reason:
+        logger.info(f'Health check passed for target {container_ip_or_name}: {reason}')
+        return {'healthy': True, 'reason': reason}
+
     # If all checks failed
     reason = f'Target at {container_ip_or_name} failed VNC port check (5900-5902) and all HTTP health checks'
     logger.warning(f'{reason}')
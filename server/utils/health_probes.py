@@ -0,0 +1,143 @@
+"""
+Non-blocking health probes for target containers.
+
+Probes use asyncio sockets and httpx, so an unreachable target never blocks
+the event loop. first_successful_probe() runs several probes concurrently and
+returns as soon as one succeeds, cancelling the others.
+
+The latency of every completed probe is recorded in a histogram per probe
+(e.g. 'tcp:5900', 'http:6081'), see probe_latency_metrics().
+"""
+
+import asyncio
+import bisect
+import logging
+import time
+from typing import Any, Awaitable, Dict, List, Optional, Tuple
+from urllib.parse import urlsplit
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds of the latency histogram buckets, in milliseconds
+PROBE_LATENCY_BUCKETS_MS = (1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+
+
+class LatencyHistogram:
+    """Fixed-bucket latency histogram with success and failure counts."""
+
+    def __init__(self, buckets_ms=PROBE_LATENCY_BUCKETS_MS):
+        self.buckets_ms = buckets_ms
+        # One extra bucket for latencies above the largest bound
+        self.counts = [0] * (len(buckets_ms) + 1)
+        self.successes = 0
+        self.failures = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+
+    def observe(self, latency_ms: float, success: bool):
+        self.counts[bisect.bisect_left(self.buckets_ms, latency_ms)] += 1
+        if success:
+            self.successes += 1
+        else:
+            self.failures += 1
+        self.total_ms += latency_ms
+        self.max_ms = max(self.max_ms, latency_ms)
+
+    def to_dict(self) -> Dict[str, Any]:
+        count = self.successes + self.failures
+        labels = [f'le_{bound}ms' for bound in self.buckets_ms] + ['inf']
+        return {
+            'count': count,
+            'successes': self.successes,
+            'failures': self.failures,
+            'avg_ms': round(self.total_ms / count, 2) if count else None,
+            'max_ms': round(self.max_ms, 2),
+            'buckets': dict(zip(labels, self.counts, strict=True)),
+        }
+
+
+probe_latency: Dict[str, LatencyHistogram] = {}
+
+
+def _observe(probe: str, started_at: float, success: bool):
+    latency_ms = (time.perf_counter() - started_at) * 1000
+    histogram = probe_latency.get(probe)
+    if histogram is None:
+        histogram = probe_latency[probe] = LatencyHistogram()
+    histogram.observe(latency_ms, success)
+
+
+def probe_latency_metrics() -> Dict[str, Dict[str, Any]]:
+    return {probe: histogram.to_dict() for probe, histogram in probe_latency.items()}
+
+
+async def tcp_probe(host: str, port: int, timeout: float) -> bool:
+    """Return True if a TCP connection to host:port can be opened within timeout."""
+    started_at = time.perf_counter()
+    try:
+        _, writer = await asyncio.wait_for(
+            asyncio.open_connection(host, port), timeout=timeout
+        )
+    except TimeoutError:
+        logger.debug(f'TCP probe of {host}:{port} timed out after {timeout}s')
+        _observe(f'tcp:{port}', started_at, False)
+        return False
+    except OSError as e:
+        logger.debug(f'TCP probe of {host}:{port} failed: {str(e)}')
+        _observe(f'tcp:{port}', started_at, False)
+        return False
+
+    _observe(f'tcp:{port}', started_at, True)
+    writer.close()
+    return True
+
+
+async def http_probe(client: httpx.AsyncClient, url: str) -> bool:
+    """Return True if a GET of url returns 200."""
+    probe = f'http:{urlsplit(url).port or 80}'
+    started_at = time.perf_counter()
+    try:
+        response = await client.get(url)
+    except httpx.TimeoutException:
+        logger.debug(f'HTTP probe of {url} timed out')
+        _observe(probe, started_at, False)
+        return False
+    except httpx.RequestError as e:
+        logger.debug(f'HTTP probe of {url} failed: {str(e)}')
+        _observe(probe, started_at, False)
+        return False
+
+    success = response.status_code == 200
+    _observe(probe, started_at, success)
+    return success
+
+
+async def first_successful_probe(
+    probes: List[Tuple[str, Awaitable[bool]]],
+) -> Optional[str]:
+    """Run probes concurrently and return the name of the first that succeeds.
+
+    The remaining probes are cancelled. If several probes succeed at the same
+    time, the one listed first wins. Returns None if all probes fail.
+    """
+    tasks = {asyncio.ensure_future(probe): name for name, probe in probes}
+    pending = set(tasks)
+    try:
+        while pending:
+            done, pending = await asyncio.wait(
+                pending, return_when=asyncio.FIRST_COMPLETED
+            )
+            for task, name in tasks.items():
+                if (
+                    task in done
+                    and not task.cancelled()
+                    and task.exception() is None
+                    and task.result()
+                ):
+                    return name
+        return None
+    finally:
+        for task in pending:
+            task.cancel()
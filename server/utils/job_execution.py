@@ -9,26 +9,50 @@ Queue Pause Logic:
 - The queue remains paused until all ERROR/PAUSED jobs are resolved.
 - No explicit pause flag is stored in the database; the pause state is inferred
   by checking for jobs in ERROR/PAUSED state.
+
+Scheduling:
+- Every target with queued jobs gets its own lane (an asyncio task) that runs
+  the target's jobs one after another, in queue order.
+- Lanes of different targets run concurrently. The number of jobs executing at
+  the same time is capped by settings.MAX_CONCURRENT_JOBS.
+- Queued jobs live in a JobQueue: one FIFO per target plus an ID index, so
+  enqueue, dequeue, cancel and requeue are O(1). Jobs that were dequeued but
+  could not start are requeued at the head of their target's queue.
+- A lane that cannot make progress (paused queue, session not ready yet) waits
+  on its wakeup event instead of polling. Enqueues, session state changes, job
+  resolve/resume and job completion call notify_target_lane() to wake it.
+- With settings.JOB_QUEUE_MODE set to 'database' there is no in-memory queue
+  and no lanes. Workers on every replica claim jobs from the jobs table with
+  leases instead, see job_worker.py.
 """
 
 import asyncio
-import copy
-import json
 import logging
+import time
 import traceback
-from collections import deque
 from datetime import datetime
-from typing import Any, List
-from uuid import UUID
+from typing import Any, Dict, List
+from uuid import UUID, uuid4
 
 import httpx
 
 # Remove direct import of APIGatewayCore
 from server.database.service import DatabaseService
 from server.models.base import Job, JobStatus
+from server.settings import settings
+
+from .blob_store import dehydrate_http_body, dehydrate_images
+from .job_log_writer import job_log_writer
+from .job_queue import JobQueue
+from .job_utils import compute_request_body_delta
+from .prompt_cache_metrics import record_prompt_cache_usage
 
 # Add import for session management functions
-from .session_management import launch_session_for_target
+from .session_management import (
+    launch_session_for_target,
+    targets_with_pending_sessions,
+    targets_with_pending_sessions_lock,
+)
 
 # Set up logging
 logger = logging.getLogger(__name__)
@@ -38,18 +62,27 @@ db = DatabaseService()
 
 # Constants
 TOKEN_LIMIT = 200000  # Maximum number of tokens (input + output) allowed per job
+# Safety net for waiting lanes in case a state change is not signalled
+LANE_WAKEUP_FALLBACK_TIMEOUT = 30
 
 # Dictionary to store running job tasks
 running_job_tasks = {}
+# IDs of jobs a lane took from the queue and has not finished yet. They are
+# still QUEUED in the database while they wait for a session or a slot
+dispatched_job_ids = set()
 
-# Job queue and lock for ensuring only one job runs at a time
-job_queue = deque()
+# Job queue and the lock protecting it (and the lane registry below)
+job_queue = JobQueue()
 job_queue_lock = asyncio.Lock()
 job_processor_task = None
 
-# Track targets that already have sessions being launched
-targets_with_pending_sessions = set()
-targets_with_pending_sessions_lock = asyncio.Lock()
+# One lane task per target with queued jobs, keyed by target ID string
+target_lanes = {}
+# Wakeup event of each lane, keyed by target ID string
+lane_wakeup_events = {}
+
+# Global cap on the number of jobs executing at the same time
+job_concurrency_semaphore = asyncio.Semaphore(settings.MAX_CONCURRENT_JOBS)
 
 # Add target-specific locks for job status transitions
 target_locks = {}
@@ -60,16 +93,32 @@ async def initialize_job_queue():
     """Load queued jobs from the database into the in-memory queue."""
     logger.info('Initializing job queue from database...')
 
-    # Get all jobs and filter for QUEUED status
-    all_jobs = db.list_jobs(
-        limit=1000, offset=0
-    )  # Get a larger number to ensure we get all queued jobs
+    if settings.JOB_QUEUE_MODE == 'database':
+        # Jobs stay in the database and are claimed by the worker
+        from .job_worker import start_job_worker
+
+        start_job_worker()
+        return
+
+    # Rebuild the paused-target index so lanes can check it without queries
+    paused_target_ids = db.rebuild_paused_target_index()
+    logger.info(f'{len(paused_target_ids)} target queue(s) paused at startup')
+
+    # Stream all QUEUED jobs oldest first, so each target keeps its submission order
+    started_at = time.perf_counter()
     queued_jobs = [
-        job for job in all_jobs if job.get('status') == JobStatus.QUEUED.value
+        Job(**job_dict)
+        for job_dict in db.iter_jobs_by_status(JobStatus.QUEUED.value)
+        # Jobs already handed to a lane are still QUEUED until they start
+        if str(job_dict['id']) not in dispatched_job_ids
+        and str(job_dict['id']) not in running_job_tasks
     ]
+    fetch_seconds = time.perf_counter() - started_at
 
     if not queued_jobs:
-        logger.info('No queued jobs found in the database.')
+        logger.info(
+            f'No queued jobs found in the database ({fetch_seconds * 1000:.1f} ms)'
+        )
         return
 
     # Before loading jobs, clear the existing queue to prevent duplicates
@@ -81,26 +130,15 @@ async def initialize_job_queue():
                 f'Queue inconsistency detected: {queue_size} jobs in memory vs {len(queued_jobs)} in database'
             )
 
-        # Clear the existing queue
+        # Replace the queue contents in one go
         job_queue.clear()
+        job_queue.extend(queued_jobs)
 
-        # Load only jobs that are in QUEUED state - double check current status
-        for job_dict in queued_jobs:
-            # Get the latest job status to ensure it's still QUEUED
-            latest_job = db.get_job(job_dict['id'])
-            if latest_job and latest_job.get('status') == JobStatus.QUEUED.value:
-                job_obj = Job(**job_dict)
-                logger.info(f'Loading queued job {job_obj.id} into memory queue')
-                job_queue.append(job_obj)
-            else:
-                if latest_job:
-                    logger.info(
-                        f'Skipping job {job_dict["id"]}: status is {latest_job.get("status")}, not QUEUED'
-                    )
-                else:
-                    logger.warning(f'Job {job_dict["id"]} not found in database')
-
-        logger.info(f'Loaded {len(job_queue)} jobs into the queue')
+        logger.info(
+            f'Loaded {len(job_queue)} jobs for {len(job_queue.target_ids())} targets '
+            f'into the queue in {(time.perf_counter() - started_at) * 1000:.1f} ms '
+            f'(query: {fetch_seconds * 1000:.1f} ms)'
+        )
 
         # Start the job processor - Only start if we have jobs and no processor is running
         global job_processor_task
@@ -123,89 +161,67 @@ async def initialize_job_queue():
 job_queue_initializer = initialize_job_queue
 
 
-def trim_base64_images(data):
-    """
-    Recursively search and trim base64 image data in content structure.
+def _job_log_data(job_id: str, log_type: str, content: Any) -> Dict[str, Any]:
+    """Build the log row for the log writer."""
+    # Store screenshots once in the blob store and keep only references.
+    # dehydrate_images works on a copy, so the original is not modified
+    if isinstance(content, (dict, list)):
+        content = dehydrate_images(content)
 
-    This function traverses a nested dictionary/list structure and replaces
-    base64 image data with "..." to reduce log size.
-    """
-    if isinstance(data, dict):
-        # Check if this is an image content entry with base64 data
-        if (
-            data.get('type') == 'image'
-            and isinstance(data.get('source'), dict)
-            and data['source'].get('type') == 'base64'
-            and 'data' in data['source']
-        ):
-            # Replace the base64 data with "..."
-            data['source']['data'] = '...'
-        else:
-            # Recursively process all dictionary values
-            for key, value in data.items():
-                data[key] = trim_base64_images(value)
-    elif isinstance(data, list):
-        # Recursively process all list items
-        for i, item in enumerate(data):
-            data[i] = trim_base64_images(item)
+    if log_type == 'http_exchange':
+        # Request and response bodies are JSON strings, replace their images too
+        for part in ('request', 'response'):
+            if part in content and 'body' in content[part]:
+                content[part]['body'] = dehydrate_http_body(content[part]['body'])
 
-    return data
+    return {
+        # Assigned here since the row is only inserted later by the log writer
+        'id': uuid4(),
+        'timestamp': datetime.now(),
+        'job_id': UUID(job_id),
+        'log_type': log_type,
+        'content': content,
+        # With images replaced by references there is nothing left to trim
+        'content_trimmed': content,
+    }
 
 
-def trim_http_body(body):
-    """
-    Process an HTTP body (request or response) to trim base64 image data.
+# Function to add logs to the database
+def add_job_log(job_id: str, log_type: str, content: Any):
+    """Helper function to add a log entry for a job.
+
+    On the event loop the entry is dropped right away if the log queue is
+    full, and images are stored in the blob store on the caller's thread.
+    Coroutines logging screenshots or API exchanges use add_job_log_async.
 
-    Handles both string (JSON) and dictionary body formats.
-    Returns the trimmed body.
+    Returns the ID of the new log entry, or None if it could not be added.
     """
     try:
-        # If body is a string that might be JSON, parse it
-        if isinstance(body, str):
-            try:
-                body_json = json.loads(body)
-                return json.dumps(trim_base64_images(body_json))
-            except json.JSONDecodeError:
-                # Not valid JSON, keep as is or set to empty if too large
-                if len(body) > 1000:
-                    return '<trimmed>'
-                return body
-        elif isinstance(body, dict):
-            return trim_base64_images(body)
-        else:
-            return body
+        log_data = _job_log_data(job_id, log_type, content)
+        # Written in batches by the background log writer
+        if not job_log_writer.submit(log_data):
+            return None
+        return log_data['id']
     except Exception as e:
-        logger.error(f'Error trimming HTTP body: {str(e)}')
-        return '<trim error>'
-
-
-# Function to add logs to the database
-def add_job_log(job_id: str, log_type: str, content: Any):
-    """Helper function to add a log entry for a job."""
-    try:
-        log_data = {'job_id': UUID(job_id), 'log_type': log_type, 'content': content}
-
-        # Create a deep copy of content for HTTP exchanges to avoid modifying the original
-        content_trimmed = (
-            copy.deepcopy(content) if isinstance(content, dict) else content
-        )
-        if log_type == 'http_exchange':
-            # Process request and response bodies to trim base64 image data
-            if 'request' in content_trimmed and 'body' in content_trimmed['request']:
-                content_trimmed['request']['body'] = trim_http_body(
-                    content_trimmed['request']['body']
-                )
+        logger.error(f'Failed to add log for job {job_id}: {str(e)}')
+        return None
 
-            if 'response' in content_trimmed and 'body' in content_trimmed['response']:
-                content_trimmed['response']['body'] = trim_http_body(
-                    content_trimmed['response']['body']
-                )
 
-        log_data['content_trimmed'] = content_trimmed
+async def add_job_log_async(job_id: str, log_type: str, content: Any):
+    """Like add_job_log, but stores images and waits for room in a full log
+    queue without blocking the event loop.
 
-        db.create_job_log(log_data)
+    Returns the ID of the new log entry, or None if it could not be added.
+    """
+    try:
+        # Hashing, copying and writing screenshots to the blob store is blocking
+        log_data = await asyncio.to_thread(_job_log_data, job_id, log_type, content)
+        if not await job_log_writer.submit_async(log_data):
+            return None
+        return log_data['id']
     except Exception as e:
         logger.error(f'Failed to add log for job {job_id}: {str(e)}')
+        return None
 
 
 async def get_target_lock(target_id):
@@ -306,9 +322,8 @@ async def _check_preconditions_and_set_running(
                         f'Requeuing job {job_id_str} as it is in state {current_job_status}'
                     )
 
-                    # Requeue the job
-                    async with job_queue_lock:
-                        job_queue.append(job)
+                    # Requeue the job at the head of its target's queue
+                    await _requeue_job(job)
 
                     # Set the flag to indicate we're requeuing due to conflict
                     requeuing_due_to_conflict = True
@@ -334,11 +349,18 @@ async def _check_preconditions_and_set_running(
 
 
 # Helper function to create the API response callback
-def _create_api_response_callback(job_id_str: str, running_token_total_ref: List[int]):
+def _create_api_response_callback(
+    job_id_str: str, running_token_total_ref: List[int], api_name: str = None
+):
     """Creates the callback function for handling API responses."""
+    # Full messages and log ID of the previous request, request bodies are
+    # stored as deltas against it
+    previous_request = {'messages': None, 'log_id': None}
+    first_request = True
 
-    def api_response_callback(request, response, error):
+    async def api_response_callback(request, response, error):
         nonlocal running_token_total_ref  # Allow modification of the outer scope variable
+        nonlocal first_request
         # Create exchange object with full request and response details
         exchange = {
             'timestamp': datetime.now().isoformat(),
@@ -423,6 +445,12 @@ def _create_api_response_callback(job_id_str: str, running_token_total_ref: List
                             usage = response_data['usage']
                             total_tokens = 0
 
+                            if api_name:
+                                record_prompt_cache_usage(
+                                    api_name, usage, first_request
+                                )
+                            first_request = False
+
                             # Handle regular input/output tokens
                             if 'input_tokens' in usage:
                                 total_tokens += usage['input_tokens']
@@ -441,6 +469,10 @@ def _create_api_response_callback(job_id_str: str, running_token_total_ref: List
                                 exchange['cache_creation_tokens'] = (
                                     cache_creation_tokens
                                 )
+                                # Unweighted count, for the cache hit rate
+                                exchange['cache_creation_input_tokens'] = usage[
+                                    'cache_creation_input_tokens'
+                                ]
 
                             # Handle cache read tokens with 0.1x multiplier
                             if 'cache_read_input_tokens' in usage:
@@ -449,6 +481,9 @@ def _create_api_response_callback(job_id_str: str, running_token_total_ref: List
                                 )
                                 total_tokens += cache_read_tokens
                                 exchange['cache_read_tokens'] = cache_read_tokens
+                                exchange['cache_read_input_tokens'] = usage[
+                                    'cache_read_input_tokens'
+                                ]
 
                             # Update running token total using the reference
                             current_total = running_token_total_ref[0]
@@ -479,8 +514,26 @@ def _create_api_response_callback(job_id_str: str, running_token_total_ref: List
                 'message': str(error),
             }
 
+        # Only store the messages that are new since the previous request
+        body, body_delta, messages = compute_request_body_delta(
+            exchange['request'].get('body'),
+            previous_request['messages'],
+            previous_request['log_id'],
+        )
+        exchange['request']['body'] = body
+        if body_delta:
+            exchange['request']['body_delta'] = body_delta
+
         # Add to job logs
-        add_job_log(job_id_str, 'http_exchange', exchange)
+        log_id = await add_job_log_async(job_id_str, 'http_exchange', exchange)
+        if log_id is None:
+            # Dropped, the next request must not point at a row that was never
+            # written, store its full body instead
+            previous_request['messages'] = None
+            previous_request['log_id'] = None
+        else:
+            previous_request['messages'] = messages
+            previous_request['log_id'] = str(log_id)
 
     return api_response_callback
 
@@ -489,7 +542,7 @@ def _create_api_response_callback(job_id_str: str, running_token_total_ref: List
 def _create_tool_callback(job_id_str: str):
     """Creates the callback function for handling tool usage."""
 
-    def tool_callback(tool_result, tool_id):
+    async def tool_callback(tool_result, tool_id):
         tool_log = {
             'tool_id': tool_id,
             'output': tool_result.output if hasattr(tool_result, 'output') else None,
@@ -505,7 +558,7 @@ def _create_tool_callback(job_id_str: str):
         ):
             tool_log['base64_image'] = tool_result.base64_image
 
-        add_job_log(job_id_str, 'tool_use', tool_log)
+        await add_job_log_async(job_id_str, 'tool_use', tool_log)
 
     return tool_callback
 
@@ -514,8 +567,8 @@ def _create_tool_callback(job_id_str: str):
 def _create_output_callback(job_id_str: str):
     """Creates the callback function for handling message output."""
 
-    def output_callback(content_block):
-        add_job_log(job_id_str, 'message', content_block)
+    async def output_callback(content_block):
+        await add_job_log_async(job_id_str, 'message', content_block)
 
     return output_callback
 
@@ -557,7 +610,7 @@ async def execute_api_in_background(job: Job):
 
         # Create callbacks using helper functions
         api_response_callback = _create_api_response_callback(
-            job_id_str, running_token_total_ref
+            job_id_str, running_token_total_ref, api_name=job.api_name
         )
         tool_callback = _create_tool_callback(job_id_str)
         output_callback = _create_output_callback(job_id_str)
@@ -572,6 +625,9 @@ async def execute_api_in_background(job: Job):
                 session_id=str(job.session_id),
             )
 
+            # Make sure all logs of the run are stored before the job is reported done
+            await asyncio.to_thread(job_log_writer.flush)
+
             # Update job with result and API exchanges
             updated_job = db.update_job(
                 job.id,
@@ -627,6 +683,17 @@ async def execute_api_in_background(job: Job):
             job_with_tokens['total_input_tokens'] = metrics['total_input_tokens']
             job_with_tokens['total_output_tokens'] = metrics['total_output_tokens']
 
+            # Record the prompt cache usage of the job
+            db.update_job(
+                job.id,
+                {
+                    'total_cache_creation_tokens': metrics[
+                        'total_cache_creation_tokens'
+                    ],
+                    'total_cache_read_tokens': metrics['total_cache_read_tokens'],
+                },
+            )
+
 
         except asyncio.CancelledError:
             # Job was cancelled during API execution
@@ -738,9 +805,6 @@ async def execute_api_in_background(job: Job):
         except Exception as e:
             logger.error(f'Error setting completion future in finally: {e}')
 
-        # Process the next job in the queue
-        asyncio.create_task(process_next_job())
-
     except Exception as e:
         error_message = str(e)
         error_traceback = ''.join(
@@ -815,220 +879,324 @@ async def execute_api_in_background(job: Job):
         if job_id_str in running_job_tasks:
             del running_job_tasks[job_id_str]
 
+        # Let the target's lane pick up its next job right away
+        notify_target_lane(job.target_id)
 
-async def process_job_queue():
-    """Process jobs in the queue one at a time."""
-    logger.info('Job queue processor started')
 
-    while True:
-        # Get the next job from the queue
-        current_job = None
-        async with job_queue_lock:
-            if not job_queue:
-                logger.info('Job queue is empty, stopping processor')
-                break
-
-            # Find a job from a target that's not paused
-            for _i, job in enumerate(job_queue):
-                # Check if target's queue is paused (by looking for ERROR or PAUSED jobs)
-                blocking_info = db.is_target_queue_paused(job.target_id)
-                if not blocking_info['is_paused']:
-                    logger.info(
-                        f'Target {job.target_id} queue is not paused: {blocking_info} - processing job {job.id}'
-                    )
-                    current_job = job
-                    job_queue.remove(job)
-                    break
+def is_job_processor_running() -> bool:
+    """Return True if the dispatcher, any target lane or the worker is active."""
+    if job_processor_task is not None and not job_processor_task.done():
+        return True
+    if settings.JOB_QUEUE_MODE == 'database':
+        from .job_worker import is_job_worker_running
 
-            # If all targets' queues with jobs are paused, wait and retry
-            if not current_job and job_queue:
-                logger.info(
-                    'All targets with jobs have paused queues due to ERROR or PAUSED jobs'
-                )
+        return is_job_worker_running()
+    return any(not lane.done() for lane in target_lanes.values())
 
-        # If no job could be processed because all queues are paused, wait and retry
-        if not current_job and job_queue:
-            await asyncio.sleep(5)
-            continue
 
-        if current_job:
-            logger.info(f'Processing job {current_job.id} from queue')
+async def _requeue_job(job: Job):
+    """Put a job that could not start back at the head of its target's queue.
 
-            # Check if job has a session assigned
-            if current_job.session_id:
-                # Check session state before executing the job
-                session = db.get_session(current_job.session_id)
-                if session and session.get('state') != 'ready':
-                    session_state = session.get('state', 'unknown')
-
-                    # Check if session is in a terminal state (destroying or destroyed)
-                    if session_state in ['destroying', 'destroyed']:
-                        # Session is in a terminal state
-                        error_message = f"Cannot execute job: session is in terminal state '{session_state}'"
-                        logger.warning(f'Job {current_job.id}: {error_message}')
-                        add_job_log(str(current_job.id), 'system', error_message)
-
-                        # Instead of failing the job, create a new session and reassign it
-                        logger.info(
-                            f'Creating new session for job {current_job.id} since previous session is in terminal state'
-                        )
-                        add_job_log(
-                            str(current_job.id),
-                            'system',
-                            'Creating new session since previous session is in terminal state',
-                        )
+    In database mode the job simply stays QUEUED in the jobs table and is
+    claimed again once the worker releases its lease.
+    """
+    if settings.JOB_QUEUE_MODE == 'database':
+        return
+    async with job_queue_lock:
+        dispatched_job_ids.discard(str(job.id))
+        job_queue.requeue(job)
 
-                        # Reset the session_id on the job
-                        current_job.session_id = None
-                        db.update_job(current_job.id, {'session_id': None})
 
-                        # Requeue the job so it can go through the session assignment process
-                        async with job_queue_lock:
-                            job_queue.append(current_job)
+def notify_target_lane(target_id):
+    """Wake the lane of a target so it re-evaluates its queue immediately.
+
+    Safe to call for targets without a lane - a target without a lane has no
+    queued jobs, so there is nothing to wake.
+    """
+    event = lane_wakeup_events.get(str(target_id))
+    if event is not None:
+        event.set()
+
+
+async def _wait_for_lane_wakeup(target_id: str):
+    """Block the lane until it is notified (or the fallback timeout expires)."""
+    event = lane_wakeup_events.get(target_id)
+    if event is None:
+        return
+    try:
+        await asyncio.wait_for(event.wait(), timeout=LANE_WAKEUP_FALLBACK_TIMEOUT)
+    except TimeoutError:
+        logger.debug(f'Job lane for target {target_id} woke up after fallback timeout')
+
+
+def _ensure_target_lane(target_id: str):
+    """Start a lane for the target unless one is already running.
+
+    Must be called while holding job_queue_lock.
+    """
+    lane = target_lanes.get(target_id)
+    if lane is not None and not lane.done():
+        return
+    lane_wakeup_events[target_id] = asyncio.Event()
+    target_lanes[target_id] = asyncio.create_task(_process_target_lane(target_id))
+    logger.info(f'Started job lane for target {target_id}')
 
-                        await asyncio.sleep(1)
-                        continue
-                    else:
-                        # Session is not ready but in a non-terminal state, requeue the job
-                        logger.info(
-                            f'Session {current_job.session_id} not ready (state: {session_state}), requeuing job {current_job.id}'
-                        )
-                        add_job_log(
-                            str(current_job.id),
-                            'system',
-                            f'Job waiting for session to be ready (current state: {session_state})',
-                        )
 
-                        async with job_queue_lock:
-                            job_queue.append(current_job)
+def _unregister_target_lane(target_id: str):
+    """Remove the current task's lane registration for the target."""
+    if target_lanes.get(target_id) is asyncio.current_task():
+        del target_lanes[target_id]
+        lane_wakeup_events.pop(target_id, None)
+
+
+async def _ensure_job_session(current_job: Job) -> bool:
+    """
+    Make sure the job has a ready session assigned.
+
+    Returns:
+        bool: True if the job can be executed now. If False, the job has been
+        put back into the queue and the lane should wait for a wakeup.
+    """
+    # Check if job has a session assigned
+    if current_job.session_id:
+        # Check session state before executing the job
+        session = db.get_session(current_job.session_id)
+        if not session or session.get('state') == 'ready':
+            return True
+
+        session_state = session.get('state', 'unknown')
 
-                    # Wait a short time before processing the next job
-                    await asyncio.sleep(1)
-                    continue
+        # Check if session is in a terminal state (destroying or destroyed)
+        if session_state not in ['destroying', 'destroyed']:
+            # Session is not ready but in a non-terminal state, requeue the job
+            logger.info(
+                f'Session {current_job.session_id} not ready (state: {session_state}), requeuing job {current_job.id}'
+            )
+            add_job_log(
+                str(current_job.id),
+                'system',
+                f'Job waiting for session to be ready (current state: {session_state})',
+            )
+
+            await _requeue_job(current_job)
+            return False
+
+        # Session is in a terminal state
+        error_message = (
+            f"Cannot execute job: session is in terminal state '{session_state}'"
+        )
+        logger.warning(f'Job {current_job.id}: {error_message}')
+        add_job_log(str(current_job.id), 'system', error_message)
+
+        # Instead of failing the job, create a new session and reassign it
+        logger.info(
+            f'Creating new session for job {current_job.id} since previous session is in terminal state'
+        )
+        add_job_log(
+            str(current_job.id),
+            'system',
+            'Creating new session since previous session is in terminal state',
+        )
+
+        # Reset the session_id on the job and go through session assignment below
+        current_job.session_id = None
+        db.update_job(current_job.id, {'session_id': None})
+
+    # Job has no session assigned - check if we need to assign one
+    # Get an available session for the target
+    target_id_str = str(
+        current_job.target_id
+    )  # Ensure target_id is a string for UUID conversion and logging
+    target_uuid = UUID(target_id_str)
+    available_session = db.find_ready_session_for_target(target_id=target_uuid)
+
+    if available_session:
+        # Assign the job to this session
+        current_job.session_id = available_session['id']
+        db.update_job(current_job.id, {'session_id': available_session['id']})
+        add_job_log(
+            str(current_job.id),
+            'system',
+            f'Job assigned to session {available_session["id"]}',
+        )
+        return True
+
+    # No session available, check if we should launch a new one
+    launch_new_session = False
+
+    # First check if any session is already initializing in the database
+    db_initializing = db.has_initializing_session_for_target(target_id=target_uuid)
+    if not db_initializing:
+        # No session is initializing in the database, check our in-memory tracking
+        async with targets_with_pending_sessions_lock:
+            if target_id_str not in targets_with_pending_sessions:
+                # No session is being launched for this target yet
+                targets_with_pending_sessions.add(target_id_str)
+                launch_new_session = True
+                logger.info(f'Added target {target_id_str} to pending sessions set.')
             else:
-                # Job has no session assigned - check if we need to assign one
-                # Get an available session for the target
-                target_id_str = str(
-                    current_job.target_id
-                )  # Ensure target_id is a string for UUID conversion and logging
-                target_uuid = UUID(target_id_str)
-                available_session = db.find_ready_session_for_target(
-                    target_id=target_uuid
-                )
+                logger.info(f'Target {target_id_str} already in pending sessions set.')
 
-                if available_session:
-                    # Assign the job to this session
-                    current_job.session_id = available_session['id']
-                    db.update_job(
-                        current_job.id, {'session_id': available_session['id']}
-                    )
-                    add_job_log(
-                        str(current_job.id),
-                        'system',
-                        f'Job assigned to session {available_session["id"]}',
-                    )
-                else:
-                    # No session available, check if we should launch a new one
-                    launch_new_session = False
+    if launch_new_session:
+        # Launch a new session in the background
+        logger.info(
+            f'No available sessions for target {target_id_str}, launching a new one'
+        )
+        add_job_log(
+            str(current_job.id),
+            'system',
+            f'No available sessions for target {target_id_str}, launching a new one',
+        )
+        # Use the imported function
+        asyncio.create_task(launch_session_for_target(target_id_str))
+    else:
+        # A session is already being launched for this target
+        if db_initializing:
+            reason = 'a session is initializing in the database'
+        else:
+            reason = 'a session is being launched'
 
-                    # First check if any session is already initializing in the database                       # target_uuid is already defined above when calling db.find_ready_session_for_target
-                    db_initializing = db.has_initializing_session_for_target(
-                        target_id=target_uuid
-                    )
-                    if not db_initializing:
-                        # No session is initializing in the database, check our in-memory tracking
-                        async with targets_with_pending_sessions_lock:
-                            if target_id_str not in targets_with_pending_sessions:
-                                # No session is being launched for this target yet
-                                targets_with_pending_sessions.add(target_id_str)
-                                launch_new_session = True
-                                logger.info(
-                                    f'Added target {target_id_str} to pending sessions set.'
-                                )  # Added log
-                            else:
-                                logger.info(
-                                    f'Target {target_id_str} already in pending sessions set.'
-                                )  # Added log
-
-                    if launch_new_session:
-                        # Launch a new session in the background
-                        logger.info(
-                            f'No available sessions for target {target_id_str}, launching a new one'
-                        )
-                        add_job_log(
-                            str(current_job.id),
-                            'system',
-                            f'No available sessions for target {target_id_str}, launching a new one',
-                        )
-                        # Use the imported function
-                        asyncio.create_task(launch_session_for_target(target_id_str))
-                    else:
-                        # A session is already being launched for this target
-                        if db_initializing:
-                            reason = 'a session is initializing in the database'
-                        else:
-                            reason = 'a session is being launched'
+        logger.info(
+            f'No available sessions for target {target_id_str}, but {reason}. Requeuing job {current_job.id}'
+        )
+        add_job_log(
+            str(current_job.id),
+            'system',
+            f'No available sessions for target {target_id_str}, waiting for session launch to complete',
+        )
 
-                        logger.info(
-                            f'No available sessions for target {target_id_str}, but {reason}. Requeuing job {current_job.id}'
-                        )
-                        add_job_log(
-                            str(current_job.id),
-                            'system',
-                            f'No available sessions for target {target_id_str}, waiting for session launch to complete',
-                        )
+    # Requeue the job; the lane is woken once the session is ready
+    await _requeue_job(current_job)
+    return False
 
-                    # Requeue the job
-                    async with job_queue_lock:
-                        job_queue.append(current_job)
-                    await asyncio.sleep(5)  # Wait a bit longer before retrying
-                    continue
 
-            # Execute the job
-            task = asyncio.create_task(execute_api_in_background(current_job))
-            running_job_tasks[str(current_job.id)] = task
+async def _run_job(current_job: Job):
+    """Execute a job and wait for it, holding one global concurrency slot."""
+    job_id_str = str(current_job.id)
 
-            # Wait for the job to complete before processing the next one
-            try:
-                await task
-            except Exception as e:
-                logger.error(f'Error executing job {current_job.id}: {str(e)}')
+    async with job_concurrency_semaphore:
+        # The job may have been canceled or interrupted while it waited for a slot
+        latest_job = db.get_job(current_job.id)
+        if not latest_job or latest_job.get('status') != JobStatus.QUEUED.value:
+            logger.info(
+                f'Skipping job {job_id_str}: status changed to '
+                f'{latest_job.get("status") if latest_job else "deleted"} while waiting for a slot'
+            )
+            return
 
+        task = asyncio.create_task(execute_api_in_background(current_job))
+        running_job_tasks[job_id_str] = task
+
+        # Wait for the job to complete before the lane picks the next one
+        try:
+            await task
+        except asyncio.CancelledError:
+            # Propagate if the lane itself is being cancelled
+            if asyncio.current_task().cancelling():
+                raise
+            logger.info(f'Job {job_id_str} was cancelled before it started')
+        except Exception as e:
+            logger.error(f'Error executing job {job_id_str}: {str(e)}')
+        finally:
             # Remove the job from running_job_tasks
-            if str(current_job.id) in running_job_tasks:
-                del running_job_tasks[str(current_job.id)]
+            if job_id_str in running_job_tasks:
+                del running_job_tasks[job_id_str]
 
-    logger.info('Job queue processor stopped')
 
+async def _process_target_lane(target_id: str):
+    """Process the queued jobs of a single target one at a time."""
+    logger.info(f'Job lane for target {target_id} started')
+    wakeup_event = lane_wakeup_events[target_id]
 
-async def process_next_job():
-    """Start processing the next job in the queue if available."""
-    global job_processor_task
+    try:
+        while True:
+            # Get the next job for this target from the queue
+            current_job = None
+            async with job_queue_lock:
+                # Clear before inspecting any state so that notifications sent
+                # from here on are not lost while the lane decides to wait
+                wakeup_event.clear()
+
+                if not job_queue.has_jobs(target_id):
+                    # Unregister while still holding the lock so that a concurrent
+                    # enqueue starts a fresh lane instead of relying on this one
+                    _unregister_target_lane(target_id)
+                    logger.info(f'No queued jobs left for target {target_id}')
+                    break
 
-    # Log the current state of the job processor task
-    processor_status = (
-        'None'
-        if job_processor_task is None
-        else ('Done' if job_processor_task.done() else 'Running')
-    )
-    logger.info(
-        f'process_next_job called - job_processor_task status: {processor_status}, queue size: {len(job_queue)}'
-    )
+                # Check if target's queue is paused (has ERROR or PAUSED jobs)
+                if not db.is_target_paused(target_id):
+                    current_job = job_queue.popleft(target_id)
+                    dispatched_job_ids.add(str(current_job.id))
 
-    async with job_queue_lock:
-        # Only start a new processor if there are jobs in the queue and no active processor task
-        if job_queue and (job_processor_task is None or job_processor_task.done()):
-            # Create a new job processor task before releasing the lock
-            job_processor_task = asyncio.create_task(process_job_queue())
-            logger.info('Started processing next job in queue')
-        else:
-            await asyncio.sleep(60)
-            if not job_queue:
-                logger.info('Not starting job processor - queue is empty')
-            elif job_processor_task is not None and not job_processor_task.done():
+            # If the target's queue is paused, wait until a job is resolved or resumed
+            if current_job is None:
                 logger.info(
-                    'Not starting job processor - existing processor is still running'
+                    f'Target {target_id} queue is paused due to ERROR or PAUSED jobs'
                 )
+                await _wait_for_lane_wakeup(target_id)
+                continue
+
+            logger.info(f'Processing job {current_job.id} from queue')
+
+            try:
+                session_ready = await _ensure_job_session(current_job)
+                if session_ready:
+                    await _run_job(current_job)
+            finally:
+                dispatched_job_ids.discard(str(current_job.id))
+
+            if not session_ready:
+                await _wait_for_lane_wakeup(target_id)
+                continue
+
+            # The job is back in the queue if it could not start because of a
+            # conflicting running job; wait for that job instead of spinning
+            async with job_queue_lock:
+                requeued = current_job.id in job_queue
+            if requeued:
+                await _wait_for_lane_wakeup(target_id)
+    finally:
+        async with job_queue_lock:
+            _unregister_target_lane(target_id)
+        logger.info(f'Job lane for target {target_id} stopped')
+
+
+async def process_job_queue():
+    """Start a lane for every target that has jobs in the queue."""
+    logger.info('Job queue processor started')
+
+    async with job_queue_lock:
+        if not job_queue:
+            logger.info('Job queue is empty, stopping processor')
+        for target_id in job_queue.target_ids():
+            _ensure_target_lane(target_id)
+
+    logger.info('Job queue processor stopped')
+
+
+async def process_next_job(target_id=None):
+    """Wake the lanes of targets with queued jobs, starting any that are missing.
+
+    Args:
+        target_id: Only wake the lane of this target. Wakes all lanes if None.
+    """
+    async with job_queue_lock:
+        if target_id is None:
+            queued_target_ids = job_queue.target_ids()
+        elif job_queue.has_jobs(target_id):
+            queued_target_ids = [str(target_id)]
+        else:
+            queued_target_ids = []
+
+        if not queued_target_ids:
+            logger.info('Not waking any job lane - no queued jobs')
+            return
+
+        for queued_target_id in queued_target_ids:
+            _ensure_target_lane(queued_target_id)
+            notify_target_lane(queued_target_id)
+        logger.info(f'Woke job lanes for targets: {queued_target_ids}')
 
 
 async def enqueue_job(job_obj: Job):
@@ -1057,38 +1225,28 @@ async def enqueue_job(job_obj: Job):
             f'Failed to update job {job_obj.id} status before queueing'
         ) from e
 
+    # In database mode the QUEUED row is the queue entry, a worker will claim it
+    if settings.JOB_QUEUE_MODE == 'database':
+        add_job_log(str(job_obj.id), 'system', 'Job added to queue')
+        logger.info(f'Job {job_obj.id} queued in database for workers to claim')
+        return
+
     # 2. Add to queue and manage processor
     async with job_queue_lock:
-        # Safety check: Avoid adding the same job twice
-        if any(j.id == job_obj.id for j in job_queue):
+        # Add job to the queue, avoiding adding the same job twice
+        if not job_queue.append(job_obj):
             logger.warning(
                 f'Job {job_obj.id} is already in the queue. Skipping addition.'
             )
             return  # Job already enqueued, nothing more to do
-
-        # Add job to the queue
-        job_queue.append(job_obj)
         # Add a standard log entry
         log_message = 'Job added to queue'  # Use the consistent message
         add_job_log(str(job_obj.id), 'system', log_message)
         logger.info(f"Job {job_obj.id} added to queue. Log message: '{log_message}'")
 
-        # Ensure the job processor task is running
-        global job_processor_task
-        processor_status = (
-            'None'
-            if job_processor_task is None
-            else ('Done' if job_processor_task.done() else 'Running')
-        )
+        # Ensure the lane for the job's target is running
         logger.info(
-            f'Enqueued job {job_obj.id} - Processor status: {processor_status}, Queue size: {len(job_queue)}'
+            f'Enqueued job {job_obj.id} - Active lanes: {len(target_lanes)}, Queue size: {len(job_queue)}'
         )
-
-        if job_processor_task is None or job_processor_task.done():
-            logger.info(f'Starting job processor task after enqueuing job {job_obj.id}')
-            job_processor_task = asyncio.create_task(process_job_queue())
-            logger.info('Started job queue processor task.')
-        else:
-            logger.info(
-                f'Job processor task is already running. Queue size: {len(job_queue)}'
-            )
+        _ensure_target_lane(str(job_obj.target_id))
+        notify_target_lane(job_obj.target_id)
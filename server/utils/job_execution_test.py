@@ -0,0 +1,58 @@
+import asyncio
+import json
+from uuid import uuid4
+
+import httpx
+
+from . import job_execution
+from .job_utils import reconstruct_http_exchanges
+
+
+def exchange(messages):
+    request = httpx.Request(
+        'POST',
+        'https://api.example.com/v1/messages',
+        json={'model': 'm', 'messages': messages},
+    )
+    return request, httpx.Response(200, json={'id': 'msg'}, request=request)
+
+
+def test_api_response_callback_does_not_chain_onto_dropped_exchange(monkeypatch):
+    stored = []
+    calls = 0
+
+    async def add_job_log_async(job_id, log_type, content):
+        nonlocal calls
+        calls += 1
+        # The log queue is full for the second exchange
+        if calls == 2:
+            return None
+        log_id = uuid4()
+        stored.append({'id': str(log_id), 'content': content})
+        return log_id
+
+    monkeypatch.setattr(job_execution, 'add_job_log_async', add_job_log_async)
+    callback = job_execution._create_api_response_callback(str(uuid4()), [0])
+
+    history = [{'role': 'user', 'content': f'message {i}'} for i in range(4)]
+
+    async def run():
+        for count in (1, 2, 3, 4):
+            await callback(*exchange(history[:count]), None)
+
+    asyncio.run(run())
+
+    requests = [log['content']['request'] for log in stored]
+    # Full body after the drop, then a delta against it
+    assert 'body_delta' not in requests[0]
+    assert 'body_delta' not in requests[1]
+    assert json.loads(requests[1]['body'])['messages'] == history[:3]
+    assert requests[2]['body_delta'] == {
+        'base_log_id': stored[1]['id'],
+        'base_message_count': 3,
+    }
+
+    reconstructed = reconstruct_http_exchanges(stored)
+    assert not any(e['content'].get('body_incomplete') for e in reconstructed)
+    body = json.loads(reconstructed[2]['content']['request']['body'])
+    assert body['messages'] == history
@@ -0,0 +1,216 @@
+"""
+Background writer for job logs.
+
+add_job_log is called several times per sampling loop iteration, mostly from
+the event loop. Instead of committing every log line on the caller's thread,
+entries are put into a bounded in-memory queue and written by a background
+thread in batches of JOB_LOG_BATCH_SIZE rows, or every
+JOB_LOG_FLUSH_INTERVAL_MS, each batch in a single transaction.
+
+When the queue is full, callers on worker threads block for up to
+JOB_LOG_ENQUEUE_TIMEOUT seconds (backpressure) before the entry is dropped and
+counted. Coroutines get the same backpressure from submit_async, which waits
+in a worker thread, so a slow database slows down the job that logs instead of
+stalling every job. A plain submit on the event loop never blocks, its entry
+is dropped right away.
+"""
+
+import asyncio
+import logging
+import queue
+import threading
+import time
+from typing import Any, Dict, List
+
+from server.database import db
+from server.settings import settings
+
+logger = logging.getLogger(__name__)
+
+
+def _on_event_loop() -> bool:
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return False
+    return True
+
+
+class JobLogWriter:
+    """Batches job log rows and writes them from a background thread."""
+
+    def __init__(
+        self,
+        max_queue_size: int,
+        batch_size: int,
+        flush_interval_ms: int,
+        enqueue_timeout: float,
+    ):
+        self._queue: queue.Queue = queue.Queue(maxsize=max_queue_size)
+        self._batch_size = batch_size
+        self._flush_interval = flush_interval_ms / 1000
+        self._enqueue_timeout = enqueue_timeout
+
+        self._thread: threading.Thread | None = None
+        self._thread_lock = threading.Lock()
+        self._stopping = threading.Event()
+
+        # Number of entries accepted and handled (written or failed), used by flush()
+        self._progress = threading.Condition()
+        self._submitted = 0
+        self._processed = 0
+
+        # Metrics
+        self._written = 0
+        self._failed = 0
+        self._dropped = 0
+        self._batches = 0
+        self._last_flush_ms = 0.0
+        self._max_flush_ms = 0.0
+
+    def _ensure_started(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._thread_lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            if self._stopping.is_set():
+                return
+            self._thread = threading.Thread(
+                target=self._run, name='job-log-writer', daemon=True
+            )
+            self._thread.start()
+
+    def submit(self, log_data: Dict[str, Any]) -> bool:
+        """Queue a log row for writing. Returns False if it had to be dropped."""
+        if self._stopping.is_set():
+            # Shutting down - write directly so nothing is lost
+            db.create_job_log(log_data)
+            return True
+
+        self._ensure_started()
+        with self._progress:
+            self._submitted += 1
+        try:
+            if _on_event_loop():
+                self._queue.put_nowait(log_data)
+            else:
+                self._queue.put(log_data, timeout=self._enqueue_timeout)
+            return True
+        except queue.Full:
+            with self._progress:
+                self._submitted -= 1
+                self._dropped += 1
+            logger.warning(
+                f'Job log queue is full, dropped log for job {log_data.get("job_id")}'
+            )
+            return False
+
+    async def submit_async(self, log_data: Dict[str, Any]) -> bool:
+        """Queue a log row from a coroutine, waiting off the event loop for up
+        to the enqueue timeout while the queue is full. Returns False if it had
+        to be dropped."""
+        return await asyncio.to_thread(self.submit, log_data)
+
+    def flush(self, timeout: float | None = 10.0) -> bool:
+        """Block until every log submitted before the call has been written."""
+        with self._progress:
+            target = self._submitted
+            if self._processed >= target:
+                return True
+            self._ensure_started()
+            return self._progress.wait_for(
+                lambda: self._processed >= target, timeout=timeout
+            )
+
+    def stop(self, timeout: float = 10.0):
+        """Write all queued logs and stop the background thread."""
+        self._stopping.set()
+        thread = self._thread
+        if thread is not None and thread.is_alive():
+            thread.join(timeout=timeout)
+            if thread.is_alive():
+                logger.warning('Job log writer did not finish flushing before timeout')
+                return
+        # Write anything submitted while the thread was exiting
+        remaining = []
+        while True:
+            try:
+                remaining.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        if remaining:
+            self._write_batch(remaining)
+        logger.info(f'Job log writer stopped: {self.metrics()}')
+
+    def metrics(self) -> Dict[str, Any]:
+        return {
+            'queue_depth': self._queue.qsize(),
+            'written': self._written,
+            'failed': self._failed,
+            'dropped': self._dropped,
+            'batches': self._batches,
+            'last_flush_ms': round(self._last_flush_ms, 2),
+            'max_flush_ms': round(self._max_flush_ms, 2),
+        }
+
+    def _next_batch(self) -> List[Dict[str, Any]]:
+        """Wait for the first entry, then collect more until the batch is full
+        or the flush interval has passed."""
+        try:
+            batch = [self._queue.get(timeout=self._flush_interval)]
+        except queue.Empty:
+            return []
+
+        deadline = time.monotonic() + self._flush_interval
+        while len(batch) < self._batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 and not self._stopping.is_set():
+                break
+            try:
+                batch.append(self._queue.get(timeout=max(remaining, 0)))
+            except queue.Empty:
+                break
+        return batch
+
+    def _write_batch(self, batch: List[Dict[str, Any]]):
+        started_at = time.perf_counter()
+        try:
+            db.create_job_logs(batch)
+            self._written += len(batch)
+        except Exception as e:
+            logger.error(f'Failed to write batch of {len(batch)} job logs: {str(e)}')
+            # Retry row by row so one bad entry does not lose the whole batch
+            for log_data in batch:
+                try:
+                    db.create_job_log(log_data)
+                    self._written += 1
+                except Exception as e:
+                    self._failed += 1
+                    logger.error(
+                        f'Failed to add log for job {log_data.get("job_id")}: {str(e)}'
+                    )
+        flush_ms = (time.perf_counter() - started_at) * 1000
+        self._batches += 1
+        self._last_flush_ms = flush_ms
+        self._max_flush_ms = max(self._max_flush_ms, flush_ms)
+
+        with self._progress:
+            self._processed += len(batch)
+            self._progress.notify_all()
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            if batch:
+                self._write_batch(batch)
+            elif self._stopping.is_set():
+                return
+
+
+job_log_writer = JobLogWriter(
+    max_queue_size=settings.JOB_LOG_QUEUE_SIZE,
+    batch_size=settings.JOB_LOG_BATCH_SIZE,
+    flush_interval_ms=settings.JOB_LOG_FLUSH_INTERVAL_MS,
+    enqueue_timeout=settings.JOB_LOG_ENQUEUE_TIMEOUT,
+)
@@ -0,0 +1,62 @@
+import asyncio
+import threading
+
+from .job_log_writer import JobLogWriter
+
+
+def make_writer(enqueue_timeout: float) -> JobLogWriter:
+    writer = JobLogWriter(
+        max_queue_size=1,
+        batch_size=10,
+        flush_interval_ms=10,
+        enqueue_timeout=enqueue_timeout,
+    )
+    # No background thread, entries stay queued until the test takes them
+    writer._ensure_started = lambda: None
+    return writer
+
+
+def test_submit_on_event_loop_drops_when_full():
+    writer = make_writer(enqueue_timeout=5.0)
+
+    async def submit():
+        return writer.submit({'job_id': 'a'}), writer.submit({'job_id': 'b'})
+
+    assert asyncio.run(submit()) == (True, False)
+    assert writer.metrics()['dropped'] == 1
+
+
+def test_submit_async_waits_for_room():
+    writer = make_writer(enqueue_timeout=5.0)
+    writer.submit({'job_id': 'a'})
+    # Room frees up while the second entry waits
+    threading.Timer(0.1, writer._queue.get).start()
+
+    assert asyncio.run(writer.submit_async({'job_id': 'b'})) is True
+    assert writer._queue.get_nowait() == {'job_id': 'b'}
+    assert writer.metrics()['dropped'] == 0
+
+
+def test_submit_async_drops_after_timeout():
+    writer = make_writer(enqueue_timeout=0.05)
+    writer.submit({'job_id': 'a'})
+
+    async def submit():
+        # The event loop keeps running while the entry waits
+        ticks = 0
+
+        async def tick():
+            nonlocal ticks
+            while True:
+                ticks += 1
+                await asyncio.sleep(0.005)
+
+        ticker = asyncio.create_task(tick())
+        result = await writer.submit_async({'job_id': 'b'})
+        ticker.cancel()
+        return result, ticks
+
+    result, ticks = asyncio.run(submit())
+    assert result is False
+    assert ticks > 1
+    assert writer.metrics()['dropped'] == 1
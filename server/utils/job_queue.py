@@ -0,0 +1,136 @@
+"""
+Indexed in-memory job queue.
+
+Jobs are kept in one FIFO sub-queue per target plus an index from job ID to
+target, so enqueue, dequeue, cancel and requeue are all O(1) and each target
+keeps its submission order. Targets with queued jobs are kept in a
+round-robin ready set so that no target can starve the others.
+
+The queue itself is not thread- or task-safe; callers hold job_queue_lock.
+"""
+
+from collections import OrderedDict
+from typing import Dict, Iterator, List, Optional
+
+from server.models.base import Job
+
+
+class JobQueue:
+    """Per-target FIFO job queue with an ID index and a round-robin ready set."""
+
+    def __init__(self):
+        # job_id -> target_id, for O(1) membership checks and removal
+        self._index: Dict[str, str] = {}
+        # target_id -> OrderedDict of job_id -> Job, in submission order
+        self._target_queues: Dict[str, OrderedDict] = {}
+        # Targets with queued jobs, in round-robin order (values unused)
+        self._ready_targets: OrderedDict = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._index)
+
+    def __bool__(self) -> bool:
+        return bool(self._index)
+
+    def __contains__(self, job_id) -> bool:
+        return str(job_id) in self._index
+
+    def __iter__(self) -> Iterator[Job]:
+        """Iterate over all queued jobs, target by target in round-robin order."""
+        for target_id in list(self._ready_targets):
+            yield from list(self._target_queues[target_id].values())
+
+    def append(self, job: Job) -> bool:
+        """Add a job to the tail of its target's queue.
+
+        Returns False if the job is already queued.
+        """
+        return self._add(job, front=False)
+
+    def extend(self, jobs) -> int:
+        """Append jobs in order, skipping duplicates. Returns the number added."""
+        return sum(1 for job in jobs if self._add(job, front=False))
+
+    def requeue(self, job: Job) -> bool:
+        """Put a job back at the head of its target's queue.
+
+        Used for jobs that were dequeued but could not start yet, so they keep
+        their place ahead of jobs submitted after them.
+        """
+        return self._add(job, front=True)
+
+    def _add(self, job: Job, front: bool) -> bool:
+        job_id = str(job.id)
+        if job_id in self._index:
+            return False
+
+        target_id = str(job.target_id)
+        target_queue = self._target_queues.get(target_id)
+        if target_queue is None:
+            target_queue = self._target_queues[target_id] = OrderedDict()
+            self._ready_targets[target_id] = None
+
+        target_queue[job_id] = job
+        if front:
+            target_queue.move_to_end(job_id, last=False)
+        self._index[job_id] = target_id
+        return True
+
+    def peek(self, target_id) -> Optional[Job]:
+        """Return the next job of a target without removing it."""
+        target_queue = self._target_queues.get(str(target_id))
+        if not target_queue:
+            return None
+        return next(iter(target_queue.values()))
+
+    def popleft(self, target_id=None) -> Optional[Job]:
+        """Remove and return the next job.
+
+        Args:
+            target_id: Take the next job of this target. If None, take the next
+                job of the next target in round-robin order.
+        """
+        if target_id is None:
+            if not self._ready_targets:
+                return None
+            target_id = next(iter(self._ready_targets))
+            # Rotate so the next call serves another target first
+            self._ready_targets.move_to_end(target_id)
+
+        target_queue = self._target_queues.get(str(target_id))
+        if not target_queue:
+            return None
+        job_id, job = target_queue.popitem(last=False)
+        self._discard(job_id)
+        return job
+
+    def remove(self, job_id) -> Optional[Job]:
+        """Remove a job by ID, returning it or None if it was not queued."""
+        job_id = str(job_id)
+        target_id = self._index.get(job_id)
+        if target_id is None:
+            return None
+        job = self._target_queues[target_id].pop(job_id)
+        self._discard(job_id)
+        return job
+
+    def _discard(self, job_id: str):
+        target_id = self._index.pop(job_id)
+        if not self._target_queues[target_id]:
+            del self._target_queues[target_id]
+            del self._ready_targets[target_id]
+
+    def clear(self):
+        self._index.clear()
+        self._target_queues.clear()
+        self._ready_targets.clear()
+
+    def target_ids(self) -> List[str]:
+        """Return the targets with queued jobs, in round-robin order."""
+        return list(self._ready_targets)
+
+    def has_jobs(self, target_id) -> bool:
+        return str(target_id) in self._target_queues
+
+    def target_size(self, target_id) -> int:
+        return len(self._target_queues.get(str(target_id), ()))
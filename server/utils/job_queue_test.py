@@ -0,0 +1,41 @@
+from uuid import uuid4
+
+from server.models.base import Job
+
+from .job_queue import JobQueue
+
+
+def make_job(target_id):
+    return Job(id=uuid4(), target_id=target_id, api_name='test', status='queued')
+
+
+def test_per_target_fifo_and_round_robin():
+    target_a, target_b = uuid4(), uuid4()
+    a1, a2, b1 = make_job(target_a), make_job(target_a), make_job(target_b)
+    queue = JobQueue()
+    for job in (a1, a2, b1):
+        assert queue.append(job)
+
+    assert not queue.append(a1)
+    assert len(queue) == 3
+    assert queue.popleft() is a1
+    assert queue.popleft() is b1
+    assert queue.popleft() is a2
+    assert not queue
+
+
+def test_remove_and_requeue_to_front():
+    target_id = uuid4()
+    first, second = make_job(target_id), make_job(target_id)
+    queue = JobQueue()
+    queue.append(first)
+    queue.append(second)
+
+    assert queue.popleft(target_id) is first
+    queue.requeue(first)
+    assert queue.peek(target_id) is first
+
+    assert queue.remove(second.id) is second
+    assert queue.remove(second.id) is None
+    assert second.id not in queue
+    assert queue.target_size(target_id) == 1
@@ -2,8 +2,9 @@
 Utility functions for job-related computations.
 """
 
+import json
 from datetime import datetime, timezone
-from typing import Any, Dict, List
+from typing import Any, Dict, List, Optional
 
 from server.models.base import JobStatus
 
@@ -19,7 +20,9 @@ def compute_job_metrics(
         http_exchanges: Optional list of HTTP exchanges for the job
 
     Returns:
-        Dict containing computed metrics (duration_seconds, total_input_tokens, total_output_tokens)
+        Dict containing computed metrics (duration_seconds, total_input_tokens,
+        total_output_tokens, total_cache_creation_tokens, total_cache_read_tokens,
+        cache_hit_rate)
     """
     # Calculate duration
     created_at = datetime.fromisoformat(str(job['created_at']))
@@ -53,6 +56,10 @@ def compute_job_metrics(
     # Calculate token usage from HTTP exchanges if provided
     total_input = 0
     total_output = 0
+    # Unweighted prompt token counts, for the cache hit rate
+    uncached_input = 0
+    cache_creation = 0
+    cache_read = 0
 
     if http_exchanges:
         for exchange in http_exchanges:
@@ -63,15 +70,117 @@ def compute_job_metrics(
             # Check for token usage directly in the exchange (new format)
             if 'input_tokens' in content:
                 total_input += content['input_tokens']
+                uncached_input += content['input_tokens']
             if 'output_tokens' in content:
                 total_output += content['output_tokens']
             if 'cache_creation_tokens' in content:
                 total_input += content['cache_creation_tokens']
             if 'cache_read_tokens' in content:
                 total_input += content['cache_read_tokens']
+            cache_creation += content.get('cache_creation_input_tokens') or 0
+            cache_read += content.get('cache_read_input_tokens') or 0
+
+    # Share of the prompt tokens read from the cache, None if caching was not used
+    prompt_tokens = uncached_input + cache_creation + cache_read
+    cache_hit_rate = None
+    if prompt_tokens and (cache_creation or cache_read):
+        cache_hit_rate = round(cache_read / prompt_tokens, 4)
 
     return {
         'duration_seconds': duration,
         'total_input_tokens': total_input,
         'total_output_tokens': total_output,
+        'total_cache_creation_tokens': cache_creation,
+        'total_cache_read_tokens': cache_read,
+        'cache_hit_rate': cache_hit_rate,
     }
+
+
+def compute_request_body_delta(
+    body: str, previous_messages: Optional[List[Any]], base_log_id: Optional[str]
+) -> tuple[str, Optional[Dict[str, Any]], Optional[List[Any]]]:
+    """
+    Reduce a model request body to the messages that are new since the previous
+    request of the same job.
+
+    The sampling loop re-sends the whole conversation on every call, so each
+    request mostly repeats the previous one. Only the messages after the prefix
+    shared with the previous request are kept, together with a pointer to the
+    exchange log holding that prefix.
+
+    Args:
+        body: The JSON request body
+        previous_messages: The full messages of the previous request, if any
+        base_log_id: The ID of the exchange log of the previous request
+
+    Returns:
+        tuple: (stored body, delta info or None, full messages of this request)
+    """
+    try:
+        body_json = json.loads(body)
+    except (TypeError, json.JSONDecodeError):
+        return body, None, None
+
+    messages = body_json.get('messages') if isinstance(body_json, dict) else None
+    if not isinstance(messages, list):
+        return body, None, None
+    if not previous_messages or base_log_id is None:
+        return body, None, messages
+
+    # Length of the prefix shared with the previous request
+    shared = 0
+    for previous, current in zip(previous_messages, messages, strict=False):
+        if previous != current:
+            break
+        shared += 1
+    if shared == 0:
+        return body, None, messages
+
+    delta_body = dict(body_json, messages=messages[shared:])
+    delta = {'base_log_id': base_log_id, 'base_message_count': shared}
+    return json.dumps(delta_body), delta, messages
+
+
+def reconstruct_http_exchanges(
+    http_exchanges: List[Dict[str, Any]],
+) -> List[Dict[str, Any]]:
+    """
+    Rebuild the full request bodies of delta-encoded HTTP exchange logs.
+
+    Exchanges must be in chronological order, as every delta refers to an
+    earlier exchange of the same job. Exchanges whose base is missing (e.g.
+    pruned) are returned as stored and flagged with 'body_incomplete'.
+    """
+    full_messages_by_log_id: Dict[str, List[Any]] = {}
+    reconstructed = []
+    for exchange in http_exchanges:
+        content = exchange.get('content') or {}
+        request = content.get('request') or {}
+        delta = request.get('body_delta')
+
+        try:
+            body_json = json.loads(request.get('body', ''))
+        except (TypeError, json.JSONDecodeError):
+            reconstructed.append(exchange)
+            continue
+        messages = body_json.get('messages') if isinstance(body_json, dict) else None
+        if not isinstance(messages, list):
+            reconstructed.append(exchange)
+            continue
+
+        if delta:
+            base_messages = full_messages_by_log_id.get(str(delta['base_log_id']))
+            if base_messages is None:
+                exchange = dict(exchange, content=dict(content, body_incomplete=True))
+                reconstructed.append(exchange)
+                continue
+            messages = base_messages[: delta['base_message_count']] + messages
+            body_json['messages'] = messages
+            request = {k: v for k, v in request.items() if k != 'body_delta'}
+            request['body'] = json.dumps(body_json)
+            exchange = dict(exchange, content=dict(content, request=request))
+
+        full_messages_by_log_id[str(exchange['id'])] = messages
+        reconstructed.append(exchange)
+
+    return reconstructed
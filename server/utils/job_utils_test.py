@@ -0,0 +1,68 @@
+import json
+
+from .job_utils import compute_request_body_delta, reconstruct_http_exchanges
+
+
+def record_exchanges(bodies):
+    """Store request bodies the way the job's API response callback does."""
+    exchanges = []
+    previous_messages, previous_log_id = None, None
+    for index, body in enumerate(bodies):
+        log_id = f'log-{index}'
+        stored_body, body_delta, previous_messages = compute_request_body_delta(
+            json.dumps(body), previous_messages, previous_log_id
+        )
+        request = {'method': 'POST', 'body': stored_body}
+        if body_delta:
+            request['body_delta'] = body_delta
+        exchanges.append({'id': log_id, 'content': {'request': request}})
+        previous_log_id = log_id
+    return exchanges
+
+
+def test_request_body_delta_round_trip():
+    first = {'role': 'user', 'content': 'Open the app'}
+    reply = {'role': 'assistant', 'content': [{'type': 'tool_use', 'id': 't1'}]}
+    result = {'role': 'user', 'content': [{'type': 'tool_result', 'id': 't1'}]}
+    bodies = [
+        {'model': 'm', 'messages': [first]},
+        {'model': 'm', 'messages': [first, reply, result]},
+        # History rewritten (e.g. old screenshots dropped), no shared prefix
+        {'model': 'm', 'messages': [result]},
+        {'model': 'm', 'messages': [result, reply]},
+    ]
+
+    exchanges = record_exchanges(bodies)
+
+    stored = [json.loads(e['content']['request']['body']) for e in exchanges]
+    assert stored[1]['messages'] == [reply, result]
+    assert exchanges[1]['content']['request']['body_delta'] == {
+        'base_log_id': 'log-0',
+        'base_message_count': 1,
+    }
+    assert 'body_delta' not in exchanges[2]['content']['request']
+    assert stored[3]['messages'] == [reply]
+
+    reconstructed = reconstruct_http_exchanges(exchanges)
+    for exchange, body in zip(reconstructed, bodies, strict=True):
+        request = exchange['content']['request']
+        assert json.loads(request['body']) == body
+        assert 'body_delta' not in request
+
+
+def test_reconstruct_flags_missing_base():
+    bodies = [
+        {'messages': [{'role': 'user', 'content': 'a'}]},
+        {
+            'messages': [
+                {'role': 'user', 'content': 'a'},
+                {'role': 'user', 'content': 'b'},
+            ]
+        },
+    ]
+    # The base exchange was pruned
+    exchanges = record_exchanges(bodies)[1:]
+
+    (exchange,) = reconstruct_http_exchanges(exchanges)
+    assert exchange['content']['body_incomplete'] is True
+    assert exchange['content']['request']['body_delta']['base_log_id'] == 'log-0'
@@ -0,0 +1,140 @@
+"""
+Database-backed job worker.
+
+Used instead of the in-memory queue and lanes when settings.JOB_QUEUE_MODE is
+'database', so that several API server replicas can execute jobs:
+
+- Queued jobs stay in the jobs table. Each replica runs one worker that claims
+  the oldest claimable job with an atomic lease (lease_owner/lease_expires_at),
+  see DatabaseService.claim_next_job.
+- Per-target exclusivity is enforced by the claim: a job is not claimable while
+  another job of its target holds a live lease or the target's queue is paused.
+- While a job runs, the worker renews its lease every JOB_HEARTBEAT_INTERVAL
+  seconds. If the lease is lost (revoked by an interrupt on another replica, or
+  expired), the local execution is cancelled.
+- Jobs of a crashed worker are recovered once their lease expires: queued jobs
+  become claimable again, running jobs are moved to ERROR.
+"""
+
+import asyncio
+import logging
+import os
+import socket
+
+from server.models.base import Job, JobStatus
+from server.settings import settings
+
+from .job_execution import (
+    _ensure_job_session,
+    db,
+    execute_api_in_background,
+    job_concurrency_semaphore,
+    running_job_tasks,
+)
+
+logger = logging.getLogger(__name__)
+
+worker_id = settings.JOB_WORKER_ID or f'{socket.gethostname()}-{os.getpid()}'
+job_worker_task = None
+
+
+def is_job_worker_running() -> bool:
+    return job_worker_task is not None and not job_worker_task.done()
+
+
+def start_job_worker():
+    """Start the worker of this replica unless it is already running."""
+    global job_worker_task
+    if is_job_worker_running():
+        logger.info(f'Job worker {worker_id} is already running')
+        return
+    job_worker_task = asyncio.create_task(run_job_worker())
+    logger.info(f'Started job worker {worker_id}')
+
+
+async def run_job_worker():
+    """Claim and execute jobs from the database until cancelled."""
+    while True:
+        try:
+            for job in db.recover_expired_job_leases():
+                logger.warning(
+                    f'Recovered job {job["id"]} of target {job["target_id"]}: lease expired while running'
+                )
+
+            # Only claim a job once there is a free execution slot for it
+            await job_concurrency_semaphore.acquire()
+            try:
+                job_dict = db.claim_next_job(worker_id, settings.JOB_LEASE_SECONDS)
+            except Exception:
+                job_concurrency_semaphore.release()
+                raise
+
+            if not job_dict:
+                job_concurrency_semaphore.release()
+                await asyncio.sleep(settings.JOB_WORKER_POLL_INTERVAL)
+                continue
+
+            logger.info(f'Worker {worker_id} claimed job {job_dict["id"]}')
+            asyncio.create_task(_run_leased_job(Job(**job_dict)))
+        except asyncio.CancelledError:
+            logger.info(f'Job worker {worker_id} stopped')
+            raise
+        except Exception as e:
+            logger.error(f'Error in job worker {worker_id}: {str(e)}', exc_info=True)
+            await asyncio.sleep(settings.JOB_WORKER_POLL_INTERVAL)
+
+
+async def _heartbeat(job_id, task: asyncio.Task):
+    """Renew the lease of a running job, cancelling it if the lease is lost."""
+    while not task.done():
+        await asyncio.sleep(settings.JOB_HEARTBEAT_INTERVAL)
+        try:
+            renewed = db.renew_job_lease(job_id, worker_id, settings.JOB_LEASE_SECONDS)
+        except Exception as e:
+            # Keep running, the lease only expires after JOB_LEASE_SECONDS
+            logger.error(f'Failed to renew lease of job {job_id}: {str(e)}')
+            continue
+        if not renewed:
+            logger.warning(f'Worker {worker_id} lost the lease of job {job_id}')
+            task.cancel()
+            return
+
+
+async def _run_leased_job(job: Job):
+    """Execute a leased job, then release the lease and the execution slot."""
+    job_id_str = str(job.id)
+    heartbeat_task = None
+    release_lease = True
+    try:
+        # The job may have been canceled or interrupted since it was claimed
+        latest_job = db.get_job(job.id)
+        if not latest_job or latest_job.get('status') != JobStatus.QUEUED.value:
+            logger.info(f'Skipping claimed job {job_id_str}: no longer queued')
+            return
+
+        # Without a ready session the job stays QUEUED and is claimed again later.
+        # Keep the lease for one poll interval so it is not re-claimed right away
+        if not await _ensure_job_session(job):
+            release_lease = False
+            db.renew_job_lease(job.id, worker_id, settings.JOB_WORKER_POLL_INTERVAL)
+            return
+
+        task = asyncio.create_task(execute_api_in_background(job))
+        running_job_tasks[job_id_str] = task
+        heartbeat_task = asyncio.create_task(_heartbeat(job.id, task))
+        try:
+            await task
+        except asyncio.CancelledError:
+            logger.info(f'Job {job_id_str} was cancelled')
+    except Exception as e:
+        logger.error(f'Error executing job {job_id_str}: {str(e)}')
+    finally:
+        if heartbeat_task is not None:
+            heartbeat_task.cancel()
+        running_job_tasks.pop(job_id_str, None)
+        try:
+            if release_lease:
+                db.release_job_lease(job.id, worker_id)
+        except Exception as e:
+            logger.error(f'Failed to release lease of job {job_id_str}: {str(e)}')
+        job_concurrency_semaphore.release()
@@ -0,0 +1,70 @@
+"""
+Prompt cache usage per API.
+
+Updated with the token usage of every model response (see job_execution), so
+the cache hit rate of each API can be measured. The first request of a job
+run is tracked separately: with a stable prompt prefix, back-to-back jobs of
+the same API should read most of it from the cache.
+"""
+
+from typing import Any, Dict, Optional
+
+# api_name -> token counters
+_usage: Dict[str, Dict[str, int]] = {}
+
+
+def record_prompt_cache_usage(
+    api_name: str, usage: Dict[str, Any], first_request: bool
+):
+    """Add the usage of a model response of a job of api_name."""
+    stats = _usage.get(api_name)
+    if stats is None:
+        stats = _usage[api_name] = {
+            'requests': 0,
+            'input_tokens': 0,
+            'cache_creation_input_tokens': 0,
+            'cache_read_input_tokens': 0,
+            'first_requests': 0,
+            'first_request_prompt_tokens': 0,
+            'first_request_cache_read_tokens': 0,
+        }
+
+    input_tokens = usage.get('input_tokens') or 0
+    cache_creation = usage.get('cache_creation_input_tokens') or 0
+    cache_read = usage.get('cache_read_input_tokens') or 0
+    stats['requests'] += 1
+    stats['input_tokens'] += input_tokens
+    stats['cache_creation_input_tokens'] += cache_creation
+    stats['cache_read_input_tokens'] += cache_read
+    if first_request:
+        stats['first_requests'] += 1
+        stats['first_request_prompt_tokens'] += (
+            input_tokens + cache_creation + cache_read
+        )
+        stats['first_request_cache_read_tokens'] += cache_read
+
+
+def _hit_rate(cache_read: int, prompt_tokens: int) -> Optional[float]:
+    return round(cache_read / prompt_tokens, 4) if prompt_tokens else None
+
+
+def prompt_cache_metrics() -> Dict[str, Dict[str, Any]]:
+    """Return the token counters and cache hit rates per API."""
+    metrics = {}
+    for api_name, stats in _usage.items():
+        prompt_tokens = (
+            stats['input_tokens']
+            + stats['cache_creation_input_tokens']
+            + stats['cache_read_input_tokens']
+        )
+        metrics[api_name] = {
+            **stats,
+            'cache_hit_rate': _hit_rate(
+                stats['cache_read_input_tokens'], prompt_tokens
+            ),
+            'first_request_cache_hit_rate': _hit_rate(
+                stats['first_request_cache_read_tokens'],
+                stats['first_request_prompt_tokens'],
+            ),
+        }
+    return metrics
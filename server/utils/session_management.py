@@ -75,3 +75,8 @@ async def launch_session_for_target(target_id: str) -> Optional[Dict[str, Any]]:
                 logger.info(
                     f'Removed target {target_id} from pending sessions (in launch_session_for_target finally block)'
                 )
+
+        # Wake the target's job lane so it picks up the new session (or retries)
+        from server.utils.job_execution import notify_target_lane
+
+        notify_target_lane(target_id)
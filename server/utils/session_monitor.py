@@ -13,7 +13,9 @@ from server.database import db
 from server.utils.docker_manager import (
     check_target_container_health,
 )
+from server.utils.job_execution import notify_target_lane
 from server.utils.orchestrator_utils import get_container_status
+from server.utils.target_health import record_target_health
 
 logger = logging.getLogger(__name__)
 
@@ -144,6 +146,7 @@ async def monitor_session_states():
                     db.update_session(
                         session_id, {'state': 'destroyed', 'is_archived': True}
                     )
+                    notify_target_lane(session.get('target_id'))
                     # Clean up tracking and continue to next session
                     if session_id in last_checked:
                         del last_checked[session_id]
@@ -170,11 +173,15 @@ async def monitor_session_states():
                                 target_host = service_mapping[target_type]
                     
                     health_status = await check_target_container_health(target_host)
+                    record_target_health(
+                        target_host, health_status['healthy'], health_status['reason']
+                    )
                     if health_status['healthy']:
                         logger.info(
                             f"API for session {session_id} is ready, updating state to 'ready'"
                         )
                         db.update_session(session_id, {'state': 'ready'})
+                        notify_target_lane(session.get('target_id'))
 
             # Clean up last_checked for sessions that no longer exist
             session_ids = {session.get('id') for session in sessions}
@@ -0,0 +1,84 @@
+"""
+Cached health state of target containers.
+
+The sampling loop checks the target's health before every tool call. A full
+check_target_container_health probe costs several network round trips, so
+the last result per target host is kept and reused for
+TARGET_HEALTH_TTL_SECONDS:
+
+- A fresh state is answered from the cache.
+- A stale healthy state is still answered from the cache, and refreshed by a
+  probe in the background.
+- A missing or unhealthy state is probed before answering. Concurrent callers
+  share a single probe.
+
+The state is also updated passively: VNC actions that succeed mark the host
+healthy, VNC connection errors invalidate its state so the next check probes.
+"""
+
+import asyncio
+import logging
+import time
+from typing import Dict
+
+from server.settings import settings
+from server.utils.docker_manager import check_target_container_health
+
+logger = logging.getLogger(__name__)
+
+# host -> {'healthy': bool, 'reason': str, 'checked_at': monotonic time}
+_health_states: Dict[str, dict] = {}
+_probe_tasks: Dict[str, asyncio.Task] = {}
+
+
+def record_target_health(host: str, healthy: bool, reason: str):
+    """Store the health of a host as observed by a probe or a VNC action."""
+    _health_states[host] = {
+        'healthy': healthy,
+        'reason': reason,
+        'checked_at': time.monotonic(),
+    }
+
+
+def invalidate_target_health(host: str):
+    """Forget the health of a host, so the next check probes it."""
+    if _health_states.pop(host, None) is not None:
+        logger.info(f'Invalidated cached health of target {host}')
+
+
+async def _probe(host: str) -> dict:
+    try:
+        health_status = await check_target_container_health(host)
+    except Exception as e:
+        health_status = {'healthy': False, 'reason': f'Health check failed: {str(e)}'}
+    record_target_health(host, health_status['healthy'], health_status['reason'])
+    return health_status
+
+
+def _start_probe(host: str) -> asyncio.Task:
+    task = _probe_tasks.get(host)
+    if task is None or task.done():
+        task = asyncio.create_task(_probe(host))
+        _probe_tasks[host] = task
+        task.add_done_callback(lambda _: _probe_tasks.pop(host, None))
+    return task
+
+
+async def get_target_health(host: str) -> dict:
+    """Return the health of a target host, probing only when needed.
+
+    Returns:
+        A dictionary with keys 'healthy' (bool) and 'reason' (str), like
+        check_target_container_health
+    """
+    state = _health_states.get(host)
+    if state is not None:
+        age = time.monotonic() - state['checked_at']
+        if age < settings.TARGET_HEALTH_TTL_SECONDS:
+            return {'healthy': state['healthy'], 'reason': state['reason']}
+        if state['healthy']:
+            _start_probe(host)
+            return {'healthy': True, 'reason': state['reason']}
+
+    # Shield the shared probe from cancellation of a single caller
+    return dict(await asyncio.shield(_start_probe(host)))